@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark creazione albero cartelle WebDAV: MKCOL sequenziali vs provision_folder_tree
+
+Avvia un server WebDAV fittizio locale in un processo separato (MKCOL con
+latenza simulata, 409 senza cartella padre, 405 se già esistente, alcuni
+429 iniettati) e misura il tempo per creare l'albero.
+
+La versione precedente di create_folder_structure attendeva inoltre 2 s
+prima di ogni MKCOL (10 s dopo un 429): quella pausa fissa è riportata
+come stima, non eseguita.
+
+Uso:
+    python bench_folders.py [--folders 50] [--latency-ms 20] [--throttle 2]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add project directory to Python path
+sys.path.insert(0, os.path.dirname(__file__))
+
+# Pausa fissa per MKCOL della versione precedente (secondi)
+PREVIOUS_DELAY = 2
+
+
+class _MkcolServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, throttle: int, retry_after: int):
+        super().__init__(("127.0.0.1", 0), _MkcolHandler)
+        self.latency = latency
+        self.throttle_total = throttle
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.folders = set()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class _MkcolHandler(BaseHTTPRequestHandler):
+    """Stand-in WebDAV: solo MKCOL, stato in memoria"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, headers=None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_MKCOL(self):
+        server = self.server
+        time.sleep(server.latency)
+        path = self.path.rstrip("/")
+        with server.lock:
+            server.requests += 1
+            # 429 a metà albero, come un server sotto carico
+            if server.throttle and server.requests >= 10:
+                server.throttle -= 1
+                headers = {"Retry-After": str(server.retry_after)} if server.retry_after else {}
+                return self._reply(429, headers)
+            if path in server.folders:
+                return self._reply(405)
+            parent = path.rsplit("/", 1)[0]
+            if parent.count("/") > 4 and parent not in server.folders:
+                return self._reply(409)
+            server.folders.add(path)
+        self._reply(201)
+
+    def do_DELETE(self):
+        with self.server.lock:
+            self.server.folders.clear()
+            self.server.requests = 0
+            self.server.throttle = self.server.throttle_total
+        self._reply(204)
+
+
+def _serve(port_queue, latency: float, throttle: int, retry_after: int) -> None:
+    server = _MkcolServer(latency, throttle, retry_after)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _folder_tree(count: int) -> list:
+    """Albero tipo create_folder_structure: public/<dominio> con sottocartelle"""
+    folders = ["public", "logs", "backup"]
+    domain = 0
+    while len(folders) < count:
+        folders.append(f"public/site{domain}.example.com")
+        for sub in ("www", "logs"):
+            if len(folders) < count:
+                folders.append(f"public/site{domain}.example.com/{sub}")
+        domain += 1
+    return folders
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark creazione albero cartelle WebDAV")
+    parser.add_argument("--folders", type=int, default=50, help="Cartelle da creare")
+    parser.add_argument("--latency-ms", type=int, default=20, help="Latenza simulata per MKCOL (ms)")
+    parser.add_argument("--throttle", type=int, default=2, help="Risposte 429 iniettate")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After dei 429 (secondi, 0 = assente)")
+    parser.add_argument("--workers", type=int, default=8, help="MKCOL contemporanei per livello")
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=_serve, args=(port_queue, args.latency_ms / 1000, args.throttle, args.retry_after), daemon=True
+    )
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get()}"
+    # Rate limiter condiviso con stato nuovo: nessun rate appreso da run precedenti
+    os.environ.update(NC_BASE_URL=base_url, NC_ADMIN_USER="bench", NC_ADMIN_PASS="bench",
+                      NC_RATELIMIT_DIR=tempfile.mkdtemp(prefix="ncwrap-bench-"))
+
+    import requests
+    from ncwrap.api import provision_folder_tree
+
+    folders = _folder_tree(args.folders)
+    root = f"{base_url}/remote.php/dav/files/bench"
+
+    def sequential():
+        session = requests.Session()
+        for folder in folders:
+            while session.request("MKCOL", f"{root}/{folder}").status_code == 429:
+                time.sleep(args.retry_after)
+
+    def parallel():
+        results = provision_folder_tree("bench", "bench", folders, max_workers=args.workers)
+        failed = [folder for folder, status in results.items() if status not in (201, 405)]
+        if failed:
+            raise RuntimeError(f"cartelle non create: {failed}")
+
+    print(f"📁 {len(folders)} cartelle, latenza {args.latency_ms} ms, {args.throttle} risposte 429, "
+          f"server locale {base_url}")
+    for label, func in (("MKCOL sequenziali", sequential), ("provision_folder_tree", parallel)):
+        requests.request("DELETE", root)
+        started = time.perf_counter()
+        func()
+        print(f"{label:<24} {time.perf_counter() - started:>7.2f} s")
+    print(f"{'pausa fissa precedente':<24} {len(folders) * PREVIOUS_DELAY:>7.2f} s (stima, non eseguita)")
+
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark upload WebDAV: file object (implementazione precedente) vs FileBody
+
+Avvia un server WebDAV fittizio locale in un processo separato (accetta PUT
+e scarta il corpo) e misura MB/s e CPU% del processo client.
+
+Uso:
+    python bench_upload.py [--size-mb 512] [--runs 3]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add project directory to Python path
+sys.path.insert(0, os.path.dirname(__file__))
+
+
+class _PutSink(BaseHTTPRequestHandler):
+    """Stand-in WebDAV: legge il corpo (Content-Length o chunked) e risponde 201"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _drain(self, remaining: int, buffer: memoryview) -> None:
+        while remaining > 0:
+            read = self.rfile.readinto(buffer[:min(len(buffer), remaining)])
+            if not read:
+                break
+            remaining -= read
+
+    def do_PUT(self):
+        buffer = memoryview(bytearray(1024 * 1024))
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                self._drain(size, buffer)
+                self.rfile.readline()
+                if size == 0:
+                    break
+            mode = "chunked"
+        else:
+            self._drain(int(self.headers.get("Content-Length", 0)), buffer)
+            mode = "content-length"
+        self.send_response(201)
+        self.send_header("X-Body-Mode", mode)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def _serve(port_queue) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PutSink)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _measure(label: str, func, size: int, runs: int) -> None:
+    best = None
+    for _ in range(runs):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        mode = func()
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        if best is None or wall < best[0]:
+            best = (wall, cpu, mode)
+    wall, cpu, mode = best
+    print(f"{label:<28} {size / wall / 1024 / 1024:>9.1f} MB/s   CPU {cpu / wall * 100:>5.1f}%   ({mode})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upload WebDAV")
+    parser.add_argument("--size-mb", type=int, default=512, help="Dimensione file di test (MiB)")
+    parser.add_argument("--runs", type=int, default=3, help="Ripetizioni (si riporta la migliore)")
+    args = parser.parse_args()
+
+    import requests
+    from ncwrap.transfer import FileBody
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(port_queue,), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port_queue.get()}/remote.php/dav/files/bench/file.bin"
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(prefix="ncwrap-bench-") as tmp:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            tmp.write(block)
+        tmp.flush()
+
+        session = requests.Session()
+
+        def file_object():
+            with open(tmp.name, "rb") as f:
+                response = session.put(url, data=f)
+            return response.headers.get("X-Body-Mode")
+
+        def file_body():
+            response = session.put(url, data=FileBody(tmp.name))
+            return response.headers.get("X-Body-Mode")
+
+        print(f"📦 File {args.size_mb} MiB, {args.runs} run, server locale {url.split('/remote')[0]}")
+        _measure("file object (precedente)", file_object, size, args.runs)
+        _measure("FileBody (preadv+buffer)", file_body, size, args.runs)
+
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
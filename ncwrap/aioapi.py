@@ -0,0 +1,394 @@
+"""
+API Nextcloud asincrona - OCS e WebDAV su asyncio
+
+Stessa superficie di api.py (utenti, MKCOL, PROPFIND, PUT, GET, share) ma su
+aiohttp, con concorrenza limitata da semaforo: un solo processo può pilotare
+migliaia di operazioni contemporanee senza thread.
+
+Richiede la dipendenza opzionale aiohttp:
+    pip install nextcloud-wrapper[async]
+"""
+import asyncio
+import os
+import random
+from urllib.parse import quote
+from typing import Dict, Iterable, List, Optional, Tuple
+from xml.etree.ElementTree import ParseError
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    aiohttp = None
+
+from .api import (
+    get_nc_config,
+    nc_headers,
+    ocs_users_url,
+    ocs_shares_url,
+    dav_files_url,
+    parse_user_info,
+    parse_share_url,
+    share_type_code,
+    parse_user_exists,
+    cached_user_exists,
+    cache_user_exists,
+    invalidate_user_cache,
+    USERS_PAGE_SIZE,
+)
+from .davxml import iter_ocs_elements
+from .ratelimit import get_limiter, parse_retry_after
+from .utils import env_int
+
+# Operazioni HTTP contemporanee per client
+DEFAULT_CONCURRENCY = 64
+# Status per cui ritentare (oltre a 429)
+RETRY_STATUS = (502, 503, 504)
+
+
+class AioResponse:
+    """Risposta già letta (status, header, corpo) - interfaccia simile a requests"""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], text: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise AioHTTPError(self.status_code, self.text[:200])
+
+
+class AioHTTPError(Exception):
+    """Errore HTTP da risposta asincrona"""
+
+    def __init__(self, status_code: int, message: str = ""):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+
+class AsyncNextcloudClient:
+    """
+    Client asincrono Nextcloud con pool aiohttp e concorrenza limitata
+
+    Uso:
+        async with AsyncNextcloudClient() as nc:
+            await asyncio.gather(*(nc.create_webdav_folder(p, u, pw) for p in paths))
+    """
+
+    def __init__(self, base_url: Optional[str] = None, admin_user: Optional[str] = None,
+                 admin_pass: Optional[str] = None, concurrency: Optional[int] = None,
+                 pool_size: Optional[int] = None, timeout: float = 30.0):
+        if aiohttp is None:
+            raise RuntimeError(
+                "aiohttp non installato - usa: pip install nextcloud-wrapper[async]"
+            )
+
+        if not all([base_url, admin_user, admin_pass]):
+            cfg_url, cfg_user, cfg_pass = get_nc_config()
+            base_url = base_url or cfg_url
+            admin_user = admin_user or cfg_user
+            admin_pass = admin_pass or cfg_pass
+
+        self.base_url = base_url.rstrip("/")
+        self.admin_auth = (admin_user, admin_pass)
+        self.concurrency = concurrency or env_int("NC_AIO_CONCURRENCY", DEFAULT_CONCURRENCY)
+        self.pool_size = pool_size or env_int("NC_HTTP_POOL_SIZE", 32)
+        self.timeout = timeout
+        # Creato in open(), dentro il loop in esecuzione: su Python 3.8/3.9
+        # un Semaphore si lega al loop corrente al momento della costruzione
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._limiter = get_limiter(self.base_url)
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    async def __aenter__(self) -> "AsyncNextcloudClient":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        """Apre la ClientSession (pool keep-alive)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar(),
+                # Nessun limite totale: PUT/GET di file grandi durano più di
+                # self.timeout; si limitano connessione e pause tra le letture
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout,
+                                              sock_read=self.timeout),
+            )
+
+    async def close(self) -> None:
+        """Chiude la ClientSession"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._semaphore = None
+
+    async def _acquire_token(self) -> None:
+        """Attende un token dal limiter condiviso senza bloccare il loop"""
+        if self._limiter is None:
+            return
+        while True:
+            wait = self._limiter.reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _auth(auth: Optional[Tuple[str, str]]):
+        return aiohttp.BasicAuth(auth[0], auth[1]) if auth else None
+
+    async def request(self, method: str, url: str, auth: Optional[Tuple[str, str]] = None,
+                      max_retries: int = 3, delay_base: float = 2.0,
+                      read_body: bool = True, **kwargs) -> AioResponse:
+        """
+        Richiesta HTTP con retry asincrono per 429/5xx/errori di rete
+
+        I 429 aggiornano il rate limiter condiviso dell'host (stesso stato
+        dei client sincroni e degli altri processi).
+
+        Args:
+            method: Metodo HTTP
+            url: URL completo
+            auth: Tupla (user, password)
+            max_retries: Numero massimo retry
+            delay_base: Delay base in secondi
+            read_body: Se leggere il corpo della risposta
+            **kwargs: Parametri aggiuntivi per aiohttp (headers, data, ...)
+
+        Returns:
+            AioResponse
+        """
+        await self.open()
+        last_exception: Optional[BaseException] = None
+
+        for attempt in range(max_retries + 1):
+            try:
+                await self._acquire_token()
+                async with self._semaphore:
+                    async with self._session.request(method, url, auth=self._auth(auth), **kwargs) as resp:
+                        text = await resp.text(errors="replace") if read_body else ""
+                        response = AioResponse(resp.status, dict(resp.headers), text)
+
+                if response.status_code == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if self._limiter is not None:
+                        self._limiter.on_throttle(retry_after)
+                    if attempt < max_retries:
+                        if self._limiter is None:
+                            delay = delay_base * (2 ** attempt)
+                            await asyncio.sleep(max(delay, retry_after or 0) + random.uniform(0.1, 0.3) * delay)
+                        continue
+                elif self._limiter is not None:
+                    self._limiter.on_success()
+
+                if response.status_code in RETRY_STATUS and attempt < max_retries:
+                    await asyncio.sleep(delay_base * (1.5 ** attempt))
+                    continue
+
+                return response
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_exception = e
+                if attempt < max_retries:
+                    await asyncio.sleep(delay_base * (1.5 ** attempt))
+                    continue
+                break
+
+        if last_exception:
+            raise last_exception
+        raise AioHTTPError(0, "Tutti i tentativi di richiesta sono falliti")
+
+    # ===== OCS utenti =====
+
+    async def create_nc_user(self, user_id: str, password: str) -> str:
+        """Crea utente Nextcloud (solleva AioHTTPError se fallisce)"""
+        response = await self.request(
+            "POST", ocs_users_url(self.base_url), auth=self.admin_auth,
+            headers=nc_headers(), data={"userid": user_id, "password": password},
+        )
+        invalidate_user_cache(user_id, self.base_url)
+        response.raise_for_status()
+        return response.text
+
+    async def check_user_exists(self, user_id: str, use_cache: bool = True) -> bool:
+        """Verifica esatta esistenza utente (GET /cloud/users/{id}, cache condivisa con api.py)"""
+        if use_cache:
+            cached = cached_user_exists(self.base_url, user_id)
+            if cached is not None:
+                return cached
+        try:
+            response = await self.request(
+                "GET", ocs_users_url(self.base_url, quote(user_id, safe="")),
+                auth=self.admin_auth, headers=nc_headers(),
+            )
+        except (AioHTTPError, aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        exists = parse_user_exists(response.status_code, response.text)
+        if exists is None:
+            return False
+        cache_user_exists(self.base_url, user_id, exists)
+        return exists
+
+    async def list_nc_users(self, search: str = "", page_size: int = USERS_PAGE_SIZE) -> List[str]:
+        """Lista utenti Nextcloud con paginazione limit/offset"""
+        users: List[str] = []
+        offset = 0
+        while True:
+            params = {"limit": page_size, "offset": offset}
+            if search:
+                params["search"] = search
+            response = await self.request(
+                "GET", ocs_users_url(self.base_url), auth=self.admin_auth,
+                headers=nc_headers(), params=params,
+            )
+            response.raise_for_status()
+            try:
+                page = list(iter_ocs_elements(response.text, "users"))
+            except ParseError as e:
+                raise AioHTTPError(response.status_code, f"risposta OCS non valida: {e}")
+            for user_id in page:
+                cache_user_exists(self.base_url, user_id, True)
+            users.extend(page)
+            if len(page) < page_size:
+                return users
+            offset += page_size
+
+    async def get_users_info(self, user_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Info di più utenti in parallelo (limitate dal semaforo del client)"""
+        user_ids = list(user_ids)
+        infos = await asyncio.gather(*(self.get_user_info(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, infos))
+
+    async def get_user_info(self, user_id: str) -> Optional[dict]:
+        """Info utente (enabled, quota) o None"""
+        try:
+            response = await self.request(
+                "GET", ocs_users_url(self.base_url, user_id), auth=self.admin_auth,
+                headers=nc_headers(),
+            )
+            response.raise_for_status()
+            return parse_user_info(response.text)
+        except (AioHTTPError, aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async def _set_user_field(self, user_id: str, key: str, value: str) -> str:
+        response = await self.request(
+            "PUT", ocs_users_url(self.base_url, user_id), auth=self.admin_auth,
+            headers=nc_headers(), data={"key": key, "value": value},
+        )
+        response.raise_for_status()
+        return response.text
+
+    async def set_nc_password(self, user_id: str, new_password: str) -> str:
+        """Aggiorna password utente"""
+        return await self._set_user_field(user_id, "password", new_password)
+
+    async def set_nc_quota(self, user_id: str, quota: str) -> str:
+        """Imposta quota utente"""
+        return await self._set_user_field(user_id, "quota", quota)
+
+    async def delete_nc_user(self, user_id: str) -> str:
+        """Elimina utente Nextcloud"""
+        response = await self.request(
+            "DELETE", ocs_users_url(self.base_url, user_id), auth=self.admin_auth,
+            headers=nc_headers(),
+        )
+        invalidate_user_cache(user_id, self.base_url)
+        response.raise_for_status()
+        return response.text
+
+    # ===== WebDAV =====
+
+    async def create_webdav_folder(self, path: str, auth_user: str, auth_pass: str) -> int:
+        """MKCOL - ritorna status code (201 creata, 405 esistente)"""
+        response = await self.request(
+            "MKCOL", dav_files_url(self.base_url, auth_user, path),
+            auth=(auth_user, auth_pass), read_body=False,
+        )
+        return response.status_code
+
+    async def delete_webdav_item(self, path: str, auth_user: str, auth_pass: str) -> int:
+        """DELETE file o cartella - ritorna status code"""
+        response = await self.request(
+            "DELETE", dav_files_url(self.base_url, auth_user, path),
+            auth=(auth_user, auth_pass), read_body=False,
+        )
+        return response.status_code
+
+    async def list_webdav_directory(self, user: str, password: str, path: str = "") -> Tuple[int, str]:
+        """PROPFIND Depth 1 - ritorna (status_code, xml_response)"""
+        response = await self.request(
+            "PROPFIND", dav_files_url(self.base_url, user, path),
+            auth=(user, password), headers={"Depth": "1"},
+        )
+        return response.status_code, response.text
+
+    async def upload_file_webdav(self, local_path: str, remote_path: str,
+                                 user: str, password: str) -> int:
+        """PUT file locale - ritorna status code (201/204 successo)"""
+        try:
+            with open(local_path, "rb") as f:
+                response = await self.request(
+                    "PUT", dav_files_url(self.base_url, user, remote_path),
+                    auth=(user, password), data=f, read_body=False, max_retries=0,
+                )
+            return response.status_code
+        except FileNotFoundError:
+            return 404
+        except Exception:
+            return 500
+
+    async def download_file_webdav(self, remote_path: str, local_path: str,
+                                   user: str, password: str, chunk_size: int = 1024 * 1024) -> int:
+        """
+        GET file remoto su disco - ritorna status code (200 successo)
+
+        Scrive su <local_path>.part (scritture nel thread pool, fuori dal
+        loop) e lo rinomina solo a download completo: un errore a metà non
+        lascia un file troncato a destinazione.
+        """
+        await self.open()
+        url = dav_files_url(self.base_url, user, remote_path)
+        part_path = f"{local_path}.part"
+        loop = asyncio.get_running_loop()
+        try:
+            await self._acquire_token()
+            async with self._semaphore:
+                async with self._session.get(url, auth=self._auth((user, password))) as resp:
+                    if resp.status != 200:
+                        return resp.status
+                    f = await loop.run_in_executor(None, open, part_path, "wb")
+                    try:
+                        async for chunk in resp.content.iter_chunked(chunk_size):
+                            await loop.run_in_executor(None, f.write, chunk)
+                    finally:
+                        await loop.run_in_executor(None, f.close)
+            await loop.run_in_executor(None, os.replace, part_path, local_path)
+            return 200
+        except Exception:
+            try:
+                os.unlink(part_path)
+            except OSError:
+                pass
+            return 500
+
+    async def share_webdav_folder(self, path: str, user: str, password: str,
+                                  share_type: str = "public") -> Optional[str]:
+        """Condivide cartella - ritorna URL condivisione o None"""
+        try:
+            response = await self.request(
+                "POST", ocs_shares_url(self.base_url), auth=(user, password),
+                headers=nc_headers(),
+                data={"path": f"/{path.strip('/')}", "shareType": share_type_code(share_type)},
+            )
+            if response.status_code in (200, 201):
+                return parse_share_url(response.text)
+            return None
+        except Exception:
+            return None
@@ -1,12 +1,41 @@
 """
 API Nextcloud - gestione utenti e cartelle via OCS e WebDAV
 """
+import hashlib
+import json
 import os
+import queue
+import random
+import threading
 import requests
-from typing import Tuple, List, Optional
-from .utils import validate_domain, run_with_retry
+from collections import deque
+from xml.etree.ElementTree import ParseError
+from typing import Callable, Iterator, Tuple, List, Optional
+from urllib.parse import quote, urlsplit
+from .utils import validate_domain, run_with_retry, env_int
+from .cache import MetadataCache, TTLCache
+from .client import get_client
+from .davxml import DavEntry, PROPFIND_BODY, USAGE_PROPFIND_BODY, iter_multistatus, iter_ocs_elements, parse_ocs
+from .ratelimit import TokenBucket, parse_retry_after
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
-import random
+
+# Utenti per pagina nelle liste OCS (limit/offset)
+USERS_PAGE_SIZE = 500
+
+# Esistenza utenti per (base_url, user_id): evita GET ripetute durante setup/listing
+_USER_CACHE = TTLCache(ttl=env_int("NC_USER_CACHE_TTL", 60), maxsize=10000)
+
+# Validità cache persistente metadati server (secondi), poi rivalidazione ETag
+STATUS_TTL = env_int("NC_STATUS_TTL", 300)
+CAPABILITIES_TTL = env_int("NC_CAPABILITIES_TTL", 3600)
+
+
+def _throttle_delay(response: requests.Response, delay_base: float, attempt: int) -> float:
+    """Attesa dopo un 429 senza rate limiter: backoff esponenziale, almeno Retry-After"""
+    delay = delay_base * (2 ** attempt)
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    return max(delay, retry_after or 0) + random.uniform(0.1, 0.3) * delay
 
 
 def make_request_with_retry(method: str, url: str, max_retries: int = 3, 
@@ -14,6 +43,8 @@ def make_request_with_retry(method: str, url: str, max_retries: int = 3,
     """
     Fa richieste HTTP con retry automatico per rate limiting
     
+    Le richieste passano dal client condiviso (pool keep-alive per host).
+    
     Args:
         method: Metodo HTTP (GET, POST, etc.)
         url: URL della richiesta
@@ -31,17 +62,22 @@ def make_request_with_retry(method: str, url: str, max_retries: int = 3,
     
     for attempt in range(max_retries + 1):
         try:
-            response = requests.request(method, url, **kwargs)
+            client = get_client()
+            response = client.request(method, url, **kwargs)
             
-            # Se è 429 (Too Many Requests), retry con backoff
+            # Se è 429 (Too Many Requests) il client ha già ridotto il rate
+            # condiviso: la prossima richiesta attende nel limiter. Senza
+            # limiter (NC_RATE_LIMIT=0) si attende qui, rispettando Retry-After
             if response.status_code == 429:
                 if attempt < max_retries:
-                    delay = delay_base * (2 ** attempt)  # Backoff esponenziale
-                    jitter = random.uniform(0.1, 0.3) * delay  # Jitter per evitare thundering herd
-                    total_delay = delay + jitter
-                    
-                    print(f"⏳ Rate limit (429), attesa {total_delay:.1f}s (tentativo {attempt + 1}/{max_retries + 1})")
-                    time.sleep(total_delay)
+                    if client.limiter_for(url) is None:
+                        delay = _throttle_delay(response, delay_base, attempt)
+                        print(f"⏳ Rate limit (429), retry in {delay:.1f}s (tentativo {attempt + 1}/{max_retries + 1})")
+                        response.close()
+                        time.sleep(delay)
+                        continue
+                    print(f"⏳ Rate limit (429), rallento (tentativo {attempt + 1}/{max_retries + 1})")
+                    response.close()
                     continue
             
             # Per altri errori HTTP temporanei
@@ -122,6 +158,100 @@ def nc_headers() -> dict:
     return {"OCS-APIRequest": "true"}
 
 
+def ocs_users_url(base_url: str, user_id: Optional[str] = None) -> str:
+    """URL endpoint OCS provisioning utenti (collezione o singolo utente)"""
+    url = f"{base_url}/ocs/v1.php/cloud/users"
+    return f"{url}/{user_id}" if user_id else url
+
+
+def dav_files_url(base_url: str, user: str, path: str = "") -> str:
+    """
+    URL WebDAV di un file/cartella nello spazio utente
+
+    Il percorso è in chiaro (come da DavEntry.relative_path()): ogni
+    segmento viene codificato, così '#', '?' e '%' restano parte del nome.
+    """
+    segments = "/".join(quote(seg, safe="") for seg in path.strip("/").split("/") if seg)
+    return f"{base_url}/remote.php/dav/files/{quote(user, safe='')}/{segments}"
+
+
+def dav_files_href(base_url: str, user: str) -> str:
+    """Percorso (href) della root WebDAV utente, per DavEntry.relative_path()"""
+    return urlsplit(dav_files_url(base_url, user)).path
+
+
+def dav_uploads_url(base_url: str, user: str, upload_id: str = "", chunk: str = "") -> str:
+    """URL WebDAV di una sessione di upload a blocchi (chunking v2)"""
+    url = f"{base_url}/remote.php/dav/uploads/{quote(user, safe='')}"
+    if upload_id:
+        url += f"/{quote(upload_id, safe='')}"
+    if chunk:
+        url += f"/{quote(chunk, safe='')}"
+    return url
+
+
+def ocs_shares_url(base_url: str) -> str:
+    """URL endpoint OCS condivisioni"""
+    return f"{base_url}/ocs/v2.php/apps/files_sharing/api/v1/shares"
+
+
+def parse_user_info(data) -> Optional[dict]:
+    """
+    Estrae enabled/quota dalla risposta OCS di un utente
+    
+    Args:
+        data: Corpo risposta (str, bytes o Response in streaming)
+        
+    Returns:
+        Dict con enabled, quota (valore configurato) e, se presenti,
+        quota_used/quota_free/quota_total in bytes; None se vuoto o non XML
+    """
+    try:
+        ocs = parse_ocs(data)
+    except ParseError:
+        return None
+    if not isinstance(ocs.data, dict):
+        return None
+    
+    info = {}
+    # OCS v1 XML serializza i booleani PHP come "1" / ""
+    enabled = ocs.data.get("enabled")
+    if enabled is not None:
+        info["enabled"] = enabled in ("true", "1")
+    
+    quota = ocs.data.get("quota")
+    if isinstance(quota, dict):
+        if quota.get("quota"):
+            info["quota"] = quota["quota"]
+        for key in ("used", "free", "total"):
+            value = quota.get(key)
+            if value not in (None, ""):
+                try:
+                    info[f"quota_{key}"] = int(float(value))
+                except ValueError:
+                    pass
+    elif quota:
+        info["quota"] = quota
+    
+    return info if info else None
+
+
+def parse_share_url(data) -> Optional[str]:
+    """Estrae l'URL di condivisione dalla risposta OCS (None se assente o non XML)"""
+    try:
+        ocs = parse_ocs(data)
+    except ParseError:
+        return None
+    if isinstance(ocs.data, dict):
+        return ocs.data.get("url") or None
+    return None
+
+
+def share_type_code(share_type: str) -> str:
+    """Codice OCS del tipo di condivisione (3=public, 0=user)"""
+    return "3" if share_type == "public" else "0"
+
+
 def create_nc_user(user_id: str, password: str) -> str:
     """
     Crea un nuovo utente in Nextcloud
@@ -137,45 +267,101 @@ def create_nc_user(user_id: str, password: str) -> str:
         requests.HTTPError: Se la richiesta fallisce
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v1.php/cloud/users"
+    url = ocs_users_url(base_url)
     
-    response = requests.post(
+    response = get_client().post(
         url,
         headers=nc_headers(),
         auth=(admin_user, admin_pass),
         data={"userid": user_id, "password": password},
         timeout=30,
     )
+    invalidate_user_cache(user_id)
     response.raise_for_status()
     return response.text
 
 
-def check_user_exists(user_id: str) -> bool:
+def check_user_exists(user_id: str, use_cache: bool = True) -> bool:
     """
     Verifica se un utente esiste già in Nextcloud
     
+    GET esatta su /cloud/users/{id} (nessun match per sottostringa come
+    con search=); il risultato resta in cache per NC_USER_CACHE_TTL
+    secondi ed è invalidato da create_nc_user() / delete_nc_user().
+    
     Args:
         user_id: Username da verificare
+        use_cache: Se False interroga sempre il server
         
     Returns:
-        True se l'utente esiste, False altrimenti
+        True se l'utente esiste, False altrimenti (anche in caso di errore)
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v1.php/cloud/users"
+    cache_key = (base_url, user_id)
+    if use_cache:
+        cached = _USER_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
     
     try:
-        response = requests.get(
-            url,
+        response = get_client().get(
+            ocs_users_url(base_url, quote(user_id, safe="")),
             headers=nc_headers(),
             auth=(admin_user, admin_pass),
-            params={"search": user_id},
             timeout=30,
         )
-        response.raise_for_status()
-        # Controllo semplificato - se user_id è nella risposta, esiste
-        return user_id in response.text
+        exists = parse_user_exists(response.status_code, response.content)
     except requests.RequestException:
         return False
+    
+    # Esito indeterminato (es. 401/5xx): non va in cache
+    if exists is None:
+        return False
+    _USER_CACHE.set(cache_key, exists)
+    return exists
+
+
+def parse_user_exists(status_code: int, body) -> Optional[bool]:
+    """
+    Interpreta la risposta di GET /cloud/users/{id}
+    
+    Returns:
+        True/False se la risposta è conclusiva, None altrimenti (anche per
+        un 200 con corpo non XML, es. pagina di manutenzione di un proxy)
+    """
+    if status_code == 404:
+        return False
+    if status_code != 200:
+        return None
+    try:
+        ocs = parse_ocs(body)
+    except ParseError:
+        return None
+    if ocs.ok:
+        return True
+    # OCS v1 risponde HTTP 200 con statuscode 404/998 se l'utente non esiste
+    if ocs.statuscode in (404, 998):
+        return False
+    return None
+
+
+def invalidate_user_cache(user_id: Optional[str] = None, base_url: Optional[str] = None) -> None:
+    """Invalida la cache esistenza utenti (un utente o tutta)"""
+    if user_id is None:
+        _USER_CACHE.clear()
+        return
+    base_url = base_url or os.environ.get("NC_BASE_URL") or ""
+    _USER_CACHE.invalidate((base_url.rstrip("/"), user_id))
+
+
+def cached_user_exists(base_url: str, user_id: str) -> Optional[bool]:
+    """Esito in cache per (base_url, user_id) o None (usato anche dal client asincrono)"""
+    return _USER_CACHE.get((base_url.rstrip("/"), user_id))
+
+
+def cache_user_exists(base_url: str, user_id: str, exists: bool) -> None:
+    """Salva in cache l'esistenza di un utente"""
+    _USER_CACHE.set((base_url.rstrip("/"), user_id), exists)
 
 
 def get_user_info(user_id: str) -> Optional[dict]:
@@ -189,39 +375,106 @@ def get_user_info(user_id: str) -> Optional[dict]:
         Dict con info utente o None se non trovato
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v1.php/cloud/users/{user_id}"
+    url = ocs_users_url(base_url, user_id)
     
     try:
-        response = requests.get(
+        response = get_client().get(
             url,
             headers=nc_headers(),
             auth=(admin_user, admin_pass),
             timeout=30,
         )
         response.raise_for_status()
-        
-        # Parse XML semplificato (dovremmo usare xml.etree ma per ora ok)
-        data = response.text
-        info = {}
-        
-        # Estrai info base dal XML
-        if "<enabled>true</enabled>" in data:
-            info["enabled"] = True
-        elif "<enabled>false</enabled>" in data:
-            info["enabled"] = False
-            
-        if "<quota>" in data:
-            quota_start = data.find("<quota>") + 7
-            quota_end = data.find("</quota>")
-            if quota_start > 6 and quota_end > quota_start:
-                info["quota"] = data[quota_start:quota_end]
-        
-        return info if info else None
-        
+        return parse_user_info(response.text)
+
     except requests.RequestException:
         return None
 
 
+def iter_nc_users(search: str = "", page_size: int = USERS_PAGE_SIZE) -> Iterator[str]:
+    """
+    Itera gli ID utente Nextcloud con paginazione limit/offset
+
+    Ogni pagina è letta in streaming: gli ID sono prodotti man mano che
+    arrivano, una richiesta ogni page_size utenti. Gli utenti visti
+    popolano la cache di check_user_exists().
+
+    Args:
+        search: Filtro OCS opzionale (sottostringa di ID/nome/email)
+        page_size: Utenti per pagina
+
+    Yields:
+        ID utente
+
+    Raises:
+        requests.HTTPError: Se una pagina fallisce
+    """
+    base_url, admin_user, admin_pass = get_nc_config()
+    url = ocs_users_url(base_url)
+    offset = 0
+
+    while True:
+        params = {"limit": page_size, "offset": offset}
+        if search:
+            params["search"] = search
+        response = make_request_with_retry(
+            "GET",
+            url,
+            headers=nc_headers(),
+            auth=(admin_user, admin_pass),
+            params=params,
+            timeout=60,
+            stream=True
+        )
+        try:
+            response.raise_for_status()
+            count = 0
+            for user_id in iter_ocs_elements(response, "users"):
+                count += 1
+                _USER_CACHE.set((base_url, user_id), True)
+                yield user_id
+        except ParseError as e:
+            raise requests.HTTPError(f"Risposta OCS non valida (offset {offset}): {e}", response=response)
+        finally:
+            response.close()
+
+        if count < page_size:
+            break
+        offset += page_size
+
+
+def list_nc_users(search: str = "", page_size: int = USERS_PAGE_SIZE) -> List[str]:
+    """
+    Lista completa utenti Nextcloud (una richiesta ogni page_size utenti)
+
+    Per verificare molti utenti costruire un set una volta sola invece di
+    chiamare check_user_exists() per ciascuno.
+    """
+    return list(iter_nc_users(search, page_size))
+
+
+def get_users_info(user_ids: List[str], max_workers: int = 8) -> dict:
+    """
+    Info di più utenti in parallelo (una GET OCS per utente)
+
+    Args:
+        user_ids: Lista username
+        max_workers: Richieste contemporanee
+
+    Returns:
+        Dict user_id -> info (come get_user_info(), None se non trovato)
+    """
+    results = {}
+    if not user_ids:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(user_ids)))) as executor:
+        futures = {executor.submit(get_user_info, user_id): user_id for user_id in user_ids}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
 def set_nc_password(user_id: str, new_password: str) -> str:
     """
     Aggiorna password utente Nextcloud
@@ -237,9 +490,9 @@ def set_nc_password(user_id: str, new_password: str) -> str:
         requests.HTTPError: Se la richiesta fallisce
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v1.php/cloud/users/{user_id}"
+    url = ocs_users_url(base_url, user_id)
     
-    response = requests.put(
+    response = get_client().put(
         url,
         headers=nc_headers(),
         auth=(admin_user, admin_pass),
@@ -262,9 +515,9 @@ def set_nc_quota(user_id: str, quota: str) -> str:
         Risposta del server
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v1.php/cloud/users/{user_id}"
+    url = ocs_users_url(base_url, user_id)
     
-    response = requests.put(
+    response = get_client().put(
         url,
         headers=nc_headers(),
         auth=(admin_user, admin_pass),
@@ -286,14 +539,15 @@ def delete_nc_user(user_id: str) -> str:
         Risposta del server
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v1.php/cloud/users/{user_id}"
+    url = ocs_users_url(base_url, user_id)
     
-    response = requests.delete(
+    response = get_client().delete(
         url,
         headers=nc_headers(),
         auth=(admin_user, admin_pass),
         timeout=30,
     )
+    invalidate_user_cache(user_id)
     response.raise_for_status()
     return response.text
 
@@ -372,16 +626,20 @@ def create_webdav_folder(path: str, auth_user: str, auth_pass: str) -> int:
     Returns:
         Status code (201 = creata, 405 = già esistente, altro = errore)
     """
+    return _mkcol(path, auth_user, auth_pass).status_code
+
+
+def _mkcol(path: str, auth_user: str, auth_pass: str) -> requests.Response:
+    """MKCOL singolo, senza retry (ritorna la Response per leggere Retry-After)"""
     base_url, _, _ = get_nc_config()
-    url = f"{base_url}/remote.php/dav/files/{auth_user}/{path.strip('/')}"
+    url = dav_files_url(base_url, auth_user, path)
     
-    response = requests.request(
+    return get_client().request(
         "MKCOL", 
         url, 
         auth=(auth_user, auth_pass), 
         timeout=30
     )
-    return response.status_code
 
 
 def delete_webdav_item(path: str, auth_user: str, auth_pass: str) -> int:
@@ -397,9 +655,9 @@ def delete_webdav_item(path: str, auth_user: str, auth_pass: str) -> int:
         Status code (204 = eliminato, 404 = non trovato)
     """
     base_url, _, _ = get_nc_config()
-    url = f"{base_url}/remote.php/dav/files/{auth_user}/{path.strip('/')}"
+    url = dav_files_url(base_url, auth_user, path)
     
-    response = requests.delete(
+    response = get_client().delete(
         url, 
         auth=(auth_user, auth_pass), 
         timeout=30
@@ -409,7 +667,10 @@ def delete_webdav_item(path: str, auth_user: str, auth_pass: str) -> int:
 
 def list_webdav_directory(user: str, password: str, path: str = "") -> Tuple[int, str]:
     """
-    Lista contenuto di una directory via WebDAV
+    Lista contenuto di una directory via WebDAV (XML grezzo)
+    
+    Per elaborare le entry senza caricare tutto il body usare
+    iter_webdav_directory(); per l'albero completo walk_remote().
     
     Args:
         user: Username
@@ -420,9 +681,9 @@ def list_webdav_directory(user: str, password: str, path: str = "") -> Tuple[int
         Tupla (status_code, xml_response)
     """
     base_url, _, _ = get_nc_config()
-    url = f"{base_url}/remote.php/dav/files/{user}/{path.strip('/')}"
+    url = dav_files_url(base_url, user, path)
     
-    response = requests.request(
+    response = get_client().request(
         "PROPFIND",
         url,
         auth=(user, password),
@@ -432,10 +693,183 @@ def list_webdav_directory(user: str, password: str, path: str = "") -> Tuple[int
     return response.status_code, response.text
 
 
+def propfind_entries(user: str, password: str, path: str = "",
+                     depth: str = "1", timeout=60) -> Iterator[DavEntry]:
+    """
+    PROPFIND in streaming: produce le entry man mano che vengono lette
+    
+    Il body non viene mai caricato interamente in memoria, quindi anche
+    cartelle con moltissimi elementi usano memoria costante.
+    
+    Args:
+        user: Username
+        password: Password
+        path: Percorso relativo (default: root)
+        depth: Header Depth ("0", "1" o "infinity")
+        timeout: Timeout requests (secondi o tupla connessione/lettura)
+        
+    Yields:
+        DavEntry (la prima è la risorsa richiesta stessa)
+        
+    Raises:
+        requests.HTTPError: Se il server non risponde 207
+    """
+    base_url, _, _ = get_nc_config()
+    url = dav_files_url(base_url, user, path)
+    
+    response = make_request_with_retry(
+        "PROPFIND",
+        url,
+        auth=(user, password),
+        headers={"Depth": depth, "Content-Type": "application/xml; charset=utf-8"},
+        data=PROPFIND_BODY,
+        timeout=timeout,
+        stream=True
+    )
+    try:
+        if response.status_code != 207:
+            response.raise_for_status()
+            raise requests.HTTPError(
+                f"PROPFIND {path or '/'}: status inatteso {response.status_code}",
+                response=response
+            )
+        yield from iter_multistatus(response)
+    finally:
+        response.close()
+
+
+def iter_webdav_directory(user: str, password: str, path: str = "") -> Iterator[DavEntry]:
+    """
+    Lista contenuto di una directory come entry tipizzate (Depth 1)
+    
+    Args:
+        user: Username
+        password: Password
+        path: Percorso relativo (default: root)
+        
+    Yields:
+        DavEntry dei figli diretti (esclusa la directory stessa)
+    """
+    entries = propfind_entries(user, password, path, depth="1")
+    next(entries, None)  # Prima entry = directory richiesta
+    yield from entries
+
+
+# Status con cui il server rifiuta Depth: infinity (Nextcloud: 403 di default)
+_DEPTH_INFINITY_REFUSED = (400, 403, 405, 412, 501)
+# Timeout PROPFIND Depth: infinity (connessione, lettura)
+_DEPTH_INFINITY_TIMEOUT = (10, 300)
+
+
+def walk_remote(user: str, password: str, path: str = "", max_in_flight: int = 8,
+                depth_infinity: bool = True,
+                onerror: Optional[Callable[[str, Exception], None]] = None) -> Iterator[DavEntry]:
+    """
+    Percorre ricorsivamente un albero remoto producendo le entry man mano
+
+    Prova un solo PROPFIND Depth: infinity; se il server lo rifiuta passa a
+    una visita in ampiezza con PROPFIND Depth: 1 concorrenti (al massimo
+    max_in_flight in corso). In entrambi i casi le entry sono prodotte mentre
+    il body viene letto: nessuna lista dell'albero in memoria.
+    
+    Per il percorso relativo usare entry.relative_path(dav_files_href(base_url, user)).
+    
+    Args:
+        user: Username
+        password: Password
+        path: Cartella di partenza (default: root)
+        max_in_flight: PROPFIND Depth 1 contemporanei nel fallback
+        depth_infinity: Se tentare prima Depth: infinity
+        onerror: Callback(cartella, eccezione) per errori su una cartella nel
+                 fallback; se None l'errore viene sollevato
+        
+    Yields:
+        DavEntry di tutti i discendenti (esclusa la cartella di partenza);
+        l'ordine non è garantito
+    """
+    if depth_infinity:
+        entries = propfind_entries(user, password, path, depth="infinity",
+                                   timeout=_DEPTH_INFINITY_TIMEOUT)
+        try:
+            next(entries)  # Prima entry = cartella di partenza
+        except StopIteration:
+            return
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status not in _DEPTH_INFINITY_REFUSED:
+                raise
+        else:
+            yield from entries
+            return
+    
+    yield from _walk_breadth_first(user, password, path, max(1, max_in_flight), onerror)
+
+
+def _walk_breadth_first(user: str, password: str, path: str, max_in_flight: int,
+                        onerror: Optional[Callable[[str, Exception], None]]) -> Iterator[DavEntry]:
+    """Visita in ampiezza con PROPFIND Depth 1 concorrenti (vedi walk_remote)"""
+    base_url, _, _ = get_nc_config()
+    base_href = dav_files_href(base_url, user)
+    # Coda limitata: se il consumatore è lento i worker si fermano
+    results: "queue.Queue" = queue.Queue(maxsize=max_in_flight * 256)
+    stop = threading.Event()
+    
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def list_folder(folder: str) -> None:
+        entries = iter_webdav_directory(user, password, folder)
+        try:
+            for entry in entries:
+                if not put(("entry", entry)):
+                    return
+            put(("done", folder))
+        except Exception as e:
+            put(("error", (folder, e)))
+        finally:
+            entries.close()
+    
+    pending = deque([path.strip("/")])
+    in_flight = 0
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        while pending or in_flight:
+            while pending and in_flight < max_in_flight:
+                executor.submit(list_folder, pending.popleft())
+                in_flight += 1
+            
+            kind, payload = results.get()
+            if kind == "entry":
+                if payload.is_dir:
+                    pending.append(payload.relative_path(base_href))
+                yield payload
+            elif kind == "done":
+                in_flight -= 1
+            else:
+                in_flight -= 1
+                folder, error = payload
+                if onerror is None:
+                    raise error
+                onerror(folder, error)
+    finally:
+        # Consumatore fermato o errore: sblocca i worker senza attenderli
+        stop.set()
+        executor.shutdown(wait=False)
+
+
 def upload_file_webdav(local_path: str, remote_path: str, user: str, password: str) -> int:
     """
     Carica file via WebDAV
     
+    I file più grandi di un blocco (NC_UPLOAD_CHUNK_MB) passano dall'upload
+    a blocchi paralleli e ripristinabile di transfer.upload_file_chunked.
+    
     Args:
         local_path: Percorso file locale
         remote_path: Percorso destinazione su Nextcloud
@@ -446,16 +880,20 @@ def upload_file_webdav(local_path: str, remote_path: str, user: str, password: s
         Status code (201/204 = successo)
     """
     base_url, _, _ = get_nc_config()
-    url = f"{base_url}/remote.php/dav/files/{user}/{remote_path.strip('/')}"
+    url = dav_files_url(base_url, user, remote_path)
     
     try:
-        with open(local_path, 'rb') as f:
-            response = requests.put(
-                url,
-                data=f,
-                auth=(user, password),
-                timeout=60
-            )
+        from .transfer import DEFAULT_CHUNK_MB, MiB, FileBody, upload_file_chunked
+        size = os.path.getsize(local_path)
+        if size > env_int("NC_UPLOAD_CHUNK_MB", DEFAULT_CHUNK_MB) * MiB:
+            return upload_file_chunked(local_path, remote_path, user, password).status_code
+        
+        response = get_client().put(
+            url,
+            data=FileBody(local_path, length=size) if size else b"",
+            auth=(user, password),
+            timeout=60
+        )
         return response.status_code
     except FileNotFoundError:
         return 404
@@ -467,6 +905,10 @@ def download_file_webdav(remote_path: str, local_path: str, user: str, password:
     """
     Scarica file via WebDAV
     
+    Usa transfer.download_file_ranged: intervalli paralleli se il server
+    supporta Range, file .part ripristinabile e rename atomico (local_path
+    non resta mai troncato).
+    
     Args:
         remote_path: Percorso file su Nextcloud
         local_path: Percorso destinazione locale
@@ -476,27 +918,94 @@ def download_file_webdav(remote_path: str, local_path: str, user: str, password:
     Returns:
         Status code (200 = successo)
     """
-    base_url, _, _ = get_nc_config()
-    url = f"{base_url}/remote.php/dav/files/{user}/{remote_path.strip('/')}"
-    
     try:
-        response = requests.get(
-            url,
-            auth=(user, password),
-            timeout=60,
-            stream=True
-        )
-        
-        if response.status_code == 200:
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        
-        return response.status_code
+        from .transfer import download_file_ranged
+        return download_file_ranged(remote_path, local_path, user, password).status_code
     except Exception:
         return 500
 
 
+def provision_folder_tree(user: str, password: str, folders: List[str],
+                          max_workers: int = 8, max_retries: int = 5,
+                          limiter: Optional[TokenBucket] = None) -> dict:
+    """
+    Crea un albero di cartelle WebDAV in parallelo, livello per livello
+    
+    Le cartelle vengono ordinate per profondità (i padri prima dei figli,
+    anche se non elencati esplicitamente) e le cartelle sorelle sono create
+    in parallelo sul pool di connessioni condiviso. Nessuna attesa fissa:
+    si rallenta solo quando il server risponde 429, tramite il rate limiter
+    condiviso dell'host (rispetta Retry-After).
+    
+    Args:
+        user: Username
+        password: Password
+        folders: Percorsi relativi alla root utente (es. ["public/a.it"])
+        max_workers: MKCOL contemporanei per livello
+        max_retries: Tentativi per cartella in caso di 429
+        limiter: Limiter aggiuntivo solo per questo albero (opzionale, oltre
+                 a quello condiviso dell'host applicato dal client)
+        
+    Returns:
+        Dict cartella -> status code (201 creata, 405 già esistente)
+    """
+    # Includi i padri mancanti e raggruppa per profondità
+    all_folders = set()
+    for folder in folders:
+        parts = folder.strip("/").split("/")
+        for i in range(1, len(parts) + 1):
+            all_folders.add("/".join(parts[:i]))
+    
+    levels = {}
+    for folder in all_folders:
+        levels.setdefault(folder.count("/"), []).append(folder)
+    
+    base_url, _, _ = get_nc_config()
+    host_limiter = get_client().limiter_for(base_url)
+    
+    def mkcol_adaptive(folder: str) -> int:
+        status = 500
+        for attempt in range(max_retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            response = _mkcol(folder, user, password)
+            status = response.status_code
+            response.close()
+            
+            if status != 429:
+                if limiter is not None:
+                    limiter.on_success()
+                return status
+            
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if limiter is not None:
+                limiter.on_throttle(retry_after)
+            if attempt < max_retries and limiter is None and host_limiter is None:
+                # Nessun limiter attivo (NC_RATE_LIMIT=0): backoff locale
+                delay = _throttle_delay(response, 1.0, attempt)
+                print(f"⏳ Rate limit (429) su {folder}, retry in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            print(f"⏳ Rate limit (429) su {folder}, rallento")
+        return status
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for depth in sorted(levels):
+            level = sorted(levels[depth])
+            futures = {executor.submit(mkcol_adaptive, folder): folder for folder in level}
+            for future in as_completed(futures):
+                folder = futures[future]
+                try:
+                    results[folder] = future.result()
+                except Exception as e:
+                    print(f"❌ Errore creazione cartella {folder}: {e}")
+                    results[folder] = 500
+    
+    # Restituisci solo le cartelle richieste, nell'ordine originale
+    return {folder.strip("/"): results.get(folder.strip("/"), 500) for folder in folders}
+
+
 def create_folder_structure(user: str, password: str, root_domain: str, subdomains: List[str]) -> dict:
     """
     Crea la struttura cartelle standard: /public, /logs, /backup + sottodomini
@@ -517,8 +1026,6 @@ def create_folder_structure(user: str, password: str, root_domain: str, subdomai
         if not validate_domain(subdomain):
             raise ValueError(f"Sottodominio non valido: {subdomain}")
     
-    results = {}
-    
     # Lista tutte le cartelle da creare
     folders_to_create = [
         "public",
@@ -531,31 +1038,7 @@ def create_folder_structure(user: str, password: str, root_domain: str, subdomai
     for subdomain in subdomains:
         folders_to_create.append(f"public/{subdomain}")
     
-    # Delay per rate limiting
-    import time
-    DELAY_BETWEEN_REQUESTS = 2  # 2 secondi tra richieste
-    
-    for folder in folders_to_create:
-        try:
-            # Delay per evitare rate limiting
-            time.sleep(DELAY_BETWEEN_REQUESTS)
-            
-            status = create_webdav_folder(folder, user, password)
-            results[folder] = status
-            
-            if status == 429:  # Rate limited
-                print(f"⚠️ Rate limiting per {folder}, attesa più lunga...")
-                time.sleep(10)  # Attesa più lunga
-                
-                # Riprova una volta
-                status = create_webdav_folder(folder, user, password)
-                results[folder] = status
-                
-        except Exception as e:
-            print(f"❌ Errore creazione cartella {folder}: {e}")
-            results[folder] = 500
-    
-    return results
+    return provision_folder_tree(user, password, folders_to_create)
 
 
 def get_webdav_space_info(user: str, password: str) -> Optional[dict]:
@@ -570,45 +1053,89 @@ def get_webdav_space_info(user: str, password: str) -> Optional[dict]:
         Dict con quota e spazio usato o None se errore
     """
     try:
-        status_code, xml_response = list_webdav_directory(user, password, "")
-        
-        if status_code not in (200, 207):
+        root = next(propfind_entries(user, password, "", depth="0"), None)
+        if root is None:
             return None
         
-        # Parse XML per trovare informazioni quota
-        # Questo è un parsing semplificato - in produzione usare xml.etree
         info = {}
-        
-        if "<d:quota-available-bytes>" in xml_response:
-            start = xml_response.find("<d:quota-available-bytes>") + 25
-            end = xml_response.find("</d:quota-available-bytes>")
-            if start > 24 and end > start:
-                try:
-                    available = int(xml_response[start:end])
-                    info["available_bytes"] = available
-                except:
-                    pass
-        
-        if "<d:quota-used-bytes>" in xml_response:
-            start = xml_response.find("<d:quota-used-bytes>") + 20
-            end = xml_response.find("</d:quota-used-bytes>")
-            if start > 19 and end > start:
-                try:
-                    used = int(xml_response[start:end])
-                    info["used_bytes"] = used
-                except:
-                    pass
+        if root.quota_available is not None:
+            info["available_bytes"] = root.quota_available
+        if root.quota_used is not None:
+            info["used_bytes"] = root.quota_used
         
         # Calcola quota totale se abbiamo entrambi i valori
-        if "available_bytes" in info and "used_bytes" in info:
+        # (quota-available-bytes negativo = quota illimitata/non calcolata)
+        if "available_bytes" in info and "used_bytes" in info and info["available_bytes"] >= 0:
             info["total_bytes"] = info["available_bytes"] + info["used_bytes"]
         
         return info if info else None
-        
+
     except Exception:
         return None
 
 
+def get_folder_usage(url: str, auth=None, headers: Optional[dict] = None,
+                     timeout=30) -> Optional[dict]:
+    """
+    Spazio occupato da una cartella WebDAV con un solo PROPFIND (Depth 1)
+
+    Nextcloud mantiene oc:size ricorsiva nella filecache: la cartella e
+    ogni sottocartella di primo livello riportano la dimensione totale
+    senza elencare il contenuto, al contrario di os.walk sul mount FUSE.
+
+    Args:
+        url: URL WebDAV completo della cartella
+        auth: Tupla (user, password) per Basic Auth
+        headers: Header aggiuntivi (es. Authorization: Bearer)
+        timeout: Timeout requests
+
+    Returns:
+        Dict con used_bytes, available_bytes (se nota), folders
+        {nome: bytes}, files_bytes e files (file di primo livello);
+        None se il server non risponde 207
+    """
+    request_headers = {"Depth": "1", "Content-Type": "application/xml; charset=utf-8"}
+    request_headers.update(headers or {})
+
+    response = make_request_with_retry(
+        "PROPFIND",
+        url,
+        auth=auth,
+        headers=request_headers,
+        data=USAGE_PROPFIND_BODY,
+        timeout=timeout,
+        stream=True
+    )
+    try:
+        if response.status_code != 207:
+            return None
+
+        entries = iter_multistatus(response)
+        root = next(entries, None)
+        if root is None:
+            return None
+
+        usage = {"used_bytes": 0, "folders": {}, "files_bytes": 0, "files": 0}
+        for entry in entries:
+            if entry.is_dir:
+                usage["folders"][entry.name] = entry.size or 0
+            else:
+                usage["files_bytes"] += entry.size or 0
+                usage["files"] += 1
+
+        # oc:size della cartella; in sua assenza somma dei figli
+        if root.size is not None:
+            usage["used_bytes"] = root.size
+        else:
+            usage["used_bytes"] = usage["files_bytes"] + sum(usage["folders"].values())
+        if root.quota_available is not None and root.quota_available >= 0:
+            usage["available_bytes"] = root.quota_available
+
+        return usage
+    finally:
+        response.close()
+
+
 def share_webdav_folder(path: str, user: str, password: str, share_type: str = "public") -> Optional[str]:
     """
     Condivide una cartella via API OCS
@@ -623,15 +1150,15 @@ def share_webdav_folder(path: str, user: str, password: str, share_type: str = "
         URL di condivisione o None se errore
     """
     base_url, admin_user, admin_pass = get_nc_config()
-    url = f"{base_url}/ocs/v2.php/apps/files_sharing/api/v1/shares"
+    url = ocs_shares_url(base_url)
     
     try:
         data = {
             "path": f"/{path.strip('/')}",
-            "shareType": "3" if share_type == "public" else "0"  # 3=public, 0=user
+            "shareType": share_type_code(share_type)
         }
         
-        response = requests.post(
+        response = get_client().post(
             url,
             headers=nc_headers(),
             auth=(user, password),
@@ -640,12 +1167,7 @@ def share_webdav_folder(path: str, user: str, password: str, share_type: str = "
         )
         
         if response.status_code in (200, 201):
-            # Parse XML per ottenere URL
-            if "<url>" in response.text:
-                start = response.text.find("<url>") + 5
-                end = response.text.find("</url>")
-                if start > 4 and end > start:
-                    return response.text[start:end]
+            return parse_share_url(response.text)
         
         return None
         
@@ -653,32 +1175,120 @@ def share_webdav_folder(path: str, user: str, password: str, share_type: str = "
         return None
 
 
-def get_nextcloud_version() -> Optional[str]:
+def _cached_get(url: str, key: str, ttl: float, use_cache: bool = True,
+                revalidate: bool = False, **kwargs) -> Tuple[Optional[int], Optional[str]]:
     """
-    Ottiene versione Nextcloud server
+    GET con cache persistente dei metadati server (MetadataCache)
+    
+    Voce valida: nessuna richiesta. Voce scaduta: GET condizionale con
+    If-None-Match/If-Modified-Since (304 = corpo in cache prorogato).
+    Solo le risposte 200 vengono salvate.
+    
+    Con revalidate=True la richiesta condizionale parte sempre, anche per
+    voci valide: serve quando conta la risposta del server (es. 401).
     
     Returns:
-        Stringa versione o None se errore
+        Tupla (status_code, corpo); status 200 anche per risposte da cache
+    """
+    base_url, _, _ = get_nc_config()
+    cache = MetadataCache(base_url)
+    entry = cache.get(key)
+    if use_cache and not revalidate and cache.is_fresh(entry):
+        return 200, entry["body"]
+    
+    headers = dict(kwargs.pop("headers", None) or {})
+    if use_cache:
+        headers.update(cache.validators(entry))
+    response = get_client().get(url, headers=headers, **kwargs)
+    
+    if response.status_code == 304 and entry is not None:
+        cache.touch(key, ttl)
+        return 200, entry["body"]
+    if response.status_code == 200:
+        cache.store(
+            key, response.text, ttl,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified")
+        )
+    return response.status_code, response.text
+
+
+def _capabilities_key(admin_user: str, admin_pass: str) -> str:
+    """Chiave cache capabilities: cambia con le credenziali admin"""
+    digest = hashlib.sha256(f"{admin_user}:{admin_pass}".encode("utf-8")).hexdigest()[:16]
+    return f"capabilities:{admin_user}:{digest}"
+
+
+def get_server_status(use_cache: bool = True) -> Optional[dict]:
+    """
+    Contenuto di status.php (installed, maintenance, version, ...)
+    
+    Args:
+        use_cache: Se False interroga sempre il server
+        
+    Returns:
+        Dict status o None se errore
     """
     try:
         base_url, _, _ = get_nc_config()
-        url = f"{base_url}/status.php"
-        
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("version")
-        
+        status_code, body = _cached_get(
+            f"{base_url}/status.php", "status", STATUS_TTL, use_cache, timeout=10
+        )
+        if status_code != 200:
+            return None
+        return json.loads(body)
+    except (requests.RequestException, ValueError):
         return None
+
+
+def get_capabilities(use_cache: bool = True) -> Optional[dict]:
+    """
+    Capabilities OCS del server (versione, app, limiti)
+    
+    Args:
+        use_cache: Se False interroga sempre il server
         
-    except Exception:
+    Returns:
+        Dict data OCS o None se errore/credenziali non valide
+    """
+    try:
+        base_url, admin_user, admin_pass = get_nc_config()
+        status_code, body = _cached_get(
+            f"{base_url}/ocs/v1.php/cloud/capabilities", _capabilities_key(admin_user, admin_pass),
+            CAPABILITIES_TTL, use_cache,
+            headers=nc_headers(), auth=(admin_user, admin_pass), timeout=10
+        )
+        if status_code != 200:
+            return None
+        data = parse_ocs(body).data
+        return data if isinstance(data, dict) else None
+    except (requests.RequestException, ParseError):
         return None
 
 
-def test_nextcloud_connectivity() -> Tuple[bool, str]:
+def get_nextcloud_version(use_cache: bool = True) -> Optional[str]:
+    """
+    Ottiene versione Nextcloud server
+    
+    Returns:
+        Stringa versione o None se errore
+    """
+    status = get_server_status(use_cache)
+    return status.get("version") if status else None
+
+
+def test_nextcloud_connectivity(use_cache: bool = True) -> Tuple[bool, str]:
     """
     Test connettività server Nextcloud
     
+    status.php viene dalla cache metadati finché valida. La verifica delle
+    credenziali admin va sempre al server, come GET condizionale sulle
+    capabilities: un 304 costa poco, e una password cambiata o revocata
+    risponde 401 invece di passare dalla cache.
+    
+    Args:
+        use_cache: Se False verifica sempre sul server
+        
     Returns:
         Tupla (successo, messaggio)
     """
@@ -686,28 +1296,28 @@ def test_nextcloud_connectivity() -> Tuple[bool, str]:
         base_url, admin_user, admin_pass = get_nc_config()
         
         # Test status endpoint
-        status_url = f"{base_url}/status.php"
-        response = requests.get(status_url, timeout=10)
-        
-        if response.status_code != 200:
-            return False, f"Status endpoint non raggiungibile: {response.status_code}"
+        status_code, body = _cached_get(
+            f"{base_url}/status.php", "status", STATUS_TTL, use_cache, timeout=10
+        )
+        if status_code != 200:
+            return False, f"Status endpoint non raggiungibile: {status_code}"
         
         # Test autenticazione admin
-        auth_url = f"{base_url}/ocs/v1.php/cloud/capabilities"
-        response = requests.get(
-            auth_url,
-            headers=nc_headers(),
-            auth=(admin_user, admin_pass),
-            timeout=10
+        status_code, _ = _cached_get(
+            f"{base_url}/ocs/v1.php/cloud/capabilities", _capabilities_key(admin_user, admin_pass),
+            CAPABILITIES_TTL, use_cache, revalidate=True,
+            headers=nc_headers(), auth=(admin_user, admin_pass), timeout=10
         )
-        
-        if response.status_code == 401:
+        if status_code == 401:
             return False, "Credenziali admin non valide"
-        elif response.status_code != 200:
-            return False, f"API OCS non raggiungibile: {response.status_code}"
+        elif status_code != 200:
+            return False, f"API OCS non raggiungibile: {status_code}"
         
-        # Ottieni versione
-        version = get_nextcloud_version()
+        # Versione dalla stessa risposta status.php
+        try:
+            version = json.loads(body).get("version")
+        except ValueError:
+            version = None
         return True, f"Connessione OK (Nextcloud {version or 'unknown'})"
         
     except requests.Timeout:
@@ -0,0 +1,312 @@
+"""
+Provisioning massivo tenant da file CSV/JSONL
+
+Le fasi di rete (utente OCS, albero cartelle, remote rclone) girano in un
+pool di worker; le fasi locali (useradd, mount, systemd) passano da una
+corsia serializzata, perché toccano /etc/passwd, FUSE e systemd.
+Le scritture su rclone.conf dei remote creati in parallelo sono protette
+da un flock in rclone.py.
+Lo stato di ogni step è salvato su file JSON: un run interrotto riprende
+dagli step non ancora completati.
+"""
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .utils import atomic_write, validate_domain
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+ProgressCallback = Callable[[str, str, str, str], None]
+
+
+@dataclass
+class TenantSpec:
+    """Riga del file tenant"""
+    username: str
+    password: str
+    quota: Optional[str] = None
+    profile: str = "full"
+    subdomains: List[str] = field(default_factory=list)
+    auth_mode: str = "bearer"
+
+    @classmethod
+    def from_dict(cls, data: Dict, default_profile: str = "full",
+                  default_auth_mode: str = "bearer") -> "TenantSpec":
+        """Costruisce la spec da un record CSV/JSON (valida i campi obbligatori)"""
+        username = (data.get("username") or data.get("user") or "").strip()
+        password = data.get("password") or ""
+        if not username or not password:
+            raise ValueError("username e password obbligatori")
+
+        subdomains = data.get("subdomains") or data.get("sub") or []
+        if isinstance(subdomains, str):
+            subdomains = [s.strip() for s in subdomains.replace(";", ",").split(",") if s.strip()]
+
+        return cls(
+            username=username,
+            password=password,
+            quota=(data.get("quota") or None),
+            profile=(data.get("profile") or default_profile),
+            subdomains=list(subdomains),
+            auth_mode=(data.get("auth_mode") or default_auth_mode),
+        )
+
+
+def load_tenants(path: str, default_profile: str = "full",
+                 default_auth_mode: str = "bearer") -> List[TenantSpec]:
+    """
+    Carica tenant da file .csv (con intestazione) o .jsonl (un oggetto per riga)
+
+    Args:
+        path: Percorso file
+        default_profile: Profilo rclone se non specificato nella riga
+        default_auth_mode: Metodo auth se non specificato nella riga
+
+    Returns:
+        Lista TenantSpec
+
+    Raises:
+        ValueError: Se una riga non è valida (indica il numero di riga)
+    """
+    records = []
+    with open(path, "r", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for lineno, row in enumerate(csv.DictReader(f), start=2):
+                records.append((lineno, row))
+        else:
+            for lineno, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    records.append((lineno, json.loads(line)))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}:{lineno}: JSON non valido ({e})")
+
+    tenants = []
+    seen = set()
+    for lineno, record in records:
+        try:
+            tenant = TenantSpec.from_dict(record, default_profile, default_auth_mode)
+        except ValueError as e:
+            raise ValueError(f"{path}:{lineno}: {e}")
+        if tenant.username in seen:
+            raise ValueError(f"{path}:{lineno}: utente duplicato {tenant.username}")
+        seen.add(tenant.username)
+        tenants.append(tenant)
+    return tenants
+
+
+class BulkState:
+    """Stato persistente per-tenant/per-step (file JSON, scritture atomiche)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.data = json.load(f).get("tenants", {})
+
+    def _save(self) -> None:
+        content = json.dumps({"updated": time.time(), "tenants": self.data}, indent=2)
+        if not atomic_write(self.path, content, 0o600):
+            raise RuntimeError(f"Impossibile salvare stato bulk: {self.path}")
+
+    def step_status(self, username: str, step: str) -> str:
+        with self._lock:
+            return self.data.get(username, {}).get("steps", {}).get(step, STATUS_PENDING)
+
+    def mark(self, username: str, step: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            tenant = self.data.setdefault(username, {"steps": {}, "status": STATUS_PENDING})
+            tenant["steps"][step] = status
+            if error:
+                tenant["error"] = f"{step}: {error}"
+            elif status == STATUS_DONE:
+                tenant.pop("error", None)
+            self._save()
+
+    def set_status(self, username: str, status: str) -> None:
+        with self._lock:
+            tenant = self.data.setdefault(username, {"steps": {}, "status": STATUS_PENDING})
+            tenant["status"] = status
+            self._save()
+
+    def tenant_status(self, username: str) -> str:
+        with self._lock:
+            return self.data.get(username, {}).get("status", STATUS_PENDING)
+
+
+class BulkProvisioner:
+    """
+    Esegue il setup di molti tenant in parallelo
+
+    Uso:
+        tenants = load_tenants("tenants.jsonl")
+        BulkProvisioner(tenants, "tenants.jsonl.state.json", workers=8).run()
+    """
+
+    def __init__(self, tenants: List[TenantSpec], state_path: str, workers: int = 8,
+                 skip_linux: bool = False, create_service: bool = True,
+                 progress: Optional[ProgressCallback] = None):
+        self.tenants = tenants
+        self.state = BulkState(state_path)
+        self.workers = max(1, workers)
+        self.skip_linux = skip_linux
+        self.create_service = create_service
+        self.progress = progress or (lambda user, step, status, message: None)
+
+    def _run_step(self, tenant: TenantSpec, step: str, func: Callable[[], None]) -> None:
+        """Esegue uno step se non già completato; aggiorna lo stato"""
+        if self.state.step_status(tenant.username, step) in (STATUS_DONE, STATUS_SKIPPED):
+            self.progress(tenant.username, step, STATUS_SKIPPED, "già completato")
+            return
+
+        self.progress(tenant.username, step, "running", "")
+        try:
+            func()
+        except Exception as e:
+            self.state.mark(tenant.username, step, STATUS_FAILED, str(e))
+            self.progress(tenant.username, step, STATUS_FAILED, str(e))
+            raise
+        self.state.mark(tenant.username, step, STATUS_DONE)
+        self.progress(tenant.username, step, STATUS_DONE, "")
+
+    # ===== Fasi di rete (pool) =====
+
+    def _network_phase(self, tenant: TenantSpec) -> None:
+        from .api import create_nc_user, check_user_exists, set_nc_quota, create_folder_structure
+        from .mount import MountManager
+
+        def nc_user():
+            if not check_user_exists(tenant.username):
+                create_nc_user(tenant.username, tenant.password)
+            if tenant.quota:
+                set_nc_quota(tenant.username, tenant.quota)
+
+        def folders():
+            results = create_folder_structure(
+                tenant.username, tenant.password, tenant.username, tenant.subdomains
+            )
+            failed = [f for f, status in results.items() if status not in (201, 405)]
+            if failed:
+                raise RuntimeError(f"cartelle non create: {', '.join(failed)}")
+
+        def rclone_remote():
+            manager = MountManager(use_bearer_token=tenant.auth_mode == "bearer")
+            if not manager.setup_credentials(tenant.username, tenant.password):
+                raise RuntimeError("configurazione remote rclone fallita")
+
+        self._run_step(tenant, "nc_user", nc_user)
+        self._run_step(tenant, "folders", folders)
+        self._run_step(tenant, "rclone_remote", rclone_remote)
+
+    # ===== Fasi locali (corsia serializzata) =====
+
+    def _local_phase(self, tenant: TenantSpec) -> None:
+        from .system import create_linux_user, user_exists
+        from .mount import MountManager
+
+        manager = MountManager(use_bearer_token=tenant.auth_mode == "bearer")
+        home_path = f"/home/{tenant.username}"
+
+        def linux_user():
+            if not user_exists(tenant.username):
+                if not create_linux_user(tenant.username, tenant.password, create_home=False):
+                    raise RuntimeError("useradd fallito")
+
+        def mount():
+            result = manager.mount_user_home(
+                tenant.username, tenant.password, home_path, tenant.profile,
+                configure_remote=False
+            )
+            if not result["success"]:
+                raise RuntimeError(result["message"])
+
+        def systemd():
+            service_name = manager.create_systemd_service(
+                tenant.username, tenant.password, home_path, tenant.profile,
+                configure_remote=False
+            )
+            if not manager.enable_mount_service(service_name):
+                raise RuntimeError(f"Avvio {service_name} fallito")
+
+        # Step disattivati da opzioni non vengono salvati: un run successivo
+        # senza --skip-linux/--no-service li esegue
+        if not self.skip_linux:
+            self._run_step(tenant, "linux_user", linux_user)
+        self._run_step(tenant, "mount", mount)
+        if self.create_service:
+            self._run_step(tenant, "systemd", systemd)
+
+    def _finish(self, tenant: TenantSpec, status: str, message: str = "") -> None:
+        self.state.set_status(tenant.username, status)
+        self.progress(tenant.username, "tenant", status, message)
+
+    def run(self) -> Dict[str, str]:
+        """
+        Esegue il provisioning di tutti i tenant
+
+        Returns:
+            Dict username -> stato finale (done/failed)
+        """
+        from .rclone import MOUNT_PROFILES
+        from .mount import MountManager, MountEngine
+
+        # Verifica/configurazione rclone una sola volta per tutto il batch
+        manager = MountManager()
+        if not manager.detect_available_engines().get(MountEngine.RCLONE):
+            raise RuntimeError("rclone non disponibile - installa con: nextcloud-wrapper mount install")
+        if not manager.configure_engine(MountEngine.RCLONE):
+            raise RuntimeError("configurazione rclone fallita")
+
+        pending = []
+        for tenant in self.tenants:
+            if self.state.tenant_status(tenant.username) == STATUS_DONE:
+                self.progress(tenant.username, "tenant", STATUS_SKIPPED, "già completato")
+                continue
+            if tenant.profile not in MOUNT_PROFILES:
+                self.state.mark(tenant.username, "validate", STATUS_FAILED, f"profilo non valido: {tenant.profile}")
+                self._finish(tenant, STATUS_FAILED, f"profilo non valido: {tenant.profile}")
+                continue
+            if not validate_domain(tenant.username) or not all(validate_domain(s) for s in tenant.subdomains):
+                self.state.mark(tenant.username, "validate", STATUS_FAILED, "dominio non valido")
+                self._finish(tenant, STATUS_FAILED, "dominio non valido")
+                continue
+            pending.append(tenant)
+
+        local_lane = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ncwrap-local")
+
+        def local_task(tenant: TenantSpec) -> None:
+            try:
+                self._local_phase(tenant)
+                self._finish(tenant, STATUS_DONE)
+            except Exception as e:
+                self._finish(tenant, STATUS_FAILED, str(e))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ncwrap-net") as pool:
+                futures = {pool.submit(self._network_phase, t): t for t in pending}
+                # Appena un tenant finisce la fase di rete entra nella corsia locale
+                for future in as_completed(futures):
+                    tenant = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self._finish(tenant, STATUS_FAILED, str(e))
+                        continue
+                    local_lane.submit(local_task, tenant)
+        finally:
+            local_lane.shutdown(wait=True)
+
+        return {t.username: self.state.tenant_status(t.username) for t in self.tenants}
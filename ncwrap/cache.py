@@ -0,0 +1,175 @@
+"""
+Cache delle risposte Nextcloud
+
+- TTLCache: in memoria con scadenza (TTL) e limite di elementi (LRU), per
+  risposte OCS ripetute nello stesso processo (es. esistenza utenti)
+- MetadataCache: su disco per metadati che cambiano di rado (status.php,
+  capabilities), condivisa tra invocazioni CLI e health check; alla
+  scadenza si rivalida con ETag/If-None-Match invece di riscaricare
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from .utils import atomic_write, first_writable_dir
+
+# Directory cache metadati (NC_CACHE_DIR ha la precedenza)
+METADATA_DIRS = ("~/.cache/ncwrap/metadata",)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Dizionario con scadenza per elemento ed espulsione LRU
+
+    Uso:
+        cache = TTLCache(ttl=60, maxsize=4096)
+        value = cache.get_or_set("key", lambda: expensive())
+    """
+
+    def __init__(self, ttl: float = 60.0, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Valore in cache o default se assente/scaduto"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Salva un valore (ttl opzionale diverso dal default)"""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Valore in cache o calcolato con factory() e salvato"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """Rimuove una chiave"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Svuota la cache"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class MetadataCache:
+    """
+    Cache persistente di risposte HTTP per un server (un file JSON per base URL)
+
+    Ogni voce conserva corpo, ETag, Last-Modified e scadenza. La logica
+    HTTP resta al chiamante:
+
+        entry = cache.get(key)
+        if entry and cache.is_fresh(entry):
+            body = entry["body"]                       # nessuna richiesta
+        else:
+            headers = cache.validators(entry)          # If-None-Match
+            ...  # 304 -> cache.touch(key, ttl); 200 -> cache.store(...)
+    """
+
+    def __init__(self, base_url: str, cache_dir: Optional[str] = None):
+        self.base_url = base_url.rstrip("/")
+        directory = cache_dir or first_writable_dir(METADATA_DIRS, "NC_CACHE_DIR")
+        name = hashlib.sha1(self.base_url.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(str(directory), f"{name}.json") if directory else None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("base_url") != self.base_url:
+            return {}
+        return data.get("entries", {})
+
+    def _save(self, entries: Dict[str, Dict]) -> None:
+        if self.path:
+            atomic_write(self.path, json.dumps({"base_url": self.base_url, "entries": entries}), 0o600)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Voce in cache (anche scaduta) o None"""
+        with self._lock:
+            return self._load().get(key)
+
+    @staticmethod
+    def is_fresh(entry: Optional[Dict]) -> bool:
+        """True se la voce esiste e non è scaduta"""
+        return bool(entry) and entry.get("expires", 0) > time.time()
+
+    @staticmethod
+    def validators(entry: Optional[Dict]) -> Dict[str, str]:
+        """Header condizionali per rivalidare una voce scaduta"""
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key: str, body: str, ttl: float, etag: Optional[str] = None,
+              last_modified: Optional[str] = None) -> None:
+        """Salva una risposta 200"""
+        with self._lock:
+            entries = self._load()
+            entries[key] = {
+                "body": body,
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched": time.time(),
+                "expires": time.time() + ttl,
+            }
+            self._save(entries)
+
+    def touch(self, key: str, ttl: float) -> Optional[Dict]:
+        """Proroga una voce dopo un 304 Not Modified"""
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is not None:
+                entry["expires"] = time.time() + ttl
+                self._save(entries)
+            return entry
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Rimuove una voce (o tutte)"""
+        with self._lock:
+            entries = self._load() if key else {}
+            entries.pop(key, None)
+            self._save(entries)
@@ -33,7 +33,7 @@ try:
 except ImportError:
     venv_app = None
 
-from .api import get_nc_config
+from .api import get_nc_config, get_server_status, test_nextcloud_connectivity
 from .utils import check_sudo_privileges
 
 def version_callback(value: bool):
@@ -79,7 +79,9 @@ if venv_app:
 
 
 @app.command()
-def config():
+def config(
+    refresh: bool = typer.Option(False, "--refresh", help="Ignora la cache metadati server e interroga Nextcloud")
+):
     """Mostra configurazione corrente"""
     rprint("[blue]⚙️ Configurazione Nextcloud Wrapper v1.0.0rc2[/blue]")
     
@@ -97,6 +99,10 @@ def config():
         
         console.print(table)
         
+        # Connettività server (status.php + capabilities dalla cache metadati se valida)
+        ok, message = test_nextcloud_connectivity(use_cache=not refresh)
+        rprint(f"[bold]Server Nextcloud:[/bold] {'✅' if ok else '❌'} {message}")
+        
         # Verifica privilegi sudo
         has_sudo = check_sudo_privileges()
         rprint(f"[bold]Privilegi sudo:[/bold] {'✅ Disponibili' if has_sudo else '❌ Non disponibili'}")
@@ -117,10 +123,24 @@ def version():
 
 
 @app.command()
-def status():
+def status(
+    refresh: bool = typer.Option(False, "--refresh", help="Ignora la cache metadati server e interroga Nextcloud")
+):
     """Status generale del sistema"""
     rprint("[blue]📊 Status generale nextcloud-wrapper[/blue]")
     
+    # Server Nextcloud (status.php dalla cache metadati se valida)
+    try:
+        server_status = get_server_status(use_cache=not refresh)
+        if server_status is None:
+            rprint("[bold]Server Nextcloud:[/bold] ❌ Non raggiungibile")
+        elif server_status.get("maintenance"):
+            rprint(f"[bold]Server Nextcloud:[/bold] ⚠️ Manutenzione (v{server_status.get('version', '?')})")
+        else:
+            rprint(f"[bold]Server Nextcloud:[/bold] ✅ v{server_status.get('version', '?')}")
+    except Exception:
+        rprint("[bold]Server Nextcloud:[/bold] ⚠️ Non configurato")
+    
     # Status virtual environment
     try:
         from .venv import VenvManager
@@ -179,5 +199,50 @@ def status():
     rprint("[bold]Gestione spazio:[/bold] ✅ Automatica via rclone (cache LRU)")
 
 
+
+@app.command()
+def exporter(
+    listen: str = typer.Option(":9469", "--listen", help="Indirizzo di ascolto [host]:porta"),
+    interval: int = typer.Option(15, "--interval", help="Intervallo collector mount/rclone/systemd (secondi)"),
+    probe_interval: int = typer.Option(60, "--probe-interval", help="Intervallo sonde latenza OCS/WebDAV (secondi)")
+):
+    """Exporter Prometheus: mount, cache VFS, servizi systemd e latenza API"""
+    from .exporter import MetricsExporter, parse_listen
+    
+    try:
+        host, port = parse_listen(listen)
+    except ValueError as e:
+        rprint(f"[red]❌ {e}[/red]")
+        sys.exit(1)
+    
+    metrics_exporter = MetricsExporter(interval=interval, probe_interval=probe_interval)
+    metrics_exporter.start()
+    rprint(f"[green]📈 Exporter attivo su http://{host or '0.0.0.0'}:{port}/metrics[/green]")
+    try:
+        metrics_exporter.serve(host, port)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        rprint(f"[red]❌ Impossibile ascoltare su {listen}: {e}[/red]")
+        sys.exit(1)
+
+@app.command()
+def watch(
+    probe_interval: int = typer.Option(30, "--probe-interval", help="Intervallo controllo stat() dei mount (secondi)"),
+    stat_timeout: float = typer.Option(5.0, "--stat-timeout", help="Timeout stat() oltre il quale il mount è bloccato"),
+    max_failures: int = typer.Option(0, "--max-failures", help="Fallimenti consecutivi prima della pausa lunga (0 = NC_WATCH_MAX_FAILURES)"),
+    cooldown: int = typer.Option(0, "--cooldown", help="Pausa a circuito aperto in secondi (0 = NC_WATCH_COOLDOWN)")
+):
+    """Watcher dei mount: rimonta subito i mount spariti o bloccati"""
+    from .watcher import MountWatcher
+    
+    watcher = MountWatcher(probe_interval=probe_interval, stat_timeout=stat_timeout,
+                           max_failures=max_failures or None, cooldown=cooldown or None)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+        rprint("[yellow]⏹️ Watcher interrotto[/yellow]")
+
 if __name__ == "__main__":
     app()
@@ -15,7 +15,7 @@ from rich.prompt import Prompt, Confirm
 from .mount import MountManager, setup_user_with_mount
 from .utils import check_sudo_privileges, is_mounted, bytes_to_human, get_directory_size, is_command_available
 from .api import test_webdav_connectivity
-from .rclone import MOUNT_PROFILES, check_connectivity
+from .rclone import MOUNT_PROFILES, check_connectivity, get_mount_source, get_mount_usage
 from .systemd import SystemdManager, list_all_mount_services
 
 mount_app = typer.Typer(help="Gestione mount rclone (engine unico) + servizi")
@@ -25,6 +25,10 @@ console = Console()
 service_app = typer.Typer(help="Gestione servizi systemd")
 mount_app.add_typer(service_app, name="service")
 
+# Sub-app per il supervisore multi-mount (shard rclone rcd)
+supervisor_app = typer.Typer(help="Mount multi-tenant in pochi demoni rclone rcd")
+mount_app.add_typer(supervisor_app, name="supervisor")
+
 
 @mount_app.command("profiles") 
 def list_profiles():
@@ -122,12 +126,11 @@ def mount_user(
             if auto_service:
                 try:
                     service_name = mount_manager.create_systemd_service(
-                        username, profile
+                        username, "", profile=profile, configure_remote=False
                     )
                     
-                    # Abilita servizio
-                    from .utils import run
-                    run(["systemctl", "enable", "--now", f"{service_name}.service"], check=False)
+                    # Abilita servizio (istanza del template: niente daemon-reload)
+                    mount_manager.enable_mount_service(service_name)
                     rprint(f"[green]✅ Servizio automatico: {service_name}[/green]")
                 except Exception as e:
                     rprint(f"[yellow]⚠️ Avviso servizio: {e}[/yellow]")
@@ -215,7 +218,8 @@ def mount_status(
 @mount_app.command("info")
 def mount_info(
     mount_point: str = typer.Argument(help="Directory mount da analizzare"),
-    check_space: bool = typer.Option(False, "--check-space", help="Calcola spazio occupato")
+    check_space: bool = typer.Option(False, "--check-space", help="Calcola spazio occupato"),
+    local_walk: bool = typer.Option(False, "--local-walk", help="Calcola spazio scandendo il mount (lento) invece di chiederlo a Nextcloud")
 ):
     """Informazioni dettagliate su un mount rclone"""
     rprint(f"[blue]🔍 Informazioni mount rclone: {mount_point}[/blue]")
@@ -253,13 +257,210 @@ def mount_info(
     try:
         if is_mounted(mount_point) and check_space:
             rprint(f"\n[yellow]📊 Calcolo spazio utilizzato...[/yellow]")
-            used_space = get_directory_size(mount_point)
+            # Mount rclone: oc:size da Nextcloud; scansione locale solo se richiesta
+            # o se il percorso non è un mount rclone
+            if local_walk or get_mount_source(mount_point) is None:
+                usage = {"used_bytes": get_directory_size(mount_point), "folders": {}}
+            else:
+                usage = get_mount_usage(mount_point)
+                if usage is None:
+                    rprint("[yellow]⚠️ Spazio non disponibile da Nextcloud[/yellow]")
+                    rprint("💡 Usa --local-walk per scandire il mount (lento)")
+                    return
             rprint(f"\n[bold]💾 Utilizzo spazio:[/bold]")
-            rprint(f"• Spazio utilizzato: {bytes_to_human(used_space)}")
+            rprint(f"• Spazio utilizzato: {bytes_to_human(usage['used_bytes'])}")
+            if "available_bytes" in usage:
+                rprint(f"• Spazio disponibile: {bytes_to_human(usage['available_bytes'])}")
             rprint(f"• Gestione cache: automatica via rclone")
+
+            if usage["folders"]:
+                space_table = Table(title="Cartelle principali (oc:size)")
+                space_table.add_column("Cartella", style="cyan")
+                space_table.add_column("Dimensione", style="white", justify="right")
+                for name, size in sorted(usage["folders"].items(), key=lambda item: -item[1]):
+                    space_table.add_row(name, bytes_to_human(size))
+                if usage.get("files"):
+                    space_table.add_row(f"({usage['files']} file nella root)", bytes_to_human(usage["files_bytes"]))
+                console.print(space_table)
     except Exception as e:
         rprint(f"[yellow]⚠️ Errore informazioni spazio: {e}[/yellow]")
 
+@mount_app.command("stats")
+def mount_stats(
+    mount_point: str = typer.Argument(None, help="Mount point (default: tutti i mount rclone)"),
+    json_output: bool = typer.Option(False, "--json", help="Output JSON"),
+    watch: int = typer.Option(0, "--watch", help="Aggiorna ogni N secondi (0 = una volta)")
+):
+    """Statistiche live per mount: trasferimenti, cache VFS, coda upload"""
+    import json
+    from .mountstats import collect_all_stats
+    
+    previous = {}
+    while True:
+        stats = collect_all_stats([mount_point] if mount_point else None)
+        
+        # Velocità istantanea dal delta tra due campioni (--watch)
+        for item in stats:
+            before = previous.get(item["mount_point"])
+            if before and "transfers" in item and "transfers" in before:
+                elapsed = item["timestamp"] - before["timestamp"]
+                delta = item["transfers"]["bytes"] - before["transfers"]["bytes"]
+                item["transfers"]["rate"] = round(max(delta, 0) / elapsed, 1) if elapsed > 0 else 0.0
+        previous = {item["mount_point"]: item for item in stats}
+        
+        if json_output:
+            print(json.dumps(stats, indent=2))
+        else:
+            if watch:
+                console.clear()
+            _print_mount_stats(stats)
+        
+        if not watch:
+            return
+        time.sleep(watch)
+
+
+def _print_mount_stats(stats):
+    if not stats:
+        rprint("[yellow]Nessun mount rclone attivo[/yellow]")
+        return
+    
+    table = Table(title="Statistiche mount rclone")
+    table.add_column("Mount Point", style="cyan")
+    table.add_column("Scaricati", style="white", justify="right")
+    table.add_column("Velocità", style="white", justify="right")
+    table.add_column("Attivi", style="white", justify="right")
+    table.add_column("Cache", style="yellow", justify="right")
+    table.add_column("Riempimento", style="yellow", justify="right")
+    table.add_column("Upload in coda", style="magenta", justify="right")
+    table.add_column("Errori", style="red", justify="right")
+    
+    for item in stats:
+        name = item["mount_point"] + (f" ({item['shard']})" if item.get("shard") else "")
+        if "error" in item:
+            table.add_row(name, "-", "-", "-", "-", "-", "-", f"⚠️ {item['error']}")
+            continue
+        transfers, vfs = item["transfers"], item["vfs"]
+        speed = transfers.get("rate", transfers["speed"])
+        fill = f"{vfs['cache_fill'] * 100:.0f}%" if vfs["cache_fill"] is not None else "N/A"
+        cache = bytes_to_human(vfs["cache_bytes"]) if vfs["cache_bytes"] is not None else "N/A"
+        table.add_row(
+            name,
+            bytes_to_human(transfers["bytes"]),
+            f"{bytes_to_human(speed)}/s",
+            str(transfers["active"]),
+            cache,
+            fill,
+            f"{vfs['uploads_queued']} (+{vfs['uploads_in_progress']})",
+            str(transfers["errors"] + vfs["errored_files"])
+        )
+    console.print(table)
+    if any(item.get("scope") == "shard" for item in stats):
+        rprint("💡 Mount del supervisore: trasferimenti aggregati per shard")
+
+
+@mount_app.command("tune")
+def mount_tune(
+    username: str = typer.Argument(help="Nome utente"),
+    mount_point: str = typer.Option(None, "--mount-point", help="Mount point (default /home/<utente>)"),
+    window: int = typer.Option(300, "--window", help="Durata campionamento (secondi)"),
+    interval: int = typer.Option(10, "--interval", help="Intervallo tra campioni (secondi)"),
+    budget: str = typer.Option(None, "--disk-budget", help="Budget cache locale (es. 20G; default quota dello spazio libero)"),
+    apply: bool = typer.Option(False, "--apply", help="Salva il profilo generato per i prossimi mount"),
+    restart: bool = typer.Option(False, "--restart", help="Con --apply: rimonta subito con il nuovo profilo"),
+    reset: bool = typer.Option(False, "--reset", help="Elimina il profilo generato e torna a quello statico")
+):
+    """Campiona il carico reale del mount e genera un profilo su misura"""
+    from .tuner import (sample_workload, recommend_options, disk_budget, save_tuned_profile,
+                        remove_tuned_profile, load_tuned_profile)
+    from .rclone_rc import RcloneRCError
+    from .utils import parse_size_to_bytes
+    
+    remote_name = f"nc-{username}"
+    mount_point = mount_point or f"/home/{username}"
+    
+    if reset:
+        if remove_tuned_profile(remote_name):
+            rprint(f"[green]✅ Profilo generato rimosso per {remote_name}[/green]")
+            rprint("💡 Rimonta per tornare al profilo statico")
+        else:
+            rprint(f"[yellow]⚠️ Nessun profilo generato per {remote_name}[/yellow]")
+        return
+    
+    rprint(f"[blue]🎛️ Campionamento {mount_point} per {window}s (ogni {interval}s)...[/blue]")
+    try:
+        summary = sample_workload(mount_point, window=window, interval=interval)
+    except (RcloneRCError, OSError) as e:
+        rprint(f"[red]❌ {e}[/red]")
+        sys.exit(1)
+    
+    if budget:
+        try:
+            limit = parse_size_to_bytes(budget)
+        except ValueError as e:
+            rprint(f"[red]❌ {e}[/red]")
+            sys.exit(1)
+    else:
+        limit = disk_budget(summary["cache_end"])
+    recommendation = recommend_options(summary, limit)
+    
+    table = Table(title=f"Carico osservato {mount_point}")
+    table.add_column("Metrica", style="cyan")
+    table.add_column("Valore", style="white")
+    table.add_row("Campioni", str(summary["samples"]))
+    transferred = bytes_to_human(summary["bytes_transferred"])
+    if summary["scope"] == "shard":
+        transferred += " (intero shard)"
+    table.add_row("Byte trasferiti", transferred)
+    cache_max = bytes_to_human(summary["cache_max"]) if summary["cache_max"] else "N/A"
+    table.add_row("Cache (picco / limite)", f"{bytes_to_human(summary['cache_peak'])} / {cache_max}")
+    table.add_row("Cache satura", "⚠️ Sì" if summary["saturated"] else "No")
+    table.add_row("Working set stimato", bytes_to_human(recommendation["working_set"]))
+    if summary["read_ratio"] is not None:
+        table.add_row("Frazione letta per file", f"{summary['read_ratio']:.0%} ({summary['files_observed']} file)")
+    table.add_row("Picco file aperti", str(summary["open_files_peak"]))
+    table.add_row("Picco upload in coda", str(summary["uploads_peak"]))
+    table.add_row("Budget disco", bytes_to_human(limit))
+    console.print(table)
+    
+    rprint("\n[bold]Raccomandazione:[/bold]")
+    for reason in recommendation["reasons"]:
+        rprint(f"  • {reason}")
+    rprint(f"  [cyan]{' '.join(recommendation['options'])}[/cyan]")
+    
+    if not apply:
+        previous = load_tuned_profile(remote_name)
+        if previous:
+            rprint(f"💡 Profilo attuale: {' '.join(previous['options'])}")
+        rprint("💡 Applica con --apply (e --restart per rimontare subito)")
+        return
+    
+    try:
+        path = save_tuned_profile(remote_name, mount_point, summary, recommendation)
+    except RuntimeError as e:
+        rprint(f"[red]❌ {e}[/red]")
+        sys.exit(1)
+    rprint(f"[green]✅ Profilo salvato: {path}[/green]")
+    
+    if not restart:
+        rprint("💡 Verrà usato al prossimo mount (anche dal servizio systemd)")
+        return
+    
+    from .supervisor import MountSupervisor
+    supervisor = MountSupervisor()
+    if supervisor.manages(mount_point):
+        spec = supervisor.desired()[os.path.realpath(mount_point)]
+        supervisor.remove(mount_point)
+        supervisor.add(remote_name, mount_point, spec["profile"], spec.get("custom_options"))
+        rprint("[green]✅ Rimontato nel supervisore con il nuovo profilo[/green]")
+    else:
+        service_name = MountManager().mount_service_name(username)
+        if SystemdManager().restart_service(service_name):
+            rprint(f"[green]✅ Servizio {service_name} riavviato[/green]")
+        else:
+            rprint(f"[yellow]⚠️ Riavvio {service_name} fallito: rimonta manualmente[/yellow]")
+
+
 @mount_app.command()
 def start(remote_name: str, mount_point: str, 
          profile: str = typer.Option("full", help="Mount profile"),
@@ -733,17 +934,13 @@ def recreate_service(
         password = Prompt.ask(f"Password per {username}", password=True)
     
     try:
-        service_name = f"ncwrap-rclone-{username}"
+        mount_manager = MountManager()
+        service_name = mount_manager.mount_service_name(username)
         remote_name = f"nc-{username}"
         home_path = f"/home/{username}"
         
-        # Verifica se servizio esiste già
-        try:
-            from .utils import run
-            check_result = run(["systemctl", "status", f"{service_name}.service"], check=False)
-            service_exists = "could not be found" not in check_result
-        except:
-            service_exists = False
+        # Verifica se servizio esiste già (istanza del template o unit per-utente)
+        service_exists = mount_manager.has_systemd_service(username)
         
         if service_exists and not force:
             rprint(f"[yellow]⚠️ Servizio {service_name} già esiste[/yellow]")
@@ -758,19 +955,15 @@ def recreate_service(
             rprint("💡 Verifica credenziali e configurazione")
             sys.exit(1)
         
-        # Ferma servizio esistente se attivo
+        # Ferma e rimuove il servizio esistente (il setup crea l'istanza del template)
         if service_exists:
             rprint(f"[blue]⏹️ Fermo servizio esistente: {service_name}[/blue]")
-            try:
-                run(["systemctl", "stop", f"{service_name}.service"], check=False)
-                run(["systemctl", "disable", f"{service_name}.service"], check=False)
-            except:
-                pass
+            mount_manager.remove_systemd_service(username)
+            service_name = mount_manager.mount_service_name(username)
         
         # Smonta se necessario
         if is_mounted(home_path):
             rprint(f"[blue]📁 Smonto mount esistente: {home_path}[/blue]")
-            mount_manager = MountManager()
             mount_manager.unmount_user_home(home_path)
         
         # ✅ SOLUZIONE SEMPLICE: USA IL SETUP ESISTENTE!
@@ -822,6 +1015,158 @@ def recreate_service(
         sys.exit(1)
 
 
+@service_app.command("migrate")
+def migrate_services(
+    dry_run: bool = typer.Option(False, "--dry-run", help="Mostra le unit da migrare senza modificarle")
+):
+    """Converte le unit ncwrap-rclone-<utente> in istanze di ncwrap-rclone@.service"""
+    if not dry_run and not check_sudo_privileges():
+        rprint("[red]❌ Privilegi sudo richiesti[/red]")
+        sys.exit(1)
+    
+    results = MountManager().migrate_legacy_units(dry_run=dry_run)
+    units = results["units"]
+    if not units:
+        rprint("[green]✅ Nessuna unit per-utente da migrare[/green]")
+        return
+    
+    table = Table(title="Unit per-utente" + (" (dry-run)" if dry_run else ""))
+    table.add_column("Utente", style="cyan")
+    table.add_column("Remote", style="white")
+    table.add_column("Mount point", style="blue")
+    table.add_column("Profilo", style="yellow")
+    table.add_column("Esito", style="green")
+    for username, spec in sorted(units.items()):
+        if dry_run:
+            outcome = f"→ ncwrap-rclone@{username}"
+        elif username in results["migrated"]:
+            outcome = "✅ migrata"
+        else:
+            outcome = f"❌ {results['failed'].get(username, '?')}"
+        table.add_row(username, spec["remote"], spec["mount_point"], spec["profile"], outcome)
+    console.print(table)
+    
+    if dry_run:
+        rprint("💡 Esegui senza --dry-run per migrare (i mount vengono riavviati)")
+    elif results["failed"]:
+        rprint(f"[yellow]⚠️ {len(results['migrated'])} migrate, {len(results['failed'])} fallite[/yellow]")
+        sys.exit(1)
+    else:
+        rprint(f"[green]✅ {len(results['migrated'])} unit migrate al template ncwrap-rclone@.service[/green]")
+
+
+@supervisor_app.command("add")
+def supervisor_add(
+    username: str = typer.Argument(help="Nome utente (remote nc-<utente>)"),
+    mount_point: str = typer.Option(None, "--mount-point", help="Mount point (default /home/<utente>)"),
+    profile: str = typer.Option("full", "--profile", help="Profilo mount")
+):
+    """Monta la home di un utente in uno shard del supervisore"""
+    if not check_sudo_privileges():
+        rprint("[red]❌ Richiesti privilegi sudo[/red]")
+        sys.exit(1)
+    
+    from .supervisor import MountSupervisor
+    
+    mount_point = mount_point or f"/home/{username}"
+    try:
+        shard = MountSupervisor().add(f"nc-{username}", mount_point, profile)
+        rprint(f"[green]✅ {mount_point} montato nello shard {shard}[/green]")
+    except (ValueError, RuntimeError) as e:
+        rprint(f"[red]❌ Errore: {e}[/red]")
+        sys.exit(1)
+
+
+@supervisor_app.command("remove")
+def supervisor_remove(
+    mount_point: str = typer.Argument(help="Mount point gestito")
+):
+    """Smonta e rimuove un mount dal supervisore"""
+    from .supervisor import MountSupervisor
+    
+    try:
+        if MountSupervisor().remove(mount_point):
+            rprint(f"[green]✅ {mount_point} smontato[/green]")
+        else:
+            rprint(f"[yellow]⚠️ {mount_point} non gestito dal supervisore[/yellow]")
+    except RuntimeError as e:
+        rprint(f"[red]❌ Errore: {e}[/red]")
+        sys.exit(1)
+
+
+@supervisor_app.command("list")
+def supervisor_list():
+    """Mount gestiti dal supervisore con stato degli shard"""
+    from .supervisor import MountSupervisor
+    
+    try:
+        mounts = MountSupervisor().list()
+    except RuntimeError as e:
+        rprint(f"[red]❌ Errore: {e}[/red]")
+        sys.exit(1)
+    
+    if not mounts:
+        rprint("[yellow]Nessun mount gestito dal supervisore[/yellow]")
+        rprint("💡 Aggiungi mount con: nextcloud-wrapper mount supervisor add <utente>")
+        return
+    
+    status_icons = {"active": "🟢 Attivo", "missing": "🟡 Mancante", "shard down": "🔴 Shard down"}
+    table = Table(title="Mount supervisore")
+    table.add_column("Mount point", style="cyan")
+    table.add_column("Remote", style="white")
+    table.add_column("Profilo", style="yellow")
+    table.add_column("Shard", style="blue")
+    table.add_column("Stato", style="green")
+    
+    for mount in mounts:
+        table.add_row(
+            mount["mount_point"],
+            mount["remote"],
+            mount["profile"],
+            mount["shard"],
+            status_icons.get(mount["status"], mount["status"])
+        )
+    console.print(table)
+
+
+@supervisor_app.command("reconcile")
+def supervisor_reconcile(
+    interval: int = typer.Option(0, "--interval", help="Ripeti ogni N secondi (0 = una volta)")
+):
+    """Riavvia gli shard caduti e rimonta i mount mancanti"""
+    from .supervisor import MountSupervisor
+    
+    try:
+        supervisor = MountSupervisor()
+    except RuntimeError as e:
+        rprint(f"[red]❌ Errore: {e}[/red]")
+        sys.exit(1)
+    
+    while True:
+        stats = supervisor.reconcile()
+        if stats["remounted"] or stats["shards_restarted"] or stats["failed"] or not interval:
+            rprint(f"🔄 Attivi: {stats['active']} | Rimontati: {stats['remounted']} | "
+                   f"Shard riavviati: {stats['shards_restarted']} | Falliti: {stats['failed']}")
+        if not interval:
+            if stats["failed"]:
+                sys.exit(1)
+            return
+        time.sleep(interval)
+
+
+@supervisor_app.command("shutdown")
+def supervisor_shutdown(
+    confirm: bool = typer.Option(False, "--yes", help="Non chiedere conferma")
+):
+    """Ferma tutti gli shard (smonta tutti i mount gestiti)"""
+    from .supervisor import MountSupervisor
+    
+    if not confirm and not Confirm.ask("Smontare tutti i mount del supervisore?"):
+        return
+    MountSupervisor().shutdown()
+    rprint("[green]✅ Shard supervisore fermati[/green]")
+
+
 
 if __name__ == "__main__":
     mount_app()
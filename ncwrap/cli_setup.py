@@ -193,6 +193,81 @@ def quick(
     )
 
 
+@setup_app.command()
+def bulk(
+    tenants_file: str = typer.Argument(help="File tenant .csv (con intestazione) o .jsonl"),
+    workers: int = typer.Option(8, "--workers", "-w", help="Worker paralleli per le fasi di rete"),
+    state_file: str = typer.Option(None, "--state", help="File stato per ripresa (default: <file>.state.json)"),
+    profile: str = typer.Option("full", "--profile", help="Profilo rclone predefinito"),
+    auth_mode: str = typer.Option("bearer", "--auth-mode", help="Metodo autenticazione predefinito: bearer o basic"),
+    skip_linux: bool = typer.Option(False, "--skip-linux", help="Non creare utenti Linux"),
+    auto_service: bool = typer.Option(True, "--service/--no-service", help="Crea e abilita servizi systemd")
+):
+    """
+    Setup massivo tenant da file CSV/JSONL
+
+    Campi: username, password, quota, profile, subdomains, auth_mode
+    (profile/auth_mode opzionali, subdomains separati da virgola).
+    Un run interrotto riprende dagli step non completati.
+
+    Esempi:
+    • nextcloud-wrapper setup bulk tenants.csv --workers 16
+    • nextcloud-wrapper setup bulk tenants.jsonl --no-service --skip-linux
+    """
+    from .bulk import BulkProvisioner, load_tenants
+
+    if auth_mode not in ["bearer", "basic"]:
+        rprint(f"[red]❌ auth-mode non valido: {auth_mode}[/red]")
+        sys.exit(1)
+
+    if not check_sudo_privileges():
+        rprint("[red]❌ Privilegi sudo richiesti per mount e servizi[/red]")
+        rprint("💡 Usa: sudo nextcloud-wrapper setup bulk ...")
+        sys.exit(1)
+
+    try:
+        tenants = load_tenants(tenants_file, profile, auth_mode)
+    except (OSError, ValueError) as e:
+        rprint(f"[red]❌ Errore lettura {tenants_file}: {e}[/red]")
+        sys.exit(1)
+
+    state_path = state_file or f"{tenants_file}.state.json"
+    rprint(f"[bold blue]🚀 Setup bulk: {len(tenants)} tenant, {workers} worker[/bold blue]")
+    rprint(f"[cyan]Stato: {state_path}[/cyan]")
+
+    icons = {"running": "⏳", "done": "✅", "failed": "❌", "skipped": "⏭️"}
+
+    def progress(user_name: str, step: str, status: str, message: str):
+        if status == "running":
+            return
+        line = f"{icons.get(status, '•')} {user_name} [{step}] {status}"
+        if message:
+            line += f" - {message}"
+        console.print(line, markup=False, highlight=False)
+
+    try:
+        provisioner = BulkProvisioner(
+            tenants, state_path, workers=workers, skip_linux=skip_linux,
+            create_service=auto_service, progress=progress
+        )
+        results = provisioner.run()
+    except Exception as e:
+        rprint(f"[bold red]💥 Errore durante setup bulk: {str(e)}[/bold red]")
+        sys.exit(1)
+
+    done = [u for u, s in results.items() if s == "done"]
+    failed = [u for u, s in results.items() if s != "done"]
+
+    rprint(f"\n[bold]📊 Riepilogo:[/bold] {len(done)} completati, {len(failed)} falliti")
+    for user_name in failed:
+        error = provisioner.state.data.get(user_name, {}).get("error", "")
+        rprint(f"[red]❌ {user_name}[/red] {error}")
+
+    if failed:
+        rprint(f"💡 Rilancia lo stesso comando per riprendere: nextcloud-wrapper setup bulk {tenants_file}")
+        sys.exit(1)
+
+
 @setup_app.command()
 def profiles():
     """​​Mostra profili rclone disponibili"""
@@ -4,6 +4,7 @@ Solo rclone, zero quote filesystem
 """
 import typer
 import sys
+import time
 from rich.console import Console
 from rich.table import Table
 from rich import print as rprint
@@ -13,7 +14,9 @@ from .api import (
     test_webdav_login, 
     check_user_exists,
     get_webdav_url,
-    set_nc_password
+    set_nc_password,
+    list_nc_users,
+    get_users_info
 )
 from .system import (
     create_linux_user, 
@@ -22,7 +25,7 @@ from .system import (
     user_exists,
     get_system_users
 )
-from .utils import check_sudo_privileges, is_mounted
+from .utils import check_sudo_privileges, is_mounted, bytes_to_human
 
 user_app = typer.Typer(help="Gestione utenti v1.0")
 console = Console()
@@ -92,6 +95,47 @@ def test_user(
         sys.exit(1)
 
 
+@user_app.command("upload")
+def upload_file(
+    username: str = typer.Argument(help="Nome utente"),
+    password: str = typer.Argument(help="Password"),
+    local_path: str = typer.Argument(help="File locale"),
+    remote_path: str = typer.Argument(help="Percorso destinazione su Nextcloud"),
+    chunk_mb: int = typer.Option(None, "--chunk-mb", help="Dimensione blocco in MiB (default NC_UPLOAD_CHUNK_MB=16)"),
+    parallel: int = typer.Option(None, "--parallel", "-p", help="Blocchi inviati in parallelo (default NC_UPLOAD_PARALLEL=4)")
+):
+    """Carica un file a blocchi paralleli (riprende da dove si era interrotto)"""
+    from .transfer import upload_file_chunked, MiB
+
+    rprint(f"[blue]⬆️ Upload {local_path} → {username}:{remote_path}[/blue]")
+
+    def progress(sent: int, total: int):
+        console.print(f"  {sent / MiB:.0f}/{total / MiB:.0f} MiB", end="\r")
+
+    try:
+        result = upload_file_chunked(
+            local_path, remote_path, username, password,
+            chunk_size=chunk_mb * MiB if chunk_mb else None,
+            parallel=parallel, progress=progress
+        )
+    except FileNotFoundError:
+        rprint(f"[red]❌ File non trovato: {local_path}[/red]")
+        sys.exit(1)
+    except Exception as e:
+        rprint(f"\n[red]❌ Upload interrotto: {e}[/red]")
+        rprint("💡 Rilancia lo stesso comando per riprendere")
+        sys.exit(1)
+
+    if not result.success:
+        rprint(f"\n[red]❌ Upload fallito: HTTP {result.status_code}[/red]")
+        sys.exit(1)
+
+    rprint(f"\n[green]✅ Upload completato: {result.size / MiB:.1f} MiB in {result.elapsed:.1f}s "
+           f"({result.mb_per_s:.1f} MiB/s)[/green]")
+    if result.resumed:
+        rprint(f"[cyan]🔄 Ripreso: {result.chunks_skipped}/{result.chunks_total} blocchi già sul server[/cyan]")
+
+
 @user_app.command("passwd")
 def change_password(
     username: str = typer.Argument(help="Nome utente"),
@@ -198,9 +242,61 @@ def user_info(
     rprint("[bold]Gestione spazio:[/bold] ✅ Automatica via rclone")
 
 
+@user_app.command("index")
+def user_index(
+    username: str = typer.Argument(help="Nome utente"),
+    password: str = typer.Option(None, "--password", "-p", help="Password/App Password: aggiorna l'indice dal server"),
+    path: str = typer.Option("", "--path", help="Sottocartella da riepilogare"),
+    changes: int = typer.Option(0, "--changes", help="Mostra le ultime N modifiche rilevate"),
+    workers: int = typer.Option(8, "--workers", help="PROPFIND paralleli durante l'aggiornamento")
+):
+    """Indice metadati remoti: dimensione, file e modifiche senza interrogare il server"""
+    from .index import RemoteIndex
+
+    try:
+        with RemoteIndex(username) as index:
+            if password:
+                rprint(f"[blue]🔄 Aggiornamento indice {username}...[/blue]")
+                stats = index.refresh(password, max_workers=workers)
+                rprint(f"[green]✅ Indice aggiornato in {stats['elapsed']:.2f}s[/green] "
+                       f"(+{stats['added']} ~{stats['modified']} -{stats['deleted']})")
+
+            summary = index.summary(path)
+            if summary["refreshed_at"] is None:
+                rprint(f"[yellow]⚠️ Indice vuoto per {username}[/yellow]")
+                rprint(f"💡 Usa: nextcloud-wrapper user index {username} --password <password>")
+                return
+
+            table = Table(title=f"Indice {username}:/{path.strip('/')}")
+            table.add_column("Campo", style="cyan")
+            table.add_column("Valore", style="white")
+            table.add_row("Dimensione", bytes_to_human(summary["size"] or 0))
+            table.add_row("File", str(summary["files"]))
+            table.add_row("Cartelle", str(summary["folders"]))
+            quota = index.quota()
+            if quota.get("quota_available", -1) >= 0:
+                table.add_row("Quota libera", bytes_to_human(quota["quota_available"]))
+            table.add_row("Aggiornato", time.strftime("%Y-%m-%d %H:%M:%S",
+                                                      time.localtime(summary["refreshed_at"])))
+            console.print(table)
+
+            if changes:
+                rows = index.changes(limit=changes)
+                if not rows:
+                    rprint("[cyan]Nessuna modifica nell'ultimo aggiornamento[/cyan]")
+                icons = {"added": "[green]+[/green]", "modified": "[yellow]~[/yellow]", "deleted": "[red]-[/red]"}
+                for row in rows:
+                    rprint(f"{icons.get(row['change'], '?')} {row['path']}")
+
+    except Exception as e:
+        rprint(f"[red]❌ Errore indice: {e}[/red]")
+        sys.exit(1)
+
+
 @user_app.command("list")
 def list_users(
-    show_system: bool = typer.Option(False, "--show-system", help="Mostra anche utenti di sistema")
+    show_system: bool = typer.Option(False, "--show-system", help="Mostra anche utenti di sistema"),
+    details: bool = typer.Option(False, "--details", help="Mostra quota Nextcloud (richieste parallele per utente)")
 ):
     """Lista tutti gli utenti con informazioni mount rclone"""
     rprint("[blue]👥 Utenti sistema con informazioni mount[/blue]")
@@ -212,41 +308,62 @@ def list_users(
             rprint("[yellow]Nessun utente trovato[/yellow]")
             return
         
+        # Una sola lista paginata degli utenti Nextcloud invece di una ricerca per utente
+        try:
+            nc_users = set(list_nc_users())
+        except Exception as e:
+            rprint(f"[yellow]⚠️ Lista utenti Nextcloud non disponibile: {e}[/yellow]")
+            nc_users = None
+        
+        nc_details = {}
+        if details and nc_users:
+            nc_details = get_users_info([u["username"] for u in users if u["username"] in nc_users])
+        
         table = Table(title="Utenti Sistema")
         table.add_column("Username", style="cyan")
         table.add_column("UID", style="white")
         table.add_column("Home", style="blue")
         table.add_column("Mount rclone", style="green")
         table.add_column("Nextcloud", style="yellow")
+        if details:
+            table.add_column("Quota", style="magenta")
         
+        mounted_users = 0
         for user in users:
             username = user["username"]
             
             # Verifica se è utente Nextcloud
-            try:
-                nc_exists = check_user_exists(username) if user.get("is_nextcloud_user") else False
-                nc_status = "✅" if nc_exists else "❌"
-            except:
+            if nc_users is None:
                 nc_status = "❓"
+            else:
+                nc_exists = user.get("is_nextcloud_user") and username in nc_users
+                nc_status = "✅" if nc_exists else "❌"
             
             # Status mount rclone
             home_path = user.get("home", "")
-            mount_status = "✅ Attivo" if is_mounted(home_path) else "❌ Non montato"
+            mounted = is_mounted(home_path)
+            mounted_users += mounted
+            mount_status = "✅ Attivo" if mounted else "❌ Non montato"
             
-            table.add_row(
+            row = [
                 username,
                 str(user["uid"]),
                 home_path,
                 mount_status,
                 nc_status
-            )
+            ]
+            if details:
+                info = nc_details.get(username) or {}
+                if "quota_used" in info:
+                    row.append(f"{bytes_to_human(info['quota_used'])} / {info.get('quota', 'none')}")
+                else:
+                    row.append(info.get("quota", "-"))
+            table.add_row(*row)
             
         console.print(table)
         
         # Statistiche
         total_users = len(users)
-        mounted_users = sum(1 for user in users if is_mounted(user.get("home", "")))
-        
         rprint(f"\n[bold]📊 Riepilogo:[/bold]")
         rprint(f"• Utenti totali: {total_users}")
         rprint(f"• Con mount rclone: {mounted_users}")
@@ -293,19 +410,9 @@ def delete_user(
         
         # Rimuovi servizi systemd
         try:
-            from .utils import run
-            services_output = run(["systemctl", "list-units", "--all"], check=False)
-            if f"ncwrap-rclone-{username}" in services_output:
-                rprint("[yellow]🔧 Rimuovendo servizio systemd...[/yellow]")
-                run(["systemctl", "stop", f"ncwrap-rclone-{username}.service"], check=False)
-                run(["systemctl", "disable", f"ncwrap-rclone-{username}.service"], check=False)
-                
-                import os
-                service_file = f"/etc/systemd/system/ncwrap-rclone-{username}.service"
-                if os.path.exists(service_file):
-                    os.remove(service_file)
-                    run(["systemctl", "daemon-reload"], check=False)
-                    rprint("[green]✅ Servizio systemd rimosso[/green]")
+            from .mount import MountManager
+            if MountManager().remove_systemd_service(username):
+                rprint("[green]✅ Servizio systemd rimosso[/green]")
         except Exception as e:
             rprint(f"[yellow]⚠️ Errore rimozione servizio: {e}[/yellow]")
         
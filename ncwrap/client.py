@@ -0,0 +1,203 @@
+"""
+Client HTTP condiviso per API Nextcloud (OCS e WebDAV)
+
+Una requests.Session per host con pool di connessioni keep-alive: le chiamate
+consecutive riusano le connessioni TCP/TLS già aperte invece di rifare
+l'handshake ad ogni richiesta.
+Ogni richiesta passa dal rate limiter condiviso dell'host (ratelimit.py):
+un 429 rallenta tutti i processi che parlano con lo stesso Nextcloud.
+La latenza di ogni richiesta alimenta l'istogramma di metrics.py.
+"""
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import observe_request
+from .ratelimit import get_limiter, parse_retry_after
+from .utils import env_int
+
+# Dimensione pool per host (connessioni keep-alive riutilizzabili)
+DEFAULT_POOL_SIZE = 32
+# Timeout predefinito se il chiamante non lo specifica
+DEFAULT_TIMEOUT = 30
+
+
+class NextcloudClient:
+    """
+    Client HTTP con una Session keep-alive per ogni host Nextcloud
+
+    Le credenziali sono passate per singola richiesta (admin per OCS,
+    utente per WebDAV): la stessa connessione può servire utenti diversi.
+    I cookie di sessione Nextcloud non vengono conservati, altrimenti la
+    sessione di un utente verrebbe inviata con le richieste di un altro.
+    """
+
+    def __init__(self, pool_size: Optional[int] = None, pool_block: bool = False,
+                 rate_limited: bool = True):
+        self.pool_size = pool_size or env_int("NC_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+        self.pool_block = pool_block
+        self.rate_limited = rate_limited
+        self._sessions: Dict[str, requests.Session] = {}
+        self._adapters: Dict[str, HTTPAdapter] = {}
+        self._request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        """Chiave pool: schema + host + porta"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def _create_session(self) -> Tuple[requests.Session, HTTPAdapter]:
+        """Crea Session con adapter dimensionato e cookie disabilitati"""
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.headers.update({"Connection": "keep-alive"})
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=self.pool_block,
+            max_retries=0,  # Retry gestiti da make_request_with_retry
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session, adapter
+
+    def session_for(self, url: str) -> requests.Session:
+        """Ritorna la Session associata all'host dell'URL (creandola se serve)"""
+        key = self._host_key(url)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session, adapter = self._create_session()
+                self._sessions[key] = session
+                self._adapters[key] = adapter
+                self._request_counts[key] = 0
+            return session
+
+    def limiter_for(self, url: str):
+        """Limiter applicato alle richieste verso l'host dell'URL (None se disattivato)"""
+        return get_limiter(url) if self.rate_limited else None
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Esegue una richiesta HTTP sul pool dell'host
+
+        Attende un token dal limiter dell'host; una risposta 429 riduce il
+        rate condiviso (rispettando Retry-After), le altre lo fanno risalire.
+
+        Args:
+            method: Metodo HTTP (GET, PUT, PROPFIND, MKCOL, ...)
+            url: URL completo
+            **kwargs: Parametri requests (auth, headers, data, timeout, ...)
+
+        Returns:
+            Response object
+        """
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        session = self.session_for(url)
+        key = self._host_key(url)
+        with self._lock:
+            self._request_counts[key] = self._request_counts.get(key, 0) + 1
+
+        limiter = self.limiter_for(url)
+        if limiter is not None:
+            limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            observe_request(method, url, None, time.monotonic() - started)
+            raise
+        observe_request(method, url, response.status_code, time.monotonic() - started)
+        if limiter is not None:
+            if response.status_code == 429:
+                limiter.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
+            else:
+                limiter.on_success()
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Metriche pool per host
+
+        Returns:
+            Dict host -> {requests, new_connections, reused, hit_ratio, pool_size}
+        """
+        report = {}
+        with self._lock:
+            items = list(self._adapters.items())
+            counts = dict(self._request_counts)
+
+        for key, adapter in items:
+            new_connections = 0
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    new_connections += getattr(pool, "num_connections", 0)
+
+            total = counts.get(key, 0)
+            reused = max(total - new_connections, 0)
+            report[key] = {
+                "requests": total,
+                "new_connections": new_connections,
+                "reused": reused,
+                "hit_ratio": (reused / total) if total else 0.0,
+                "pool_size": self.pool_size,
+            }
+        return report
+
+    def close(self) -> None:
+        """Chiude tutte le Session e le connessioni aperte"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._adapters.clear()
+            self._request_counts.clear()
+
+
+_client: Optional[NextcloudClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> NextcloudClient:
+    """Ritorna il client condiviso di processo"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = NextcloudClient()
+    return _client
+
+
+def reset_client() -> None:
+    """Chiude e scarta il client condiviso (es. dopo fork o cambio config)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -0,0 +1,302 @@
+"""
+Parser XML incrementale per risposte WebDAV multistatus e OCS
+
+Il corpo viene consumato a blocchi con XMLPullParser: ogni <d:response>
+viene trasformata in un DavEntry e subito rimossa dall'albero, quindi la
+memoria resta costante qualunque sia il numero di elementi della cartella.
+"""
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Union
+from urllib.parse import unquote
+
+DAV_NS = "DAV:"
+OC_NS = "http://owncloud.org/ns"
+NC_NS = "http://nextcloud.org/ns"
+
+# Dimensione blocchi letti dal body della risposta
+CHUNK_SIZE = 64 * 1024
+
+# Body PROPFIND con le proprietà usate dal wrapper
+PROPFIND_BODY = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+    "<d:prop>"
+    "<d:resourcetype/><d:getetag/><d:getlastmodified/>"
+    "<d:getcontentlength/><d:getcontenttype/>"
+    "<d:quota-used-bytes/><d:quota-available-bytes/>"
+    "<oc:size/><oc:fileid/>"
+    "</d:prop>"
+    "</d:propfind>"
+)
+
+# Body PROPFIND ridotto per il calcolo spazio: Nextcloud restituisce oc:size
+# (ricorsiva, precalcolata nella filecache) senza scendere nelle sottocartelle
+USAGE_PROPFIND_BODY = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+    "<d:prop>"
+    "<d:resourcetype/><d:getcontentlength/>"
+    "<d:quota-used-bytes/><d:quota-available-bytes/>"
+    "<oc:size/>"
+    "</d:prop>"
+    "</d:propfind>"
+)
+
+Source = Union[str, bytes, Iterable[bytes], Any]
+
+
+def _tag(ns: str, name: str) -> str:
+    return f"{{{ns}}}{name}"
+
+
+@dataclass
+class DavEntry:
+    """Elemento di una risposta PROPFIND"""
+    href: str
+    is_dir: bool = False
+    size: Optional[int] = None
+    etag: Optional[str] = None
+    mtime: Optional[float] = None
+    content_type: Optional[str] = None
+    quota_used: Optional[int] = None
+    quota_available: Optional[int] = None
+    file_id: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        """Nome file/cartella (ultimo segmento dell'href, decodificato)"""
+        return unquote(self.href.rstrip("/").rsplit("/", 1)[-1])
+
+    def relative_path(self, base_href: str) -> str:
+        """Percorso relativo a base_href (es. la root WebDAV utente)"""
+        href = unquote(self.href)
+        base = unquote(base_href)
+        if href.startswith(base):
+            href = href[len(base):]
+        return href.strip("/")
+
+
+@dataclass
+class OcsResponse:
+    """Risposta OCS: meta + data convertita in dict/list"""
+    status: str = ""
+    statuscode: int = 0
+    message: str = ""
+    data: Any = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        # v1 usa 100, v2 usa i codici HTTP
+        return self.statuscode in (100, 200)
+
+
+def _iter_chunks(source: Source, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Normalizza la sorgente in blocchi di bytes"""
+    if isinstance(source, str):
+        yield source.encode("utf-8")
+    elif isinstance(source, (bytes, bytearray)):
+        yield bytes(source)
+    elif hasattr(source, "iter_content"):
+        # requests.Response (stream=True): decodifica gzip/deflate inclusa
+        yield from source.iter_content(chunk_size=chunk_size)
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        yield from source
+
+
+def _parse_int(text: Optional[str]) -> Optional[int]:
+    if text is None:
+        return None
+    try:
+        return int(text.strip())
+    except ValueError:
+        return None
+
+
+def _parse_http_date(text: Optional[str]) -> Optional[float]:
+    if not text:
+        return None
+    try:
+        return parsedate_to_datetime(text.strip()).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _propstat_ok(propstat: ET.Element) -> bool:
+    status = propstat.findtext(_tag(DAV_NS, "status")) or ""
+    return " 200 " in f" {status} "
+
+
+def _entry_from_response(elem: ET.Element) -> Optional[DavEntry]:
+    """Converte un elemento <d:response> in DavEntry"""
+    href = elem.findtext(_tag(DAV_NS, "href"))
+    if not href:
+        return None
+
+    entry = DavEntry(href=href.strip())
+
+    for propstat in elem.iter(_tag(DAV_NS, "propstat")):
+        if not _propstat_ok(propstat):
+            continue
+        prop = propstat.find(_tag(DAV_NS, "prop"))
+        if prop is None:
+            continue
+
+        resourcetype = prop.find(_tag(DAV_NS, "resourcetype"))
+        if resourcetype is not None and resourcetype.find(_tag(DAV_NS, "collection")) is not None:
+            entry.is_dir = True
+
+        etag = prop.findtext(_tag(DAV_NS, "getetag"))
+        if etag:
+            entry.etag = etag.strip().strip('"')
+
+        entry.mtime = _parse_http_date(prop.findtext(_tag(DAV_NS, "getlastmodified"))) or entry.mtime
+        entry.content_type = prop.findtext(_tag(DAV_NS, "getcontenttype")) or entry.content_type
+        entry.file_id = prop.findtext(_tag(OC_NS, "fileid")) or entry.file_id
+
+        used = _parse_int(prop.findtext(_tag(DAV_NS, "quota-used-bytes")))
+        if used is not None:
+            entry.quota_used = used
+        available = _parse_int(prop.findtext(_tag(DAV_NS, "quota-available-bytes")))
+        if available is not None:
+            entry.quota_available = available
+
+        # File: getcontentlength; cartelle: oc:size (ricorsiva lato server)
+        length = _parse_int(prop.findtext(_tag(DAV_NS, "getcontentlength")))
+        oc_size = _parse_int(prop.findtext(_tag(OC_NS, "size")))
+        if length is not None:
+            entry.size = length
+        elif oc_size is not None:
+            entry.size = oc_size
+
+    if entry.is_dir and entry.size is None and entry.quota_used is not None:
+        entry.size = entry.quota_used
+
+    return entry
+
+
+def iter_multistatus(source: Source) -> Iterator[DavEntry]:
+    """
+    Itera le entry di una risposta WebDAV multistatus
+
+    Args:
+        source: requests.Response (stream=True), file-like, bytes/str
+                o iterabile di blocchi bytes
+
+    Yields:
+        DavEntry per ogni <d:response>, nell'ordine del documento
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    response_tag = _tag(DAV_NS, "response")
+    root = None
+
+    for chunk in _iter_chunks(source):
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag != response_tag:
+                continue
+
+            entry = _entry_from_response(elem)
+            # Libera memoria: svuota e stacca l'elemento dalla root
+            elem.clear()
+            if root is not None:
+                try:
+                    root.remove(elem)
+                except ValueError:
+                    pass
+            if entry is not None:
+                yield entry
+
+    parser.close()
+
+
+def _element_to_python(elem: ET.Element) -> Any:
+    """Converte un sotto-albero OCS in dict/list/str"""
+    children = list(elem)
+    if not children:
+        return (elem.text or "").strip()
+
+    # Liste OCS: figli ripetuti <element>
+    if all(child.tag == "element" for child in children):
+        return [_element_to_python(child) for child in children]
+
+    result: Dict[str, Any] = {}
+    for child in children:
+        value = _element_to_python(child)
+        if child.tag in result:
+            if not isinstance(result[child.tag], list):
+                result[child.tag] = [result[child.tag]]
+            result[child.tag].append(value)
+        else:
+            result[child.tag] = value
+    return result
+
+
+def parse_ocs(source: Source) -> OcsResponse:
+    """
+    Analizza una risposta OCS (v1 o v2) in formato XML
+
+    Args:
+        source: Corpo risposta (vedi iter_multistatus)
+
+    Returns:
+        OcsResponse con meta e data convertita
+    """
+    result = OcsResponse()
+    parser = ET.XMLPullParser(events=("end",))
+
+    for chunk in _iter_chunks(source):
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            if elem.tag == "meta":
+                result.status = elem.findtext("status") or ""
+                result.statuscode = _parse_int(elem.findtext("statuscode")) or 0
+                result.message = elem.findtext("message") or ""
+                elem.clear()
+            elif elem.tag == "data":
+                result.data = _element_to_python(elem)
+                elem.clear()
+
+    parser.close()
+    return result
+
+
+def iter_ocs_elements(source: Source, container: str) -> Iterator[str]:
+    """
+    Itera i valori testuali di una lista OCS (es. data/users/element)
+
+    Args:
+        source: Corpo risposta
+        container: Tag che contiene gli <element> (es. "users")
+
+    Yields:
+        Testo di ogni <element> figlio di container
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    current = None
+
+    for chunk in _iter_chunks(source):
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if elem.tag == container:
+                current = elem if event == "start" else None
+                continue
+            if event == "end" and current is not None and elem.tag == "element":
+                yield (elem.text or "").strip()
+                try:
+                    current.remove(elem)
+                except ValueError:
+                    pass
+
+    parser.close()
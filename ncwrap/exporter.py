@@ -0,0 +1,254 @@
+"""
+Exporter Prometheus per mount, servizi e latenza API
+
+`nextcloud-wrapper exporter --listen :9469` espone /metrics con:
+- mount su/giù per tenant (da /proc/self/mountinfo, attesi secondo
+  MountManager.expected_mounts)
+- cache VFS, upload in coda e trasferimenti rclone (API rc dei mount)
+- stato delle unit systemd ncwrap-*
+- istogrammi di latenza delle richieste OCS/WebDAV (metrics.py), alimentati
+  da sonde periodiche verso il server
+
+I collector girano in un thread di background ciascuno col proprio
+intervallo e producono un'istantanea testuale: lo scrape legge solo
+l'istantanea, non esegue I/O verso rclone o systemd e non avvia processi.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .metrics import REQUEST_LATENCY, format_family
+
+DEFAULT_LISTEN = ":9469"
+# Intervalli collector (secondi)
+DEFAULT_INTERVAL = 15
+DEFAULT_PROBE_INTERVAL = 60
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_UNIT_STATES = ("active", "inactive", "failed", "activating", "deactivating", "reloading")
+
+
+def parse_listen(listen: str) -> Tuple[str, int]:
+    """':9469' o 'host:9469' -> (host, porta)"""
+    host, _, port = listen.rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"indirizzo di ascolto non valido: {listen}")
+    return host.strip("[]"), int(port)
+
+
+def _tenant(remote: str) -> str:
+    """'nc-mario:/' -> 'mario'"""
+    name = remote.split(":", 1)[0]
+    return name[3:] if name.startswith("nc-") else name
+
+
+class MetricsExporter:
+    """
+    Raccoglie le metriche in background e serve l'ultima istantanea
+
+    Uso:
+        exporter = MetricsExporter()
+        exporter.start()
+        exporter.serve("", 9469)
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL,
+                 probe_interval: float = DEFAULT_PROBE_INTERVAL):
+        self.collectors: List[Tuple[str, Callable[[], List[str]], float]] = [
+            ("mounts", self._collect_mounts, interval),
+            ("rclone", self._collect_rclone, interval),
+            ("systemd", self._collect_systemd, interval),
+            ("api", self._collect_api, probe_interval),
+        ]
+        self._lines: Dict[str, List[str]] = {}
+        # collector -> (ultimo avvio, durata, successo)
+        self._runs: Dict[str, Tuple[float, float, bool]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ===== Ciclo collector =====
+
+    def refresh(self, force: bool = False) -> None:
+        """Esegue i collector scaduti (tutti con force=True)"""
+        for name, collector, interval in self.collectors:
+            last = self._runs.get(name)
+            if not force and last and time.time() - last[0] < interval:
+                continue
+            started = time.time()
+            try:
+                lines, ok = collector(), True
+            except Exception:
+                lines, ok = None, False
+            with self._lock:
+                if lines is not None:
+                    self._lines[name] = lines
+                self._runs[name] = (started, time.time() - started, ok)
+
+    def start(self) -> None:
+        """Prima raccolta sincrona, poi aggiornamento in background"""
+        self.refresh(force=True)
+
+        def loop():
+            while not self._stop.wait(1.0):
+                self.refresh()
+
+        self._thread = threading.Thread(target=loop, name="ncwrap-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def render(self) -> bytes:
+        """Testo di esposizione: istantanea collector + istogrammi in memoria"""
+        with self._lock:
+            lines = [line for name, _, _ in self.collectors for line in self._lines.get(name, [])]
+            runs = dict(self._runs)
+
+        lines += REQUEST_LATENCY.render()
+        lines += format_family(
+            "ncwrap_collector_success", "gauge", "Esito dell'ultima esecuzione del collector",
+            [({"collector": name}, ok) for name, (_, _, ok) in sorted(runs.items())])
+        lines += format_family(
+            "ncwrap_collector_duration_seconds", "gauge", "Durata dell'ultima esecuzione del collector",
+            [({"collector": name}, round(duration, 6)) for name, (_, duration, _) in sorted(runs.items())])
+        lines += format_family(
+            "ncwrap_collector_last_run_timestamp_seconds", "gauge", "Ultima esecuzione del collector",
+            [({"collector": name}, round(started, 3)) for name, (started, _, _) in sorted(runs.items())])
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    # ===== Collector =====
+
+    def _collect_mounts(self) -> List[str]:
+        from .mount import MountManager
+        from .rclone import list_rclone_mounts
+
+        actual = list_rclone_mounts()
+        tenants = {mount_point: spec["username"]
+                   for mount_point, spec in MountManager().expected_mounts().items()}
+        for mount_point, source in actual.items():
+            tenants.setdefault(mount_point, _tenant(source))
+
+        return format_family(
+            "ncwrap_mount_up", "gauge", "Mount rclone presente in mountinfo (1) o assente (0)",
+            [({"mount_point": mount_point, "tenant": tenant}, mount_point in actual)
+             for mount_point, tenant in sorted(tenants.items())])
+
+    def _collect_rclone(self) -> List[str]:
+        from .mountstats import collect_all_stats
+
+        gauges = {
+            "ncwrap_vfs_cache_bytes": ("cache_bytes", "Byte occupati dalla cache VFS su disco"),
+            "ncwrap_vfs_cache_max_bytes": ("cache_max_bytes", "Limite cache VFS (--vfs-cache-max-size)"),
+            "ncwrap_vfs_uploads_queued": ("uploads_queued", "File modificati in attesa di upload"),
+            "ncwrap_vfs_uploads_in_progress": ("uploads_in_progress", "Upload in corso verso Nextcloud"),
+            "ncwrap_vfs_open_files": ("open_files", "File aperti nel mount"),
+            "ncwrap_vfs_errored_files": ("errored_files", "File della cache in errore"),
+        }
+        transfers = {
+            "ncwrap_rclone_transferred_bytes_total": ("bytes", "counter", "Byte trasferiti da rclone"),
+            "ncwrap_rclone_transfers_total": ("transfers", "counter", "Trasferimenti completati"),
+            "ncwrap_rclone_errors_total": ("errors", "counter", "Errori di trasferimento"),
+            "ncwrap_rclone_speed_bytes": ("speed", "gauge", "Velocità media di trasferimento (byte/s)"),
+            "ncwrap_rclone_transfers_active": ("active", "gauge", "Trasferimenti in corso"),
+        }
+
+        vfs_samples = {name: [] for name in gauges}
+        transfer_samples = {name: [] for name in transfers}
+        rc_up, seen_shards = [], set()
+        for item in collect_all_stats():
+            labels = {"mount_point": item["mount_point"], "tenant": _tenant(item.get("source") or "")}
+            rc_up.append((labels, "error" not in item))
+            if "error" in item:
+                continue
+            for name, (key, _) in gauges.items():
+                if item["vfs"].get(key) is not None:
+                    vfs_samples[name].append((labels, item["vfs"][key]))
+
+            # Nei mount del supervisore i contatori sono dello shard: una serie per shard
+            if item["scope"] == "shard":
+                if item["shard"] in seen_shards:
+                    continue
+                seen_shards.add(item["shard"])
+                source_labels = {"shard": item["shard"]}
+            else:
+                source_labels = dict(labels)
+            for name, (key, _, _) in transfers.items():
+                transfer_samples[name].append((source_labels, item["transfers"][key]))
+
+        lines = format_family("ncwrap_mount_rc_up", "gauge", "Endpoint rc del mount raggiungibile", rc_up)
+        for name, (_, help_text) in gauges.items():
+            lines += format_family(name, "gauge", help_text, vfs_samples[name])
+        for name, (_, metric_type, help_text) in transfers.items():
+            lines += format_family(name, metric_type, help_text, transfer_samples[name])
+        return lines
+
+    def _collect_systemd(self) -> List[str]:
+        from .systemd import SystemdManager
+
+        # Un solo elenco (ListUnitsByPatterns o `systemctl list-units`) per tutte le unit ncwrap-*
+        services = SystemdManager().list_nextcloud_services(user=False)
+        samples = []
+        for service in services:
+            for state in _UNIT_STATES:
+                samples.append(({"unit": service["name"], "state": state}, service["active"] == state))
+        return format_family(
+            "ncwrap_systemd_unit_state", "gauge", "Stato ActiveState delle unit ncwrap-*", samples)
+
+    def _collect_api(self) -> List[str]:
+        from .api import dav_files_url, get_nc_config, nc_headers
+        from .client import get_client
+
+        base_url, admin_user, admin_pass = get_nc_config()
+        client = get_client()
+        probes = {
+            "ocs": lambda: client.get(f"{base_url}/ocs/v2.php/cloud/user", headers=nc_headers(),
+                                      auth=(admin_user, admin_pass), timeout=10),
+            "webdav": lambda: client.request("PROPFIND", dav_files_url(base_url, admin_user),
+                                             headers={"Depth": "0"}, auth=(admin_user, admin_pass), timeout=10),
+        }
+
+        samples = []
+        for api, probe in probes.items():
+            try:
+                response = probe()
+                response.close()
+                up = response.status_code < 400
+            except Exception:
+                up = False
+            samples.append(({"api": api}, up))
+        return format_family(
+            "ncwrap_api_up", "gauge", "Esito dell'ultima sonda verso l'API Nextcloud", samples)
+
+    # ===== HTTP =====
+
+    def serve(self, host: str, port: int) -> None:
+        """Serve /metrics fino all'interruzione (bloccante)"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] == "/metrics":
+                    body, content_type, status = exporter.render(), CONTENT_TYPE, 200
+                elif self.path == "/":
+                    body = b'<html><body><a href="/metrics">/metrics</a></body></html>'
+                    content_type, status = "text/html", 200
+                else:
+                    body, content_type, status = b"not found\n", "text/plain", 404
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.stop()
@@ -0,0 +1,345 @@
+"""
+Indice locale dei metadati remoti (SQLite) per tenant
+
+Ogni tenant ha un database /var/lib/ncwrap/index/<user>.db con percorso,
+dimensione, etag e mtime di file e cartelle. Nextcloud propaga l'ETag di
+una cartella a tutti i padri quando cambia un discendente: l'aggiornamento
+parte dalla root e rilista solo le cartelle con ETag diverso.
+Dimensioni, conteggi e modifiche recenti si leggono poi in locale.
+"""
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .api import (
+    get_nc_config,
+    dav_files_href,
+    iter_webdav_directory,
+    propfind_entries,
+    walk_remote,
+)
+from .davxml import DavEntry
+from .utils import first_writable_dir
+
+INDEX_DIRS = ("/var/lib/ncwrap/index", "~/.cache/ncwrap/index")
+# Cartelle rilistate in parallelo durante l'aggiornamento
+DEFAULT_WORKERS = 8
+# Modifiche conservate nella tabella changes
+MAX_CHANGES = 100000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    refreshed_at REAL NOT NULL,
+    path TEXT NOT NULL,
+    change TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def index_path(user: str) -> Path:
+    """Percorso database indice per un tenant (NC_INDEX_DIR ha la precedenza)"""
+    index_dir = first_writable_dir(INDEX_DIRS, "NC_INDEX_DIR")
+    if index_dir is None:
+        raise RuntimeError("Nessuna directory indice scrivibile")
+    return index_dir / f"{user}.db"
+
+
+def _parent(path: str) -> str:
+    return path.rsplit("/", 1)[0] if "/" in path else ""
+
+
+class RemoteIndex:
+    """
+    Indice SQLite dei metadati remoti di un tenant
+
+    Uso:
+        with RemoteIndex("cliente.it") as index:
+            index.refresh(password)
+            print(index.summary())
+    """
+
+    def __init__(self, user: str, db_path: Optional[str] = None):
+        self.user = user
+        self.db_path = Path(db_path) if db_path else index_path(user)
+        self.db = sqlite3.connect(str(self.db_path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        try:
+            os.chmod(self.db_path, 0o600)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "RemoteIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    # ===== Meta =====
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value) -> None:
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        (key, None if value is None else str(value)))
+
+    # ===== Scritture =====
+
+    def _upsert(self, path: str, entry: DavEntry) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries (path, parent, is_dir, size, etag, mtime) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, _parent(path), int(entry.is_dir), entry.size, entry.etag, entry.mtime),
+        )
+
+    def _delete_tree(self, path: str) -> None:
+        escaped = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        self.db.execute("DELETE FROM entries WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                        (path, f"{escaped}/%"))
+
+    def _record(self, refreshed_at: float, changes: List[Tuple[str, str]]) -> None:
+        if changes:
+            self.db.executemany(
+                "INSERT INTO changes (refreshed_at, path, change) VALUES (?, ?, ?)",
+                [(refreshed_at, path, change) for path, change in changes],
+            )
+
+    def _full_build(self, password: str, root: DavEntry, base_href: str,
+                    refreshed_at: float, max_workers: int) -> Dict[str, int]:
+        """Primo popolamento: un solo walk_remote (Depth infinity se disponibile)"""
+        count = 0
+        with self.db:
+            self.db.execute("DELETE FROM entries")
+            self._upsert("", root)
+            for entry in walk_remote(self.user, password, max_in_flight=max_workers):
+                self._upsert(entry.relative_path(base_href), entry)
+                count += 1
+        return {"added": count, "modified": 0, "deleted": 0, "listed_folders": -1}
+
+    def refresh(self, password: str, max_workers: int = DEFAULT_WORKERS,
+                record_changes: bool = True) -> Dict:
+        """
+        Aggiorna l'indice rilistando solo le cartelle con ETag cambiato
+
+        Args:
+            password: Password/App Password del tenant
+            max_workers: PROPFIND Depth 1 contemporanei
+            record_changes: Se registrare le modifiche nella tabella changes
+
+        Returns:
+            Dict con added, modified, deleted, listed_folders, elapsed
+        """
+        started = time.monotonic()
+        refreshed_at = time.time()
+        base_url, _, _ = get_nc_config()
+        base_href = dav_files_href(base_url, self.user)
+
+        root = next(propfind_entries(self.user, password, "", depth="0"), None)
+        if root is None:
+            raise RuntimeError(f"PROPFIND root vuoto per {self.user}")
+
+        stored = self.db.execute("SELECT etag FROM entries WHERE path = ''").fetchone()
+        if stored is None:
+            stats = self._full_build(password, root, base_href, refreshed_at, max_workers)
+        else:
+            stats = {"added": 0, "modified": 0, "deleted": 0, "listed_folders": 0}
+            if stored[0] != root.etag:
+                self._refresh_changed(password, base_href, refreshed_at, max_workers,
+                                      stats, record_changes)
+            with self.db:
+                self._upsert("", root)
+
+        with self.db:
+            self._set_meta("refreshed_at", refreshed_at)
+            self._set_meta("quota_used", root.quota_used)
+            self._set_meta("quota_available", root.quota_available)
+            self.db.execute(
+                "DELETE FROM changes WHERE id <= (SELECT MAX(id) FROM changes) - ?", (MAX_CHANGES,)
+            )
+
+        stats["elapsed"] = time.monotonic() - started
+        return stats
+
+    def _refresh_changed(self, password: str, base_href: str, refreshed_at: float,
+                         max_workers: int, stats: Dict, record_changes: bool) -> None:
+        """Visita per livelli delle sole cartelle con ETag cambiato"""
+
+        def list_folder(folder: str) -> List[DavEntry]:
+            return list(iter_webdav_directory(self.user, password, folder))
+
+        # Gli ETag delle cartelle si scrivono solo a fine visita: se il refresh
+        # si interrompe, al giro successivo i padri risultano ancora cambiati
+        folder_updates: List[Tuple[str, DavEntry]] = []
+        level = [""]
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            while level:
+                futures = {executor.submit(list_folder, folder): folder for folder in level}
+                next_level = []
+                for future in as_completed(futures):
+                    folder = futures[future]
+                    changed = self._apply_listing(
+                        folder, future.result(), base_href, refreshed_at, stats, record_changes
+                    )
+                    folder_updates.extend(changed)
+                    next_level.extend(path for path, _ in changed)
+                    stats["listed_folders"] += 1
+                level = next_level
+
+        with self.db:
+            for path, entry in folder_updates:
+                self._upsert(path, entry)
+
+    def _apply_listing(self, folder: str, entries: List[DavEntry], base_href: str,
+                       refreshed_at: float, stats: Dict,
+                       record_changes: bool) -> List[Tuple[str, DavEntry]]:
+        """
+        Confronta il listing di una cartella con l'indice e applica le differenze
+
+        Returns:
+            Sottocartelle (percorso, entry) da rilistare: nuove o con ETag cambiato
+        """
+        known = {
+            path: (bool(is_dir), etag)
+            for path, is_dir, etag in self.db.execute(
+                "SELECT path, is_dir, etag FROM entries WHERE parent = ? AND path != ''", (folder,)
+            )
+        }
+        changes: List[Tuple[str, str]] = []
+        changed_folders: List[Tuple[str, DavEntry]] = []
+
+        with self.db:
+            for entry in entries:
+                path = entry.relative_path(base_href)
+                previous = known.pop(path, None)
+                if previous is not None and previous == (entry.is_dir, entry.etag):
+                    continue
+
+                if previous is None:
+                    changes.append((path, "added"))
+                    stats["added"] += 1
+                elif previous[0] != entry.is_dir:
+                    # Cartella diventata file o viceversa
+                    self._delete_tree(path)
+                    changes.append((path, "modified"))
+                    stats["modified"] += 1
+                elif not entry.is_dir:
+                    changes.append((path, "modified"))
+                    stats["modified"] += 1
+
+                if entry.is_dir:
+                    changed_folders.append((path, entry))
+                    if previous is None or previous[0] != entry.is_dir:
+                        # Inserita senza ETag finché non viene listata
+                        self._upsert(path, DavEntry(href=entry.href, is_dir=True, size=entry.size,
+                                                    mtime=entry.mtime))
+                else:
+                    self._upsert(path, entry)
+
+            for path in known:
+                self._delete_tree(path)
+                changes.append((path, "deleted"))
+                stats["deleted"] += 1
+
+            if record_changes:
+                self._record(refreshed_at, changes)
+
+        return changed_folders
+
+    # ===== Query locali =====
+
+    def get(self, path: str) -> Optional[Dict]:
+        """Metadati di un percorso dall'indice"""
+        row = self.db.execute(
+            "SELECT path, is_dir, size, etag, mtime FROM entries WHERE path = ?", (path.strip("/"),)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"path": row[0], "is_dir": bool(row[1]), "size": row[2], "etag": row[3], "mtime": row[4]}
+
+    def children(self, path: str = "") -> Iterator[Dict]:
+        """Figli diretti di una cartella"""
+        for row in self.db.execute(
+            "SELECT path, is_dir, size, etag, mtime FROM entries WHERE parent = ? AND path != '' "
+            "ORDER BY path", (path.strip("/"),)
+        ):
+            yield {"path": row[0], "is_dir": bool(row[1]), "size": row[2], "etag": row[3], "mtime": row[4]}
+
+    def summary(self, path: str = "") -> Dict:
+        """
+        Dimensione e conteggi di un sottoalbero
+
+        Returns:
+            Dict con size, files, folders, refreshed_at (None se mai aggiornato)
+        """
+        path = path.strip("/")
+        if path:
+            escaped = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where, params = "path LIKE ? ESCAPE '\\'", (f"{escaped}/%",)
+        else:
+            where, params = "path != ''", ()
+        files, folders, file_bytes = self.db.execute(
+            f"SELECT COALESCE(SUM(is_dir = 0), 0), COALESCE(SUM(is_dir = 1), 0), "
+            f"COALESCE(SUM(CASE WHEN is_dir = 0 THEN size ELSE 0 END), 0) FROM entries WHERE {where}",
+            params,
+        ).fetchone()
+        # Dimensione cartella lato server (oc:size) se presente, altrimenti somma file
+        node = self.get(path)
+        size = node["size"] if node and node["is_dir"] and node["size"] is not None else file_bytes
+        refreshed_at = self._get_meta("refreshed_at")
+        return {
+            "size": size,
+            "files": files,
+            "folders": folders,
+            "refreshed_at": float(refreshed_at) if refreshed_at else None,
+        }
+
+    def quota(self) -> Dict:
+        """Quota rilevata all'ultimo aggiornamento (used/available in byte)"""
+        result = {}
+        for key in ("quota_used", "quota_available"):
+            value = self._get_meta(key)
+            if value not in (None, "None"):
+                result[key] = int(value)
+        return result
+
+    def changes(self, since: Optional[float] = None, limit: int = 100) -> List[Dict]:
+        """
+        Modifiche registrate dagli aggiornamenti (più recenti prima)
+
+        Args:
+            since: Timestamp minimo (default: ultimo aggiornamento con modifiche)
+            limit: Numero massimo di righe
+        """
+        if since is None:
+            row = self.db.execute("SELECT MAX(refreshed_at) FROM changes").fetchone()
+            since = row[0] if row and row[0] is not None else 0
+        return [
+            {"path": path, "change": change, "refreshed_at": refreshed_at}
+            for path, change, refreshed_at in self.db.execute(
+                "SELECT path, change, refreshed_at FROM changes WHERE refreshed_at >= ? "
+                "ORDER BY id DESC LIMIT ?", (since, limit)
+            )
+        ]
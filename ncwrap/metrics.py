@@ -0,0 +1,120 @@
+"""
+Metriche di processo in formato Prometheus/OpenMetrics
+
+Istogrammi in memoria aggiornati dal client HTTP condiviso (latenza delle
+richieste OCS e WebDAV) e funzioni di formattazione usate dall'exporter
+(`ncwrap/exporter.py`). Registrare una misura costa un lock e un
+confronto per bucket: resta attivo in ogni processo, ma viene esposto solo
+dall'exporter.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Bucket latenza (secondi)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def escape_label(value: str) -> str:
+    """Escape di un valore label (backslash, doppi apici, newline)"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_sample(name: str, labels: Optional[Dict[str, str]], value: float) -> str:
+    """Riga di esposizione: nome{label="valore"} valore"""
+    if labels:
+        body = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+        name = f"{name}{{{body}}}"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{name} {value}"
+
+
+def format_family(name: str, metric_type: str, help_text: str,
+                  samples: Iterable[Tuple[Optional[Dict[str, str]], float]]) -> List[str]:
+    """Righe HELP/TYPE seguite dai campioni di una metrica"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    lines += [format_sample(name, labels, value) for labels, value in samples]
+    return lines
+
+
+class Histogram:
+    """
+    Istogramma cumulativo con label, thread-safe
+
+    Uso:
+        latency = Histogram("ncwrap_x_seconds", "Durata x")
+        latency.observe({"api": "ocs"}, 0.042)
+        lines = latency.render()
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Dict[str, str], value: float) -> None:
+        """Registra una misura"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # conteggi per bucket, somma, totale
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        """Righe di esposizione (_bucket, _sum, _count)"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2])
+                        for key, series in sorted(self._series.items())]
+        for key, counts, total, count in snapshot:
+            labels = dict(key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(format_sample(f"{self.name}_bucket", dict(labels, le=repr(bound)), bucket_count))
+            lines.append(format_sample(f"{self.name}_bucket", dict(labels, le="+Inf"), count))
+            lines.append(format_sample(f"{self.name}_sum", labels, round(total, 6)))
+            lines.append(format_sample(f"{self.name}_count", labels, count))
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "ncwrap_http_request_duration_seconds",
+    "Latenza richieste HTTP verso Nextcloud per API (ocs, webdav), metodo e classe di stato",
+)
+
+
+def api_kind(url: str) -> str:
+    """Classifica un URL Nextcloud: ocs, webdav, status o other"""
+    path = urlsplit(url).path
+    if "/ocs/" in path:
+        return "ocs"
+    if "/remote.php/" in path:
+        return "webdav"
+    if path.endswith("/status.php"):
+        return "status"
+    return "other"
+
+
+def observe_request(method: str, url: str, status_code: Optional[int], seconds: float) -> None:
+    """Registra la latenza di una richiesta (status None = errore di rete)"""
+    REQUEST_LATENCY.observe(
+        {
+            "api": api_kind(url),
+            "method": method.upper(),
+            "code": f"{status_code // 100}xx" if status_code else "error",
+        },
+        seconds,
+    )
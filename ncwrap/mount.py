@@ -10,12 +10,18 @@ from pathlib import Path
 from typing import Optional, Dict, List
 from enum import Enum
 
-from .utils import run, ensure_dir, get_user_uid_gid, is_command_available, is_mounted
+from .utils import run, ensure_dir, get_user_uid_gid, is_command_available, is_mounted, atomic_write
 from .api import get_nc_config
 from .rclone import (
     add_nextcloud_remote, mount_remote, unmount, is_mounted as rclone_is_mounted,
-    create_systemd_mount_service, get_mount_profile_info, MOUNT_PROFILES
+    get_mount_profile_info, MOUNT_PROFILES,
+    create_systemd_mount_template, create_mount_instance_env, parse_mount_instance_env,
+    MOUNT_TEMPLATE_UNIT, MOUNT_ENV_DIR
 )
+from .mounttable import wait_for_mount
+
+# Attesa massima del mount pronto dopo l'avvio (secondi)
+MOUNT_READY_TIMEOUT = 30
 
 
 class MountEngine(str, Enum):
@@ -28,15 +34,22 @@ class MountManager:
     Gestore mount Nextcloud v1.0.0rc2 - solo rclone
     """
     
-    def __init__(self, preferred_engine: MountEngine = MountEngine.RCLONE, use_bearer_token: bool = True):
+    def __init__(self, preferred_engine: MountEngine = MountEngine.RCLONE, use_bearer_token: bool = True,
+                 use_supervisor: Optional[bool] = None):
         self.preferred_engine = MountEngine.RCLONE  # Fisso v1.0
         self.use_bearer_token = use_bearer_token  # AppAPI compatibility
+        # Mount ospitati dagli shard rclone rcd del supervisore invece di un processo per tenant
+        if use_supervisor is None:
+            use_supervisor = os.environ.get("NC_MOUNT_SUPERVISOR", "0") == "1"
+        self.use_supervisor = use_supervisor
         
         # Configurazione engine
         self.config = {
             "rclone_default_profile": "full",
             "rclone_cache_dir": Path.home() / ".cache" / "rclone" / "ncwrap",
-            "service_prefix": "ncwrap"
+            "service_prefix": "ncwrap",
+            "systemd_dir": "/etc/systemd/system",
+            "mount_env_dir": MOUNT_ENV_DIR
         }
     
     def detect_available_engines(self) -> Dict[MountEngine, bool]:
@@ -100,10 +113,15 @@ class MountManager:
         return add_nextcloud_remote(remote_name, base_url, username, password, self.use_bearer_token)
     
     def mount_user_home(self, username: str, password: str, home_path: str = None, 
-                       profile: str = "full", remount: bool = False, **kwargs) -> Dict:
+                       profile: str = "full", remount: bool = False,
+                       configure_remote: bool = True, **kwargs) -> Dict:
         """
         Monta Nextcloud nella home directory con rclone
         
+        Args:
+            configure_remote: Se (ri)creare il remote rclone prima del mount
+                              (False se già configurato, es. setup bulk)
+        
         Returns:
             Dict con informazioni risultato mount
         """
@@ -140,7 +158,8 @@ class MountManager:
                 return result
         
         # Mount con rclone
-        mount_success = self._mount_with_rclone(username, password, home_path, profile)
+        mount_success = self._mount_with_rclone(username, password, home_path, profile,
+                                                configure_remote=configure_remote)
         
         if mount_success:
             result.update({
@@ -154,12 +173,13 @@ class MountManager:
             print(f"❌ {result['message']}")
             return result
     
-    def _mount_with_rclone(self, username: str, password: str, home_path: str, profile: str = "full") -> bool:
+    def _mount_with_rclone(self, username: str, password: str, home_path: str, profile: str = "full",
+                           configure_remote: bool = True) -> bool:
         """Mount con rclone"""
         try:
             # Setup remote se non esiste
             remote_name = f"nc-{username}"
-            if not self.setup_credentials(username, password):
+            if configure_remote and not self.setup_credentials(username, password):
                 print(f"❌ Errore setup credenziali rclone per {username}")
                 return False
             
@@ -167,12 +187,9 @@ class MountManager:
             self._backup_existing_home(home_path, username)
             
             # Mount con rclone
-            if mount_remote(remote_name, home_path, background=True, profile=profile):
-                # Verifica che il mount sia effettivamente attivo
-                import time
-                time.sleep(3)  # Attendi che rclone si stabilizzi
-                
-                if not is_mounted(home_path):
+            if self._start_mount(remote_name, home_path, profile):
+                # Attende il mount in mountinfo e la risposta del demone FUSE
+                if not wait_for_mount(home_path, timeout=MOUNT_READY_TIMEOUT):
                     print(f"❌ Mount non attivo dopo setup per {home_path}")
                     return False
                 
@@ -203,6 +220,20 @@ class MountManager:
             print(f"❌ Errore mount rclone: {e}")
             return False
     
+    def _start_mount(self, remote_name: str, home_path: str, profile: str) -> bool:
+        """Avvia il mount: processo rclone dedicato o shard del supervisore"""
+        if not self.use_supervisor:
+            return mount_remote(remote_name, home_path, background=True, profile=profile)
+        
+        from .supervisor import MountSupervisor
+        try:
+            shard = MountSupervisor().add(remote_name, home_path, profile)
+            print(f"✅ Mount ospitato dallo shard rclone {shard}")
+            return True
+        except (ValueError, RuntimeError) as e:
+            print(f"Errore mount supervisore: {e}")
+            return False
+    
     def _backup_existing_home(self, home_path: str, username: str) -> Optional[str]:
         """Backup directory home esistente"""
         if not os.path.exists(home_path):
@@ -234,59 +265,273 @@ class MountManager:
     def unmount_user_home(self, home_path: str) -> bool:
         """Smonta home directory"""
         try:
+            if self.use_supervisor:
+                from .supervisor import MountSupervisor
+                supervisor = MountSupervisor()
+                if supervisor.manages(home_path):
+                    return supervisor.remove(home_path)
             return unmount(home_path)
         except:
             return False
     
     def create_systemd_service(self, username: str, password: str, home_path: str = None,
-                              profile: str = "full") -> str:
-        """Crea servizio systemd per mount automatico rclone"""
+                              profile: str = "full", configure_remote: bool = True) -> str:
+        """
+        Prepara il servizio systemd per il mount automatico rclone
+        
+        Ogni tenant è un'istanza del template ncwrap-rclone@.service con
+        profilo e mount point in /etc/ncwrap/mounts/<utente>.env: il
+        daemon-reload serve solo quando il template stesso cambia.
+        
+        Returns:
+            Nome del servizio da abilitare (enable_mount_service)
+        """
         if not home_path:
             home_path = f"/home/{username}"
         
-        service_name = f"{self.config['service_prefix']}-rclone-{username}"
-        
         # Setup remote prima di creare servizio
-        remote_name = f"nc-{username}"
-        self.setup_credentials(username, password)
-        
-        # Usa il generatore rclone
-        service_content = create_systemd_mount_service(
-            username, profile or "full"
-        )
+        if configure_remote:
+            self.setup_credentials(username, password)
         
-        # Scrivi file servizio
-        service_file = f"/etc/systemd/system/{service_name}.service"
-        with open(service_file, 'w') as f:
-            f.write(service_content)
+        if self.use_supervisor:
+            # Un solo servizio per tutti i tenant: rimonta dallo stato del supervisore
+            from .supervisor import SUPERVISOR_SERVICE, create_supervisor_service
+            self._install_unit(f"{SUPERVISOR_SERVICE}.service", create_supervisor_service())
+            print(f"✅ Servizio creato: {SUPERVISOR_SERVICE}.service")
+            return SUPERVISOR_SERVICE
         
-        # Reload systemd
-        run(["systemctl", "daemon-reload"])
+        self.install_mount_template()
+        env_file = os.path.join(self.config["mount_env_dir"], f"{username}.env")
+        ensure_dir(self.config["mount_env_dir"])
+        if not atomic_write(env_file, create_mount_instance_env(username, home_path, profile or "full"), 0o644):
+            raise RuntimeError(f"Impossibile scrivere {env_file}")
         
-        print(f"✅ Servizio creato: {service_name}.service")
+        service_name = f"{self.config['service_prefix']}-rclone@{username}"
+        print(f"✅ Servizio configurato: {service_name}.service ({env_file})")
         return service_name
     
+    def _install_unit(self, unit_name: str, content: str) -> bool:
+        """
+        Scrive una unit in /etc/systemd/system solo se il contenuto cambia
+        
+        Returns:
+            True se la unit è stata scritta (daemon-reload eseguito)
+        """
+        unit_file = os.path.join(self.config["systemd_dir"], unit_name)
+        try:
+            with open(unit_file, "r") as f:
+                if f.read() == content:
+                    return False
+        except OSError:
+            pass
+        
+        if not atomic_write(unit_file, content, 0o644):
+            raise RuntimeError(f"Impossibile scrivere {unit_file}")
+        from .systemd import SystemdManager
+        if not SystemdManager()._reload_systemd():
+            raise RuntimeError("daemon-reload fallito")
+        return True
+    
+    def install_mount_template(self) -> bool:
+        """Installa/aggiorna il template ncwrap-rclone@.service (True se è cambiato)"""
+        return self._install_unit(MOUNT_TEMPLATE_UNIT, create_systemd_mount_template())
+    
+    def enable_mount_service(self, service_name: str) -> bool:
+        """Abilita e avvia il servizio di mount (unit già caricata: senza daemon-reload)"""
+        from .systemd import SystemdManager
+        return SystemdManager().enable_service(service_name, reload=False)
+    
+    def _legacy_unit_file(self, username: str) -> str:
+        return os.path.join(self.config["systemd_dir"], f"{self.config['service_prefix']}-rclone-{username}.service")
+    
+    def has_systemd_service(self, username: str) -> bool:
+        """True se il tenant ha un servizio di mount (istanza del template o unit per-utente)"""
+        return (os.path.exists(os.path.join(self.config["mount_env_dir"], f"{username}.env"))
+                or os.path.exists(self._legacy_unit_file(username)))
+    
+    def mount_service_name(self, username: str) -> str:
+        """Servizio di mount del tenant: istanza del template o unit per-utente non ancora migrata"""
+        if os.path.exists(self._legacy_unit_file(username)):
+            return f"{self.config['service_prefix']}-rclone-{username}"
+        return f"{self.config['service_prefix']}-rclone@{username}"
+    
+    def remove_systemd_service(self, username: str) -> bool:
+        """
+        Ferma, disabilita e rimuove il servizio di mount del tenant
+        
+        Returns:
+            True se c'era un servizio da rimuovere
+        """
+        from .systemd import SystemdManager
+        systemd = SystemdManager()
+        removed = False
+        
+        env_file = os.path.join(self.config["mount_env_dir"], f"{username}.env")
+        if os.path.exists(env_file):
+            systemd.disable_service(f"{self.config['service_prefix']}-rclone@{username}", reload=False)
+            os.remove(env_file)
+            removed = True
+        
+        legacy_file = self._legacy_unit_file(username)
+        if os.path.exists(legacy_file):
+            systemd.disable_service(f"{self.config['service_prefix']}-rclone-{username}", reload=False)
+            os.remove(legacy_file)
+            systemd._reload_systemd()
+            removed = True
+        
+        return removed
+    
+    def _legacy_units(self) -> Dict[str, Dict]:
+        """Unit ncwrap-rclone-<utente>.service generate per tenant: utente -> {remote, mount_point, profile}"""
+        import glob
+        import re
+        
+        units = {}
+        pattern = re.compile(r"mount start (\S+) (\S+)(?: --profile (\S+))?")
+        prefix = f"{self.config['service_prefix']}-rclone-"
+        for unit_file in glob.glob(os.path.join(self.config["systemd_dir"], f"{prefix}*.service")):
+            try:
+                with open(unit_file, "r") as f:
+                    match = pattern.search(f.read())
+            except OSError:
+                continue
+            if match:
+                username = os.path.basename(unit_file)[len(prefix):-len(".service")]
+                units[username] = {
+                    "remote": match.group(1),
+                    "mount_point": match.group(2),
+                    "profile": match.group(3) or "full"
+                }
+        return units
+    
+    def _instance_units(self) -> Dict[str, Dict]:
+        """Istanze del template configurate: utente -> {remote, mount_point, profile}"""
+        import glob
+        
+        units = {}
+        for env_file in glob.glob(os.path.join(self.config["mount_env_dir"], "*.env")):
+            try:
+                with open(env_file, "r") as f:
+                    values = parse_mount_instance_env(f.read())
+            except OSError:
+                continue
+            if values.get("NC_REMOTE") and values.get("NC_MOUNT_POINT"):
+                units[os.path.basename(env_file)[:-len(".env")]] = {
+                    "remote": values["NC_REMOTE"],
+                    "mount_point": values["NC_MOUNT_POINT"],
+                    "profile": values.get("NC_PROFILE") or "full"
+                }
+        return units
+    
+    def migrate_legacy_units(self, dry_run: bool = False) -> Dict:
+        """
+        Converte le unit per-utente in istanze di ncwrap-rclone@.service
+        
+        Scrive template e file ambiente, ferma e rimuove le vecchie unit,
+        esegue un solo daemon-reload e avvia le istanze (tutti i job insieme).
+        I mount restano giù tra stop e avvio della nuova istanza.
+        
+        Returns:
+            Dict con migrated, failed (utente: motivo) e units (specifiche trovate)
+        """
+        from .systemd import SystemdManager
+        
+        legacy = self._legacy_units()
+        results = {"migrated": [], "failed": {}, "units": legacy}
+        if dry_run or not legacy:
+            return results
+        
+        systemd = SystemdManager()
+        prefix = self.config["service_prefix"]
+        self.install_mount_template()
+        ensure_dir(self.config["mount_env_dir"])
+        
+        for username, spec in legacy.items():
+            env_file = os.path.join(self.config["mount_env_dir"], f"{username}.env")
+            content = create_mount_instance_env(username, spec["mount_point"], spec["profile"], spec["remote"])
+            if not atomic_write(env_file, content, 0o644):
+                results["failed"][username] = f"impossibile scrivere {env_file}"
+        
+        to_migrate = [username for username in legacy if username not in results["failed"]]
+        old_units = [f"{prefix}-rclone-{username}" for username in to_migrate]
+        instances = [f"{prefix}-rclone@{username}" for username in to_migrate]
+        # Stop di tutte le vecchie unit, poi rimozione e un solo daemon-reload
+        systemd.run_jobs("stop", old_units)
+        systemd.disable_unit_files(old_units, reload=False)
+        for username in to_migrate:
+            try:
+                os.remove(self._legacy_unit_file(username))
+            except OSError:
+                pass
+        systemd._reload_systemd()
+        
+        # Una sola chiamata di enable per tutte le istanze, poi avvio congiunto
+        systemd.enable_unit_files(instances, reload=False)
+        started = systemd.run_jobs("start", instances)
+        for username, instance in zip(to_migrate, instances):
+            if started.get(instance):
+                results["migrated"].append(username)
+            else:
+                results["failed"][username] = "avvio istanza fallito"
+        
+        return results
+    
     def list_mounts(self) -> List[Dict]:
         """Lista tutti i mount rclone attivi"""
-        mounts = []
+        from .mounttable import get_mount_table
+        
+        return [
+            {
+                "engine": MountEngine.RCLONE,
+                "remote": entry.source,
+                "mountpoint": mount_point,
+                "type": "rclone",
+                "options": entry.options
+            }
+            for mount_point, entry in sorted(get_mount_table().mounts("fuse.rclone").items())
+        ]
+    
+    def expected_mounts(self) -> Dict[str, Dict]:
+        """
+        Mount che dovrebbero essere attivi
+        
+        Letti dai file ambiente delle istanze ncwrap-rclone@, dalle unit
+        ncwrap-rclone-* non ancora migrate (senza avviare systemctl) e dallo
+        stato del supervisore.
+        
+        Returns:
+            Dict mount point -> {username, remote, profile, owner, unit}:
+            owner "unit" (unit systemd in `unit`) o "supervisor" indica chi
+            deve rimontarlo
+        """
+        expected = {}
+        prefix = self.config["service_prefix"]
+        for units, unit_name in ((self._legacy_units(), f"{prefix}-rclone-{{}}"),
+                                 (self._instance_units(), f"{prefix}-rclone@{{}}")):
+            for username, spec in units.items():
+                expected[spec["mount_point"]] = {
+                    "username": username,
+                    "remote": spec["remote"],
+                    "profile": spec["profile"],
+                    "owner": "unit",
+                    "unit": unit_name.format(username)
+                }
         
+        from .supervisor import MountSupervisor
         try:
-            mount_output = run(["mount", "-t", "fuse.rclone"], check=False)
-            for line in mount_output.split('\n'):
-                if line.strip() and "rclone" in line:
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        mounts.append({
-                            "engine": MountEngine.RCLONE,
-                            "remote": parts[0],
-                            "mountpoint": parts[2],
-                            "type": "rclone",
-                            "options": ' '.join(parts[5:]) if len(parts) > 5 else ""
-                        })
-        except:
+            for mount_point, spec in MountSupervisor().desired().items():
+                remote = spec["remote"].rstrip(":")
+                expected[mount_point] = {
+                    "username": remote[3:] if remote.startswith("nc-") else remote,
+                    "remote": remote,
+                    "profile": spec["profile"],
+                    "owner": "supervisor",
+                    "unit": None
+                }
+        except RuntimeError:
             pass
         
-        return mounts
+        return expected
     
     def get_mount_status(self, home_path: str) -> Dict:
         """Status dettagliato di un mount"""
@@ -297,11 +542,14 @@ class MountManager:
                 "status": "Not mounted"
             }
         
+        from .mountstats import collect_mount_stats
+        
         return {
             "mounted": True,
             "engine": MountEngine.RCLONE,
             "status": "Active (rclone)",
-            "profile": self._detect_rclone_profile(home_path)
+            "profile": self._detect_rclone_profile(home_path),
+            "stats": collect_mount_stats(home_path)
         }
     
     def _detect_rclone_profile(self, mount_point: str) -> Optional[str]:
@@ -416,9 +664,8 @@ def setup_user_with_mount(username: str, password: str, quota: str = None,
             username, password, home_path, profile
         )
         
-        # Abilita servizio
-        from .utils import run
-        run(["systemctl", "enable", "--now", f"{service_name}.service"], check=False)
+        # Abilita servizio (istanza del template: niente daemon-reload)
+        mount_manager.enable_mount_service(service_name)
         print(f"✅ Servizio systemd: {service_name}")
         
     except Exception as e:
@@ -86,12 +86,11 @@ def setup_user_with_mount(username: str, password: str, quota: str = None,
     # 7. Crea servizio systemd rclone
     try:
         service_name = mount_manager.create_systemd_service(
-            username, password, home_path, MountEngine.RCLONE, profile
+            username, password, home_path, profile
         )
         
-        # Abilita servizio
-        from .utils import run
-        run(["systemctl", "enable", "--now", f"{service_name}.service"], check=False)
+        # Abilita servizio (istanza del template: niente daemon-reload)
+        mount_manager.enable_mount_service(service_name)
         print(f"✅ Servizio systemd: {service_name}")
         
     except Exception as e:
@@ -0,0 +1,136 @@
+"""
+Statistiche live dei mount rclone (trasferimenti e cache VFS)
+
+Ogni mount avviato da `mount_remote()` espone l'API rc su un socket unix
+privato (`rclone.mount_rc_socket`); i mount del supervisore usano il socket
+del proprio shard. Da lì si leggono `core/stats` (byte e velocità verso
+Nextcloud) e `vfs/stats` (cache su disco, coda upload) per dimensionare
+--vfs-cache-max-size su dati reali invece che a intuito.
+
+rclone non espone contatori di hit della cache: come indicatore si usa il
+riempimento della cache rispetto a CacheMaxSize insieme ai byte scaricati.
+"""
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .rclone import RCLONE_CONF, list_rclone_mounts, mount_rc_socket
+from .rclone_rc import RcloneRC, RcloneRCError
+from .utils import parse_size_to_bytes
+
+
+def rclone_size_to_bytes(value) -> Optional[int]:
+    """Dimensione rclone (int o stringa tipo "5Gi") in bytes"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str) and value and value != "off":
+        try:
+            return parse_size_to_bytes(value.rstrip("i"))
+        except ValueError:
+            return None
+    return None
+
+
+def stats_endpoint(mount_point: str) -> Tuple[Optional[RcloneRC], Optional[str], Optional[str]]:
+    """
+    Client rc che ospita un mount
+
+    Returns:
+        Tupla (client, fs per vfs/stats, shard) con client None se il mount
+        non ha un endpoint rc (avviato senza --rc o da un'altra versione)
+    """
+    from .supervisor import MountSupervisor
+
+    try:
+        hosted = MountSupervisor().endpoint(mount_point)
+    except RuntimeError:
+        hosted = None
+    if hosted is not None:
+        shard, client, fs = hosted
+        return (client if fs else None), fs, shard
+
+    socket_path = mount_rc_socket(mount_point)
+    if socket_path is None or not os.path.exists(socket_path):
+        return None, None, None
+    return RcloneRC(str(RCLONE_CONF), socket_path=socket_path), None, None
+
+
+def summarize_stats(core: Dict, vfs: Dict) -> Dict:
+    """
+    Riduce core/stats e vfs/stats alle metriche utili per tenant
+
+    Returns:
+        Dict con sezioni "transfers" e "vfs"
+    """
+    disk = vfs.get("diskCache") or {}
+    opt = vfs.get("opt") or {}
+    cache_bytes = disk.get("bytesUsed")
+    cache_max = rclone_size_to_bytes(opt.get("CacheMaxSize"))
+
+    return {
+        "transfers": {
+            "bytes": core.get("bytes", 0),
+            "speed": core.get("speed", 0.0),
+            "transfers": core.get("transfers", 0),
+            "active": len(core.get("transferring") or []),
+            "checks": core.get("checks", 0),
+            "errors": core.get("errors", 0),
+            "elapsed": core.get("elapsedTime", 0.0),
+        },
+        "vfs": {
+            "cache_mode": opt.get("CacheMode"),
+            "open_files": vfs.get("inUse", 0),
+            "metadata_dirs": (vfs.get("metadataCache") or {}).get("dirs", 0),
+            "metadata_files": (vfs.get("metadataCache") or {}).get("files", 0),
+            "cache_bytes": cache_bytes,
+            "cache_files": disk.get("files"),
+            "cache_max_bytes": cache_max,
+            "cache_fill": round(cache_bytes / cache_max, 4) if cache_bytes is not None and cache_max else None,
+            "uploads_queued": disk.get("uploadsQueued", 0),
+            "uploads_in_progress": disk.get("uploadsInProgress", 0),
+            "errored_files": disk.get("erroredFiles", 0),
+            "out_of_space": disk.get("outOfSpace", False),
+        },
+    }
+
+
+def collect_mount_stats(mount_point: str, source: Optional[str] = None) -> Dict:
+    """
+    Statistiche live di un mount rclone
+
+    Returns:
+        Dict con mount_point, source, shard, scope ("mount" o "shard": nei
+        mount del supervisore i trasferimenti sono del demone condiviso),
+        timestamp, transfers, vfs ed eventuale error
+    """
+    mount_point = os.path.realpath(mount_point)
+    if source is None:
+        source = list_rclone_mounts().get(mount_point)
+
+    client, fs, shard = stats_endpoint(mount_point)
+    result = {
+        "mount_point": mount_point,
+        "source": source,
+        "shard": shard,
+        "scope": "shard" if shard else "mount",
+        "timestamp": time.time(),
+    }
+    if client is None:
+        result["error"] = "endpoint rc non disponibile (rimonta per abilitarlo)"
+        return result
+
+    try:
+        result.update(summarize_stats(client.core_stats(), client.vfs_stats(fs)))
+    except (RcloneRCError, OSError) as e:
+        result["error"] = str(e)
+    return result
+
+
+def collect_all_stats(mount_points: Optional[List[str]] = None) -> List[Dict]:
+    """Statistiche di tutti i mount rclone attivi (o di quelli indicati)"""
+    mounts = list_rclone_mounts()
+    if mount_points:
+        targets = [os.path.realpath(mount_point) for mount_point in mount_points]
+    else:
+        targets = sorted(mounts)
+    return [collect_mount_stats(mount_point, mounts.get(mount_point)) for mount_point in targets]
@@ -0,0 +1,285 @@
+"""
+Tabella dei mount indicizzata per mount point
+
+Sostituisce i controlli `path in open('/proc/mounts').read()` (match per
+sottostringa: /home/a risultava montato se lo era /home/ab) e le
+invocazioni di `mount` per ogni verifica.
+
+/proc/self/mountinfo viene letto una volta e riletto solo quando il
+kernel segnala una modifica: un descrittore resta aperto e poll() riporta
+POLLPRI/POLLERR dopo ogni mount o umount nel namespace. Tutti i controlli
+del processo condividono la stessa istantanea (get_mount_table), quindi
+verificare 1000 utenti costa un solo parse.
+
+La notifica è consumata dal primo poll() sullo stesso file aperto: chi
+attende eventi (watcher, wait_for_mount) apre un proprio MountNotifier
+invece di condividere il descrittore della tabella. Così wait_for_mount()
+attende l'evento del kernel e la risposta di statfs() dal demone FUSE
+invece di una pausa fissa, senza sottrarre eventi al watcher.
+"""
+import ctypes
+import os
+import re
+import select
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .utils import call_with_timeout, wait_for_condition
+
+MOUNTINFO = "/proc/self/mountinfo"
+# f_type di statfs(2) per i filesystem FUSE
+FUSE_SUPER_MAGIC = 0x65735546
+# Attesa massima di una singola statfs() su un mount FUSE (secondi)
+STATFS_TIMEOUT = 5.0
+
+_OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def unescape_mount_field(value: str) -> str:
+    """Decodifica gli escape ottali del kernel (\\040 = spazio)"""
+    return _OCTAL_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), value)
+
+
+@dataclass
+class MountEntry:
+    """Riga di /proc/self/mountinfo"""
+    mount_point: str
+    fstype: str
+    source: str
+    options: str
+    super_options: str = ""
+    mount_id: int = 0
+
+    @property
+    def read_only(self) -> bool:
+        return "ro" in self.options.split(",")
+
+
+def parse_mountinfo(content: str) -> Dict[str, MountEntry]:
+    """
+    Parse del contenuto di mountinfo
+
+    Returns:
+        Dict mount point -> MountEntry (per mount sovrapposti vince l'ultimo,
+        cioè quello visibile)
+    """
+    entries = {}
+    for line in content.splitlines():
+        # id parent maj:min root mount_point opzioni [opzionali...] - fstype sorgente super
+        fields, _, tail = line.partition(" - ")
+        fields, tail = fields.split(), tail.split()
+        if len(fields) < 6 or len(tail) < 2:
+            continue
+        mount_point = unescape_mount_field(fields[4])
+        entries[mount_point] = MountEntry(
+            mount_point=mount_point,
+            fstype=tail[0],
+            source=unescape_mount_field(tail[1]),
+            options=fields[5],
+            super_options=tail[2] if len(tail) > 2 else "",
+            mount_id=int(fields[0]) if fields[0].isdigit() else 0,
+        )
+    return entries
+
+
+class MountNotifier:
+    """
+    Descrittore proprio su mountinfo per attendere mount/umount
+
+    Il kernel tiene lo stato della notifica per ogni file aperto: ogni
+    notifier riceve tutti gli eventi successivi alla sua apertura,
+    indipendentemente dagli altri.
+
+    Uso:
+        with get_mount_table().notifier() as notifier:
+            while not ready():
+                notifier.wait(1.0)
+    """
+
+    def __init__(self, path: str = MOUNTINFO):
+        try:
+            self._fd: Optional[int] = os.open(path, os.O_RDONLY)
+            self._poll = select.poll()
+            self._poll.register(self._fd, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            self._fd, self._poll = None, None
+
+    def fileno(self) -> Optional[int]:
+        """Descrittore per un poll() esterno (None se le notifiche non sono disponibili)"""
+        return self._fd
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Attende una modifica della tabella mount per al massimo timeout secondi
+
+        Returns:
+            True se il kernel ha segnalato un mount/umount (o se le notifiche
+            non sono disponibili e il timeout è trascorso)
+        """
+        if self._poll is None:
+            time.sleep(timeout)
+            return True
+        return bool(self._poll.poll(int(timeout * 1000)))
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd, self._poll = None, None
+
+    def __enter__(self) -> "MountNotifier":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class MountTable:
+    """
+    Istantanea dei mount aggiornata solo su notifica del kernel
+
+    Uso:
+        table = get_mount_table()
+        if table.is_mounted("/home/mario"): ...
+        rclone_mounts = table.mounts("fuse.rclone")
+    """
+
+    def __init__(self, path: str = MOUNTINFO):
+        self.path = path
+        self._entries: Optional[Dict[str, MountEntry]] = None
+        self._lock = threading.Lock()
+        self.parses = 0
+        try:
+            self._fd: Optional[int] = os.open(path, os.O_RDONLY)
+            self._poll = select.poll()
+            self._poll.register(self._fd, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            # Nessuna notifica disponibile: rilettura ad ogni accesso
+            self._fd, self._poll = None, None
+
+    def _changed(self) -> bool:
+        if self._poll is None:
+            return True
+        return bool(self._poll.poll(0))
+
+    def _read(self) -> str:
+        if self._fd is None:
+            try:
+                with open(self.path, "r") as f:
+                    return f.read()
+            except OSError:
+                return ""
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks).decode("utf-8", "surrogateescape")
+
+    def snapshot(self) -> Dict[str, MountEntry]:
+        """Mount correnti (riletti solo se il kernel ha segnalato modifiche)"""
+        with self._lock:
+            if self._entries is None or self._changed():
+                self._entries = parse_mountinfo(self._read())
+                self.parses += 1
+            return self._entries
+
+    def notifier(self) -> MountNotifier:
+        """Nuovo MountNotifier sullo stesso file (da chiudere dopo l'uso)"""
+        return MountNotifier(self.path)
+
+    def refresh(self) -> None:
+        """Forza la rilettura al prossimo accesso"""
+        with self._lock:
+            self._entries = None
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        # Niente realpath: lstat su un mount FUSE bloccato si bloccherebbe
+        return os.path.normpath(os.path.abspath(path))
+
+    def get(self, path: str) -> Optional[MountEntry]:
+        """Mount con mount point esattamente uguale a path"""
+        if not path:
+            return None
+        return self.snapshot().get(self._normalize(path))
+
+    def is_mounted(self, path: str, fstype: Optional[str] = None) -> bool:
+        """True se path è un mount point (opzionalmente di un certo tipo)"""
+        entry = self.get(path)
+        return entry is not None and (fstype is None or entry.fstype == fstype)
+
+    def mounts(self, fstype: Optional[str] = None) -> Dict[str, MountEntry]:
+        """Mount point -> MountEntry, filtrati per tipo filesystem"""
+        entries = self.snapshot()
+        if fstype is None:
+            return dict(entries)
+        return {path: entry for path, entry in entries.items() if entry.fstype == fstype}
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd, self._poll = None, None
+
+
+_table: Optional[MountTable] = None
+_table_lock = threading.Lock()
+
+
+def get_mount_table() -> MountTable:
+    """Tabella mount condivisa dal processo"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = MountTable()
+    return _table
+
+
+_libc = None
+
+
+def statfs_type(path: str) -> Optional[int]:
+    """
+    f_type di statfs(2) per path (None se la chiamata fallisce)
+
+    Su un mount FUSE la richiesta arriva al processo che lo serve: una
+    risposta FUSE_SUPER_MAGIC indica che il demone è pronto.
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    # struct statfs: f_type è il primo campo (__fsword_t, long)
+    buffer = ctypes.create_string_buffer(256)
+    if _libc.statfs(os.fsencode(path), buffer) != 0:
+        return None
+    return ctypes.c_ulong.from_buffer(buffer).value & 0xFFFFFFFF
+
+
+def wait_for_mount(path: str, fstype: Optional[str] = "fuse.rclone",
+                   timeout: float = 30, interval: float = 0.5) -> bool:
+    """
+    Attende che path sia montato e il filesystem risponda
+
+    Si sveglia alla notifica di mountinfo; per i mount FUSE verifica anche
+    statfs(), ricontrollato ogni `interval` finché il demone non risponde.
+
+    Returns:
+        True se il mount è pronto entro timeout
+    """
+    table = get_mount_table()
+
+    def ready() -> bool:
+        if not table.is_mounted(path, fstype):
+            return False
+        if fstype is None or not fstype.startswith("fuse"):
+            return True
+        # statfs() su un demone FUSE bloccato non ritorna: oltre il timeout = non pronto
+        return call_with_timeout(lambda: statfs_type(path), STATFS_TIMEOUT) == FUSE_SUPER_MAGIC
+
+    # Aperto prima del primo controllo: nessun evento va perso nel mezzo
+    with table.notifier() as notifier:
+        return wait_for_condition(ready, timeout, interval, notifier.wait)
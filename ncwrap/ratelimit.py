@@ -0,0 +1,324 @@
+"""
+Rate limiting lato client per richieste Nextcloud
+
+Token bucket adattivo: nessun rallentamento finché il server non risponde
+429, poi il rate viene ridotto (e rispettato Retry-After) e risale
+gradualmente con le risposte positive. Il tetto fisso (NC_RATE_LIMIT) è
+opzionale.
+
+SharedRateLimiter tiene lo stato per host Nextcloud in un piccolo file
+protetto da flock (/run/ncwrap/ratelimit): CLI concorrenti, unità systemd e
+comandi rclone condividono lo stesso budget e lo stesso rate appreso.
+"""
+import fcntl
+import math
+import os
+import re
+import struct
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional, Union
+from urllib.parse import urlsplit
+
+from .utils import env_int, first_writable_dir
+
+# Rate iniziale (richieste/s) e burst predefiniti
+DEFAULT_RATE = 50.0
+DEFAULT_BURST = 50
+# Limiti adattamento
+MIN_RATE = 0.5
+DECREASE_FACTOR = 0.5
+INCREASE_STEP = 1.0
+# Finestra in cui più 429 contano come un solo evento di congestione
+DECREASE_COOLDOWN = 1.0
+# Senza tetto: finestra su cui si misura il rate reale e durata minima della misura
+OBSERVE_WINDOW = 1.0
+OBSERVE_MIN = 0.1
+
+# Directory stato condiviso (la prima scrivibile)
+SHARED_STATE_DIRS = ("/run/ncwrap/ratelimit", "~/.cache/ncwrap/ratelimit")
+# rate, tokens, updated, blocked_until, last_decrease (epoch, secondi)
+_STATE = struct.Struct("<5d")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Converte header Retry-After in secondi
+
+    Args:
+        value: Valore header (secondi o data HTTP)
+
+    Returns:
+        Secondi di attesa o None se assente/non valido
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class _AdaptiveLimiter:
+    """
+    Token bucket con adattamento AIMD, comune a TokenBucket e SharedRateLimiter
+
+    Lo stato è una lista [rate, tokens, updated, blocked_until, last_decrease];
+    le sottoclassi forniscono solo _update(func), che esegue func(state, now)
+    in modo atomico (lock di thread o flock sul file condiviso).
+
+    - reserve()/acquire(): consumano un token (rispettando la pausa da Retry-After)
+    - on_throttle(): 429 → rate dimezzato + pausa; più 429 entro
+      DECREASE_COOLDOWN contano come un'unica riduzione (N richieste in volo
+      che ricevono lo stesso burst di 429 non dividono il rate per 2^N)
+    - on_success(): +INCREASE_STEP/rate per risposta, cioè circa
+      +INCREASE_STEP richieste/s per ogni secondo senza 429
+
+    Con rate infinito (nessun tetto) non si consumano token: tokens/updated
+    contano le richieste recenti e al primo 429 il rate riparte dalla metà
+    di quello effettivamente osservato.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int], min_rate: float,
+                 max_rate: Optional[float]):
+        self.initial_rate = float(rate)
+        self.max_rate = float(max_rate if max_rate is not None else rate)
+        if burst is None:
+            burst = DEFAULT_BURST if math.isinf(self.initial_rate) else max(int(rate), 1)
+        self.burst = float(burst)
+        self.min_rate = min_rate
+
+    def _initial_state(self, now: float) -> list:
+        tokens = 0.0 if math.isinf(self.initial_rate) else self.burst
+        return [self.initial_rate, tokens, now, 0.0, 0.0]
+
+    def _update(self, func):
+        raise NotImplementedError
+
+    def _refill(self, state: list, now: float) -> None:
+        elapsed = now - state[2]
+        if math.isinf(state[0]):
+            # Conteggio richieste sull'ultima OBSERVE_WINDOW; dopo una pausa si riparte
+            if elapsed >= 2 * OBSERVE_WINDOW:
+                state[1], state[2] = 0.0, now
+            elif elapsed > OBSERVE_WINDOW:
+                state[1] *= OBSERVE_WINDOW / elapsed
+                state[2] = now - OBSERVE_WINDOW
+        elif elapsed > 0:
+            state[1] = min(self.burst, state[1] + elapsed * state[0])
+            state[2] = now
+
+    @property
+    def rate(self) -> float:
+        """Rate corrente (richieste/s, inf = nessun limite)"""
+        return self._update(lambda state, now: state[0])
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        Prova a consumare un token senza attendere
+
+        Returns:
+            0 se token ottenuto, altrimenti secondi da attendere prima di riprovare
+        """
+        def take(state, now):
+            wait = state[3] - now
+            if wait > 0:
+                return wait
+            if math.isinf(state[0]):
+                state[1] += tokens
+                return 0.0
+            if state[1] >= tokens:
+                state[1] -= tokens
+                return 0.0
+            return (tokens - state[1]) / state[0]
+        return self._update(take)
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Attende finché è disponibile un token
+
+        Args:
+            tokens: Token da consumare
+            timeout: Attesa massima in secondi (None = illimitata)
+
+        Returns:
+            True se token ottenuto, False se scaduto il timeout
+        """
+        return _wait_for_token(self, tokens, timeout)
+
+    def on_success(self) -> None:
+        """Incremento additivo del rate fino a max_rate"""
+        def increase(state, now):
+            if state[0] < self.max_rate:
+                state[0] = min(self.max_rate, state[0] + INCREASE_STEP / max(state[0], 1.0))
+        self._update(increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> float:
+        """
+        Riduzione moltiplicativa del rate e pausa globale
+
+        Args:
+            retry_after: Secondi indicati dal server (Retry-After)
+
+        Returns:
+            Secondi di pausa applicati
+        """
+        def decrease(state, now):
+            if now - state[4] >= DECREASE_COOLDOWN:
+                if math.isinf(state[0]):
+                    state[0] = state[1] / max(now - state[2], OBSERVE_MIN)
+                state[0] = max(self.min_rate, state[0] * DECREASE_FACTOR)
+                state[4] = now
+            pause = retry_after if retry_after is not None else 1.0 / state[0]
+            state[3] = max(state[3], now + pause)
+            state[1] = 0.0
+            state[2] = now
+            return pause
+        return self._update(decrease)
+
+
+class TokenBucket(_AdaptiveLimiter):
+    """Limiter AIMD thread-safe con stato in memoria, locale al processo"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: Optional[int] = None,
+                 min_rate: float = MIN_RATE, max_rate: Optional[float] = None):
+        super().__init__(rate, burst, min_rate, max_rate)
+        self._state = self._initial_state(time.monotonic())
+        self._lock = threading.Lock()
+
+    def _update(self, func):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(self._state, now)
+            return func(self._state, now)
+
+
+def _wait_for_token(limiter, tokens: float, timeout: Optional[float]) -> bool:
+    """Ciclo di attesa comune: reserve() + sleep finché il token è disponibile"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = limiter.reserve(tokens)
+        if wait <= 0:
+            return True
+        if deadline is not None and time.monotonic() + wait > deadline:
+            return False
+        time.sleep(wait)
+
+
+def host_key(url: str) -> str:
+    """Chiave limiter: schema + host + porta (come il pool HTTP)"""
+    parts = urlsplit(url)
+    if not parts.netloc:
+        return url.lower()
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class SharedRateLimiter(_AdaptiveLimiter):
+    """
+    Limiter AIMD con stato condiviso tra processi (file + flock)
+
+    Il rate appreso sopravvive ai processi: una nuova CLI parte dal rate
+    sostenibile già misurato invece che dal massimo.
+    """
+
+    def __init__(self, path: Union[str, Path], rate: float = DEFAULT_RATE,
+                 burst: Optional[int] = None, min_rate: float = MIN_RATE):
+        super().__init__(rate, burst, min_rate, rate)
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._pid = 0
+        self._open()
+
+    def _open(self) -> int:
+        # Dopo fork serve un nuovo file descriptor: flock è legato alla
+        # open file description, condivisa tra padre e figlio
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _read(self, fd: int, now: float) -> list:
+        data = os.pread(fd, _STATE.size, 0)
+        if len(data) == _STATE.size:
+            state = list(_STATE.unpack(data))
+            rate = state[0]
+            if self.min_rate <= rate <= self.max_rate and state[2] <= now + 1:
+                return state
+        return self._initial_state(now)
+
+    def _update(self, func):
+        """Esegue func(state, now) sotto lock di thread e di file, poi salva"""
+        with self._lock:
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                state = self._read(fd, now)
+                self._refill(state, now)
+                result = func(state, now)
+                os.pwrite(fd, _STATE.pack(*state), 0)
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+
+
+_limiters: Dict[str, Union[SharedRateLimiter, TokenBucket]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url: str) -> Optional[Union[SharedRateLimiter, TokenBucket]]:
+    """
+    Limiter di processo per l'host dell'URL
+
+    NC_RATE_LIMIT: assente = nessun tetto finché il server non risponde 429
+    (poi AIMD dal rate osservato), N > 0 = massimo N richieste/s, 0 = limiter
+    disattivato. Se nessuna directory stato è scrivibile si usa un
+    TokenBucket locale al processo.
+
+    Returns:
+        Limiter o None se il rate limiting è disabilitato
+    """
+    max_rate = env_int("NC_RATE_LIMIT", -1)
+    if max_rate == 0:
+        return None
+    max_rate = float(max_rate) if max_rate > 0 else math.inf
+
+    key = host_key(url)
+    limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            state_dir = first_writable_dir(SHARED_STATE_DIRS, "NC_RATELIMIT_DIR")
+            filename = re.sub(r"[^A-Za-z0-9.-]+", "_", key).strip("_") + ".state"
+            try:
+                if state_dir is None:
+                    raise OSError("nessuna directory stato scrivibile")
+                limiter = SharedRateLimiter(state_dir / filename, rate=max_rate)
+            except OSError:
+                limiter = TokenBucket(rate=max_rate)
+            _limiters[key] = limiter
+        return limiter
+
+
+def reset_limiters() -> None:
+    """Chiude e scarta i limiter di processo"""
+    with _limiters_lock:
+        for limiter in _limiters.values():
+            if isinstance(limiter, SharedRateLimiter):
+                limiter.close()
+        _limiters.clear()
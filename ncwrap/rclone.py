@@ -1,15 +1,24 @@
 """
 Gestione rclone per sync e mount Nextcloud
 """
+import hashlib
 import os
 import subprocess
 import json
+import math
 from pathlib import Path
 from typing import List, Dict, Optional
-from .utils import run, ensure_dir, run_with_retry, merge_cli_options
+from .utils import run, ensure_dir, run_with_retry, merge_cli_options, get_directory_size, first_writable_dir, file_lock
+from .ratelimit import get_limiter
+from .rclone_rc import RcloneRC, RcloneRCError
 
 # Configurazione globale
 RCLONE_CONF = Path.home() / ".config" / "ncwrap" / "rclone.conf"
+# Socket rc dei singoli mount (statistiche VFS; NC_MOUNT_RC=0 disabilita)
+MOUNT_RC_DIRS = (f"/run/ncwrap/mounts-{os.getuid()}", "~/.cache/ncwrap/mounts")
+# Template unit dei mount tenant (istanze ncwrap-rclone@<utente>) e file ambiente per istanza
+MOUNT_TEMPLATE_UNIT = "ncwrap-rclone@.service"
+MOUNT_ENV_DIR = "/etc/ncwrap/mounts"
 # Configurazioni per diversi scenari di hosting
 HOSTING_MOUNT_OPTIONS = [
     "--vfs-cache-mode", "off",      # Zero cache locale, streaming puro
@@ -98,6 +107,95 @@ def ensure_config():
         RCLONE_CONF.write_text("")
 
 
+_rc_client: Optional[RcloneRC] = None
+_rc_unavailable = False
+
+
+def _config_lock():
+    """
+    Lock sulle scritture di rclone.conf
+
+    `rclone config create/delete` rilegge e riscrive tutto il file: processi
+    o worker concorrenti (es. provisioning bulk) perderebbero dei remote.
+    """
+    ensure_config()
+    return file_lock(f"{RCLONE_CONF}.lock")
+
+
+def get_rc() -> Optional[RcloneRC]:
+    """
+    Client rc verso il demone `rclone rcd` condiviso (avviato al primo uso)
+
+    Returns:
+        RcloneRC o None se disabilitato (NC_RCLONE_RC=0) o non avviabile:
+        in quel caso le funzioni di questo modulo usano la CLI rclone
+    """
+    global _rc_client, _rc_unavailable
+    if os.environ.get("NC_RCLONE_RC", "1") == "0" or _rc_unavailable:
+        return None
+    if _rc_client is None:
+        try:
+            ensure_config()
+            client = RcloneRC(str(RCLONE_CONF))
+            client.start()
+            _rc_client = client
+        except (RcloneRCError, OSError):
+            _rc_unavailable = True
+            return None
+    return _rc_client
+
+
+def _rc_config(limiter=None) -> Optional[Dict]:
+    """Override _config per una chiamata rc: TPSLimit al rate appreso per l'host"""
+    if limiter is None:
+        return None
+    limiter.acquire()
+    rate = limiter.rate
+    if math.isinf(rate):
+        return None
+    return {"TPSLimit": round(rate, 2)}
+
+
+def _split_fs(path: str):
+    """'remote:percorso' -> ('remote:', 'percorso'); percorsi locali invariati"""
+    if ":" in path and not path.startswith("/"):
+        remote, rest = path.split(":", 1)
+        return f"{remote}:", rest.strip("/")
+    return path, ""
+
+
+def _nc_limiter():
+    """Rate limiter condiviso dell'host Nextcloud (None se NC_BASE_URL assente o disabilitato)"""
+    base_url = os.environ.get("NC_BASE_URL")
+    return get_limiter(base_url) if base_url else None
+
+
+def _rate_limited(cmd: List[str], limiter=None) -> List[str]:
+    """
+    Attende un token dal limiter condiviso e limita le transazioni HTTP
+    interne di rclone (--tpslimit) al rate appreso per l'host
+    """
+    if limiter is None:
+        return cmd
+    limiter.acquire()
+    rate = limiter.rate
+    if math.isinf(rate):
+        # Nessun 429 finora e nessun tetto configurato
+        return cmd
+    return cmd + ["--tpslimit", f"{rate:.2f}"]
+
+
+def _report_throttle(limiter, stderr: str) -> None:
+    """Segnala al limiter condiviso un 429 visto da rclone"""
+    if limiter is None:
+        return
+    stderr_lower = stderr.lower()
+    if "429" in stderr_lower or "too many requests" in stderr_lower:
+        limiter.on_throttle()
+    else:
+        limiter.on_success()
+
+
 def add_nextcloud_remote(name: str, base_url: str, username: str, password: str, use_bearer_token: bool = True) -> bool:
     """
     Aggiunge un remote Nextcloud WebDAV a rclone
@@ -142,29 +240,23 @@ def add_nextcloud_remote(name: str, base_url: str, username: str, password: str,
         # Crea il remote rclone con supporto sia Basic Auth che Bearer Token
         if use_bearer_token:
             # AppAPI compatibility - usa bearer_token
-            cmd = [
-                "rclone", "config", "create", name, "webdav",
-                f"url={webdav_url}",
-                f"bearer_token={password}",
-                "vendor=nextcloud",
-                "--config", str(RCLONE_CONF)
-            ]
+            parameters = {"url": webdav_url, "bearer_token": password, "vendor": "nextcloud"}
             print(f"🔐 Usando bearer_token authentication (AppAPI compatible)")
-            print(f"Comando rclone: {' '.join(cmd[:6])}...")  # Non mostrare token
         else:
             # Basic Auth tradizionale - usa user/pass
-            cmd = [
-                "rclone", "config", "create", name, "webdav",
-                f"url={webdav_url}",
-                f"user={username}",
-                f"pass={password}",
-                "vendor=nextcloud",
-                "--config", str(RCLONE_CONF)
-            ]
+            parameters = {"url": webdav_url, "user": username, "pass": password, "vendor": "nextcloud"}
             print(f"🔐 Usando basic authentication (legacy mode)")
-            print(f"Comando rclone: {' '.join(cmd[:7])}...")  # Non mostrare password
         
-        run(cmd)
+        rc = get_rc()
+        with _config_lock():
+            if rc is not None:
+                rc.config_create(name, "webdav", parameters)
+            else:
+                cmd = ["rclone", "config", "create", name, "webdav"]
+                cmd += [f"{key}={value}" for key, value in parameters.items()]
+                cmd += ["--config", str(RCLONE_CONF)]
+                print(f"Comando rclone: {' '.join(cmd[:6])}...")  # Non mostrare password/token
+                run(cmd)
         
         # Test il remote appena creato
         test_cmd = [
@@ -174,13 +266,16 @@ def add_nextcloud_remote(name: str, base_url: str, username: str, password: str,
         ]
         
         try:
-            run(test_cmd)
+            if rc is not None:
+                rc.list(f"{name}:", dirs_only=True, config=_rc_config(_nc_limiter()))
+            else:
+                run(_rate_limited(test_cmd, _nc_limiter()))
             print(f"✅ Remote {name} creato e testato con successo")
             return True
         except RuntimeError as test_error:
             print(f"❌ Test remote fallito: {test_error}")
             # Rimuovi il remote fallito
-            run(["rclone", "config", "delete", name, "--config", str(RCLONE_CONF)], check=False)
+            remove_remote(name)
             return False
             
     except RuntimeError as e:
@@ -191,7 +286,12 @@ def add_nextcloud_remote(name: str, base_url: str, username: str, password: str,
 def remove_remote(name: str) -> bool:
     """Rimuove un remote dalla configurazione"""
     try:
-        run(["rclone", "config", "delete", name, "--config", str(RCLONE_CONF)])
+        rc = get_rc()
+        with _config_lock():
+            if rc is not None:
+                rc.config_delete(name)
+            else:
+                run(["rclone", "config", "delete", name, "--config", str(RCLONE_CONF)])
         return True
     except RuntimeError:
         return False
@@ -199,6 +299,12 @@ def remove_remote(name: str) -> bool:
 
 def list_remotes() -> List[str]:
     """Lista tutti i remote configurati"""
+    rc = get_rc()
+    if rc is not None:
+        try:
+            return rc.list_remotes()
+        except RcloneRCError:
+            pass
     try:
         output = run([
             "rclone", "listremotes", 
@@ -255,6 +361,12 @@ def mount_remote(remote_name: str, mount_point: str, background: bool = True,
 
     if profile in MOUNT_PROFILES:
         options.extend(MOUNT_PROFILES[profile]["options"])
+    # Profilo generato da `mount tune` per questo remote (sopra al profilo statico)
+    from .tuner import load_tuned_options
+    tuned_options = load_tuned_options(remote_name)
+    if tuned_options:
+        print(f"🎛️ Opzioni ottimizzate per {remote_name}: {' '.join(tuned_options)}")
+        options.extend(tuned_options)
     if custom_options:
         options.extend(custom_options)
 
@@ -262,6 +374,15 @@ def mount_remote(remote_name: str, mount_point: str, background: bool = True,
     merged_options = merge_cli_options(options)
     cmd.extend(merged_options)
     
+    # API rc privata del mount: core/stats e vfs/stats per `mount stats`
+    rc_socket = mount_rc_socket(mount_point) if os.environ.get("NC_MOUNT_RC", "1") != "0" else None
+    if rc_socket:
+        try:
+            os.unlink(rc_socket)  # socket di un mount precedente
+        except FileNotFoundError:
+            pass
+        cmd.extend(["--rc", "--rc-addr", f"unix://{rc_socket}", "--rc-no-auth"])
+    
     # Modalità daemon se richiesta
     if background:
         cmd.append("--daemon")
@@ -311,12 +432,9 @@ def unmount(mount_point: str) -> bool:
 
 
 def is_mounted(mount_point: str) -> bool:
-    """Verifica se un punto è montato"""
-    try:
-        output = run(["mount"], check=False)
-        return mount_point in output
-    except:
-        return False
+    """Verifica se un punto è montato (senza avviare `mount`)"""
+    from .mounttable import get_mount_table
+    return get_mount_table().is_mounted(mount_point)
 
 
 def sync_directories(source: str, dest: str, dry_run: bool = False, 
@@ -333,6 +451,22 @@ def sync_directories(source: str, dest: str, dry_run: bool = False,
     Returns:
         True se sync riuscita
     """
+    limiter = _nc_limiter()
+    rc = get_rc()
+    if rc is not None:
+        # sync/sync elimina gli extra in destinazione a fine trasferimento
+        # (delete-after, default rclone) anche senza --delete-during
+        try:
+            rc.sync(source, dest, dry_run=dry_run, config=_rc_config(limiter))
+            if limiter is not None:
+                limiter.on_success()
+            return True
+        except RcloneRCError as e:
+            if e.status:
+                _report_throttle(limiter, str(e))
+                print(f"Errore sync: {e}")
+                return False
+    
     cmd = [
         "rclone", "sync", source, dest,
         "--config", str(RCLONE_CONF),
@@ -346,7 +480,8 @@ def sync_directories(source: str, dest: str, dry_run: bool = False,
         cmd.append("--delete-during")
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = subprocess.run(_rate_limited(cmd, limiter), capture_output=True, text=True)
+        _report_throttle(limiter, result.stderr)
         if result.returncode != 0:
             print(f"Errore sync: {result.stderr}")
             return False
@@ -368,6 +503,19 @@ def copy_files(source: str, dest: str, dry_run: bool = False) -> bool:
     Returns:
         True se copia riuscita
     """
+    limiter = _nc_limiter()
+    rc = get_rc()
+    if rc is not None:
+        try:
+            rc.copy(source, dest, dry_run=dry_run, config=_rc_config(limiter))
+            if limiter is not None:
+                limiter.on_success()
+            return True
+        except RcloneRCError as e:
+            if e.status:
+                _report_throttle(limiter, str(e))
+                return False
+    
     cmd = [
         "rclone", "copy", source, dest,
         "--config", str(RCLONE_CONF),
@@ -378,7 +526,8 @@ def copy_files(source: str, dest: str, dry_run: bool = False) -> bool:
         cmd.append("--dry-run")
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = subprocess.run(_rate_limited(cmd, limiter), capture_output=True, text=True)
+        _report_throttle(limiter, result.stderr)
         return result.returncode == 0
     except:
         return False
@@ -386,6 +535,12 @@ def copy_files(source: str, dest: str, dry_run: bool = False) -> bool:
 
 def get_remote_info(remote_name: str) -> Optional[Dict]:
     """Recupera informazioni su un remote"""
+    rc = get_rc()
+    if rc is not None:
+        try:
+            return rc.config_get(remote_name) or None
+        except RcloneRCError:
+            pass
     try:
         output = run([
             "rclone", "config", "show", remote_name,
@@ -406,6 +561,21 @@ def get_remote_info(remote_name: str) -> Optional[Dict]:
 
 def list_files(remote_path: str, max_depth: int = 1) -> List[str]:
     """Lista file in un remote path"""
+    rc = get_rc()
+    if rc is not None:
+        fs, remote = _split_fs(remote_path)
+        try:
+            items = rc.list(fs, remote, recurse=max_depth > 1, config=_rc_config(_nc_limiter()))
+        except RcloneRCError as e:
+            if e.status:
+                return []
+        else:
+            # Stesso formato di `rclone lsf`: percorsi relativi, "/" finale per le cartelle
+            return [
+                item["Path"] + ("/" if item.get("IsDir") else "")
+                for item in items
+                if item["Path"].count("/") < max_depth
+            ]
     try:
         cmd = [
             "rclone", "lsf", remote_path,
@@ -415,7 +585,7 @@ def list_files(remote_path: str, max_depth: int = 1) -> List[str]:
         if max_depth > 1:
             cmd.extend(["--max-depth", str(max_depth)])
         
-        output = run(cmd)
+        output = run(_rate_limited(cmd, _nc_limiter()))
         return [line for line in output.split('\n') if line.strip()]
     except:
         return []
@@ -423,13 +593,26 @@ def list_files(remote_path: str, max_depth: int = 1) -> List[str]:
 
 def check_connectivity(remote_name: str, timeout: int = 30) -> bool:
     """Testa connettività con un remote con retry automatico per rate limiting"""
+    rc = get_rc()
+    if rc is not None:
+        limiter = _nc_limiter()
+        try:
+            rc.list(f"{remote_name}:", dirs_only=True, config=_rc_config(limiter))
+            if limiter is not None:
+                limiter.on_success()
+            return True
+        except RcloneRCError as e:
+            if e.status:
+                _report_throttle(limiter, str(e))
+                print(f"❌ Test remote fallito: {e}")
+                return False
     try:
         run_with_retry([
             "rclone", "lsd", f"{remote_name}:/",
             "--config", str(RCLONE_CONF),
             "--timeout", f"{timeout}s",
             "--retries", "1"  # rclone retry interno disabilitato, gestiamo noi
-        ], max_retries=3, delay_base=2.0)
+        ], max_retries=3, delay_base=2.0, limiter=_nc_limiter())
         return True
     except Exception as e:
         print(f"❌ Test remote fallito: {e}")
@@ -438,17 +621,136 @@ def check_connectivity(remote_name: str, timeout: int = 30) -> bool:
 
 def get_space_info(remote_name: str) -> Optional[Dict]:
     """Recupera informazioni spazio disponibile"""
+    rc = get_rc()
+    if rc is not None:
+        try:
+            return rc.about(f"{remote_name}:", config=_rc_config(_nc_limiter()))
+        except RcloneRCError as e:
+            if e.status:
+                return None
     try:
-        output = run([
+        output = run(_rate_limited([
             "rclone", "about", f"{remote_name}:/",
             "--config", str(RCLONE_CONF),
             "--json"
-        ])
+        ], _nc_limiter()))
         return json.loads(output)
     except:
         return None
 
 
+def list_rclone_mounts() -> Dict[str, str]:
+    """
+    Mount rclone attivi (dalla tabella mount condivisa)
+
+    Returns:
+        Dict mount point -> sorgente ("remote:percorso")
+    """
+    from .mounttable import get_mount_table
+    return {path: entry.source for path, entry in get_mount_table().mounts("fuse.rclone").items()}
+
+
+def get_mount_source(mount_point: str) -> Optional[str]:
+    """
+    Sorgente rclone ("remote:percorso") montata su mount_point
+
+    Returns:
+        Stringa sorgente o None se il percorso non è un mount rclone
+    """
+    return list_rclone_mounts().get(os.path.realpath(mount_point))
+
+
+def mount_rc_socket(mount_point: str) -> Optional[str]:
+    """
+    Socket rc privato di un mount avviato da mount_remote()
+
+    Returns:
+        Percorso del socket (uno per mount point) o None se nessuna
+        directory è scrivibile
+    """
+    directory = first_writable_dir(MOUNT_RC_DIRS, "NC_MOUNT_RC_DIR")
+    if directory is None:
+        return None
+    os.chmod(directory, 0o700)
+    digest = hashlib.sha1(os.path.realpath(mount_point).encode("utf-8")).hexdigest()[:12]
+    return str(directory / f"mount-{digest}.sock")
+
+
+def get_remote_credentials(remote_name: str) -> Optional[Dict]:
+    """
+    URL WebDAV e autenticazione di un remote Nextcloud configurato
+
+    La password salvata da rclone è offuscata: viene decodificata con
+    `rclone reveal`.
+
+    Returns:
+        Dict con url, auth (tupla Basic Auth) e headers (Bearer),
+        None se il remote non esiste o non è WebDAV
+    """
+    config = get_remote_info(remote_name)
+    if not config or not config.get("url"):
+        return None
+
+    credentials = {"url": config["url"].rstrip("/") + "/", "auth": None, "headers": {}}
+    if config.get("bearer_token"):
+        credentials["headers"]["Authorization"] = f"Bearer {config['bearer_token']}"
+    elif config.get("user") and config.get("pass"):
+        try:
+            password = run(["rclone", "reveal", config["pass"]]).strip()
+        except RuntimeError:
+            return None
+        credentials["auth"] = (config["user"], password)
+    return credentials
+
+
+def get_mount_usage(mount_point: str) -> Optional[Dict]:
+    """
+    Spazio occupato da un mount rclone chiesto direttamente a Nextcloud
+
+    Un solo PROPFIND (oc:size) sulla cartella montata invece di os.walk
+    sul filesystem FUSE, che scaricherebbe l'intero albero.
+
+    Returns:
+        Dict come api.get_folder_usage() con in più "remote";
+        None se non è un mount rclone o il server non risponde
+    """
+    from urllib.parse import quote
+    from .api import get_folder_usage
+
+    source = get_mount_source(mount_point)
+    if not source or ":" not in source:
+        return None
+    remote_name, remote_path = source.split(":", 1)
+
+    credentials = get_remote_credentials(remote_name)
+    if credentials is None:
+        return None
+
+    url = credentials["url"] + quote(remote_path.strip("/"))
+    try:
+        usage = get_folder_usage(url, auth=credentials["auth"], headers=credentials["headers"])
+    except Exception:
+        return None
+    if usage is not None:
+        usage["remote"] = source
+    return usage
+
+
+def get_path_size(path: str) -> Optional[int]:
+    """
+    Dimensione di un percorso: da Nextcloud se è un mount rclone,
+    altrimenti con scansione locale
+
+    Returns:
+        Bytes occupati; None se è un mount rclone e il server non risponde
+        (nessun fallback su os.walk attraverso FUSE)
+    """
+    if get_mount_source(path) is not None:
+        usage = get_mount_usage(path)
+        return usage["used_bytes"] if usage else None
+    return get_directory_size(path)
+
+
 def get_mount_profile_info(profile: str) -> Optional[Dict]:
     """Recupera informazioni su un profilo mount"""
     return MOUNT_PROFILES.get(profile)
@@ -515,3 +817,54 @@ WantedBy=multi-user.target
     return service_content
 
 
+def create_systemd_mount_template() -> str:
+    """
+    Template unit per i mount tenant (ncwrap-rclone@.service)
+    
+    Remote, mount point e profilo arrivano dall'EnvironmentFile
+    dell'istanza: aggiungere un tenant non richiede nuove unit né
+    daemon-reload, basta abilitare ncwrap-rclone@<utente>.
+    """
+    return f"""[Unit]
+Description=Nextcloud mount for user %i
+After=network-online.target
+Wants=network-online.target
+Before=docker.service
+
+[Service]
+Type=forking
+User=root
+Group=root
+EnvironmentFile={MOUNT_ENV_DIR}/%i.env
+ExecStart=/usr/local/bin/nextcloud-wrapper mount start ${{NC_REMOTE}} ${{NC_MOUNT_POINT}} --profile ${{NC_PROFILE}} --background
+ExecStop=/usr/local/bin/nextcloud-wrapper mount stop ${{NC_MOUNT_POINT}}
+Restart=on-failure
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+
+def create_mount_instance_env(username: str, mount_point: Optional[str] = None,
+                              profile: str = "full", remote_name: Optional[str] = None) -> str:
+    """Contenuto di /etc/ncwrap/mounts/<utente>.env per l'istanza ncwrap-rclone@<utente>"""
+    return (
+        f"# ncwrap-rclone@{username}\n"
+        f"NC_REMOTE={remote_name or f'nc-{username}'}\n"
+        f"NC_MOUNT_POINT={mount_point or f'/home/{username}'}\n"
+        f"NC_PROFILE={profile}\n"
+    )
+
+
+def parse_mount_instance_env(content: str) -> Dict[str, str]:
+    """Variabili di un file ambiente d'istanza (righe CHIAVE=valore)"""
+    values = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#") and "=" in line:
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip().strip('"')
+    return values
+
+
@@ -0,0 +1,311 @@
+"""
+Client per l'API remote control (rc) di rclone
+
+Invece di avviare un processo rclone per ogni operazione (startup e
+parsing di rclone.conf ogni volta), si usa un `rclone rcd` di lunga durata
+in ascolto su un socket unix privato: le operazioni diventano chiamate
+JSON su HTTP con connessione keep-alive.
+
+Il demone viene avviato al primo uso (o riutilizzato se già attivo) e
+sopravvive al processo che l'ha lanciato; `RcloneRC.shutdown()` lo ferma.
+"""
+import fcntl
+import hashlib
+import http.client
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .utils import first_writable_dir, is_command_available
+
+# Directory socket rcd (privata per utente: il socket è senza autenticazione)
+RC_DIRS = (f"/run/ncwrap/rc-{os.getuid()}", "~/.cache/ncwrap/rc")
+# Attesa massima avvio rcd (secondi)
+START_TIMEOUT = 10.0
+# Timeout chiamate brevi (list, about, config)
+CALL_TIMEOUT = 60.0
+
+
+class RcloneRCError(RuntimeError):
+    """Errore restituito da rclone rc (o demone non raggiungibile)"""
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection su socket unix"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class RcloneRC:
+    """
+    Client JSON-RPC verso `rclone rcd` su socket unix
+
+    Uso:
+        rc = RcloneRC(config_path="~/.config/ncwrap/rclone.conf")
+        rc.start()
+        remotes = rc.list_remotes()
+        about = rc.about("nc-user")
+    """
+
+    def __init__(self, config_path: str, socket_path: Optional[str] = None,
+                 extra_args: Optional[List[str]] = None):
+        self.config_path = str(Path(config_path).expanduser())
+        # Opzioni globali del demone (es. --cache-dir, --buffer-size)
+        self.extra_args = list(extra_args or [])
+        if socket_path is None:
+            directory = first_writable_dir(RC_DIRS, "NC_RCLONE_RC_DIR")
+            if directory is None:
+                raise RcloneRCError("nessuna directory scrivibile per il socket rcd")
+            os.chmod(directory, 0o700)
+            # Un demone per file di configurazione
+            digest = hashlib.sha1(self.config_path.encode("utf-8")).hexdigest()[:10]
+            socket_path = str(directory / f"rcd-{digest}.sock")
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    # ===== Ciclo di vita demone =====
+
+    def is_running(self) -> bool:
+        """True se un rcd risponde sul socket"""
+        try:
+            self.call("rc/noop", timeout=2)
+            return True
+        except (RcloneRCError, OSError):
+            return False
+
+    def start(self) -> None:
+        """
+        Avvia `rclone rcd` sul socket se non è già attivo
+
+        Un lock su file evita che due processi avviino il demone insieme.
+
+        Raises:
+            RcloneRCError: Se rclone manca o il demone non risponde in tempo
+        """
+        if self.is_running():
+            return
+        if not is_command_available("rclone"):
+            raise RcloneRCError("rclone non installato")
+
+        with open(f"{self.socket_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.is_running():
+                return
+            # Socket rimasto da un demone terminato
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+            process = subprocess.Popen(
+                [
+                    "rclone", "rcd",
+                    "--rc-addr", f"unix://{self.socket_path}",
+                    "--rc-no-auth",
+                    "--config", self.config_path,
+                ] + self.extra_args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+
+            deadline = time.monotonic() + START_TIMEOUT
+            while time.monotonic() < deadline:
+                if process.poll() is not None:
+                    raise RcloneRCError(f"rclone rcd terminato all'avvio (exit {process.returncode})")
+                if self.is_running():
+                    os.chmod(self.socket_path, 0o600)
+                    return
+                time.sleep(0.05)
+            process.terminate()
+            raise RcloneRCError("rclone rcd non risponde")
+
+    def shutdown(self) -> None:
+        """Ferma il demone (core/quit)"""
+        try:
+            self.call("core/quit", timeout=5)
+        except (RcloneRCError, OSError):
+            pass
+
+    # ===== Trasporto =====
+
+    def _connection(self, timeout: Optional[float]) -> _UnixHTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _UnixHTTPConnection(self.socket_path)
+            self._local.conn = conn
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _drop_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def call(self, command: str, timeout: Optional[float] = CALL_TIMEOUT, **params) -> Dict:
+        """
+        Esegue un comando rc (es. "operations/list") e ritorna il JSON
+
+        Args:
+            command: Percorso comando rc
+            timeout: Timeout socket (None = nessuno, per sync/copy)
+            **params: Parametri JSON (es. fs, remote, _config)
+
+        Raises:
+            RcloneRCError: Errore rclone o demone non raggiungibile
+        """
+        body = json.dumps(params).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+
+        # Un secondo tentativo se la connessione keep-alive è stata chiusa
+        for attempt in range(2):
+            conn = self._connection(timeout)
+            try:
+                conn.request("POST", f"/{command}", body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.HTTPException) as e:
+                self._drop_connection()
+                if attempt:
+                    raise RcloneRCError(f"rcd non raggiungibile: {e}")
+            except OSError as e:
+                # Timeout, socket assente, permessi: per i chiamanti è un errore rc
+                self._drop_connection()
+                raise RcloneRCError(f"{command}: rcd non raggiungibile: {e}")
+
+        try:
+            result = json.loads(data) if data else {}
+        except ValueError:
+            raise RcloneRCError(f"{command}: risposta non JSON", response.status)
+        if response.status != 200:
+            raise RcloneRCError(f"{command}: {result.get('error', response.reason)}", response.status)
+        return result
+
+    # ===== Operazioni =====
+
+    def list_remotes(self) -> List[str]:
+        """Nomi dei remote configurati"""
+        return self.call("config/listremotes").get("remotes") or []
+
+    def config_get(self, name: str) -> Dict:
+        """Parametri di un remote (password offuscate come in rclone.conf)"""
+        return self.call("config/get", name=name)
+
+    def config_create(self, name: str, remote_type: str, parameters: Dict[str, str]) -> Dict:
+        """Crea un remote (le password vengono offuscate da rclone)"""
+        return self.call(
+            "config/create", name=name, type=remote_type, parameters=parameters,
+            opt={"obscure": True, "nonInteractive": True},
+        )
+
+    def config_delete(self, name: str) -> None:
+        """Elimina un remote"""
+        self.call("config/delete", name=name)
+
+    def list(self, fs: str, remote: str = "", recurse: bool = False,
+             dirs_only: bool = False, config: Optional[Dict] = None) -> List[Dict]:
+        """
+        Contenuto di fs:remote (operations/list)
+
+        Returns:
+            Lista di dict rclone (Path, Name, Size, IsDir, ModTime, ...)
+        """
+        opt = {"recurse": recurse, "dirsOnly": dirs_only, "noMimeType": True}
+        params = {"fs": fs, "remote": remote, "opt": opt}
+        if config:
+            params["_config"] = config
+        return self.call("operations/list", **params).get("list") or []
+
+    def about(self, fs: str, config: Optional[Dict] = None) -> Dict:
+        """Spazio totale/usato/libero del remote (operations/about)"""
+        params = {"fs": fs}
+        if config:
+            params["_config"] = config
+        return self.call("operations/about", **params)
+
+    def sync(self, src_fs: str, dst_fs: str, dry_run: bool = False,
+             config: Optional[Dict] = None) -> Dict:
+        """rclone sync tramite sync/sync (attende il completamento)"""
+        return self._transfer("sync/sync", src_fs, dst_fs, dry_run, config)
+
+    def copy(self, src_fs: str, dst_fs: str, dry_run: bool = False,
+             config: Optional[Dict] = None) -> Dict:
+        """rclone copy tramite sync/copy (attende il completamento)"""
+        return self._transfer("sync/copy", src_fs, dst_fs, dry_run, config)
+
+    def _transfer(self, command: str, src_fs: str, dst_fs: str, dry_run: bool,
+                  config: Optional[Dict]) -> Dict:
+        config = dict(config or {})
+        if dry_run:
+            config["DryRun"] = True
+        params = {"srcFs": src_fs, "dstFs": dst_fs}
+        if config:
+            params["_config"] = config
+        return self.call(command, timeout=None, **params)
+
+    def mount(self, fs: str, mount_point: str, vfs_opt: Optional[Dict] = None,
+              mount_opt: Optional[Dict] = None) -> None:
+        """
+        Monta fs nel demone (mount/mount)
+
+        Il mount vive quanto il demone rcd: per mount persistenti usare i
+        servizi systemd.
+        """
+        params = {"fs": fs, "mountPoint": mount_point}
+        if vfs_opt:
+            params["vfsOpt"] = vfs_opt
+        if mount_opt:
+            params["mountOpt"] = mount_opt
+        self.call("mount/mount", **params)
+
+    def unmount(self, mount_point: str) -> None:
+        """Smonta un mount creato dal demone (mount/unmount)"""
+        self.call("mount/unmount", mountPoint=mount_point)
+
+    def list_mounts(self) -> List[Dict]:
+        """Mount attivi nel demone (mount/listmounts): Fs, MountPoint, MountedOn"""
+        return self.call("mount/listmounts").get("mountPoints") or []
+
+    def pid(self) -> int:
+        """PID del processo rclone che serve l'endpoint (core/pid)"""
+        return int(self.call("core/pid", timeout=5)["pid"])
+
+    def core_stats(self) -> Dict:
+        """Statistiche trasferimenti del demone (core/stats): bytes, speed, transfers, errors"""
+        return self.call("core/stats")
+
+    def core_transferred(self) -> List[Dict]:
+        """Ultimi trasferimenti completati (core/transferred): byte finali, dimensione, esito"""
+        return self.call("core/transferred").get("transferred") or []
+
+    def vfs_stats(self, fs: Optional[str] = None) -> Dict:
+        """
+        Statistiche VFS (vfs/stats): file aperti, cache metadati e disco, code upload
+
+        Args:
+            fs: VFS da interrogare, obbligatorio se il demone ne ospita più di uno
+        """
+        params = {"fs": fs} if fs else {}
+        return self.call("vfs/stats", **params)
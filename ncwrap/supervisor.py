@@ -0,0 +1,390 @@
+"""
+Supervisore mount multi-tenant: pochi `rclone rcd` che ospitano molti mount
+
+Invece di un processo `rclone mount --daemon` per tenant (un runtime Go,
+una cache VFS e un pool HTTP ciascuno), i mount vengono creati con
+`mount/mount` dentro un piccolo numero di demoni rcd ("shard"). Gli shard
+sono raggruppati per profilo, perché opzioni come --buffer-size e
+--cache-dir sono globali al demone; all'interno di un profilo il mount
+point sceglie lo shard con un hash stabile.
+
+Lo stato desiderato (mount point -> remote, profilo, shard) è salvato su
+file: `reconcile()` riavvia gli shard caduti e rimonta ciò che manca.
+"""
+import json
+import os
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from .rclone import RCLONE_CONF, DEFAULT_MOUNT_OPTIONS, MOUNT_PROFILES, ensure_config
+from .rclone_rc import RcloneRC, RcloneRCError
+from .utils import atomic_write, env_int, file_lock, first_writable_dir, is_mounted, run
+
+# Stato desiderato e socket degli shard
+SUPERVISOR_DIRS = ("/var/lib/ncwrap/supervisor", "~/.cache/ncwrap/supervisor")
+# Shard per profilo (NC_SUPERVISOR_SHARDS)
+DEFAULT_SHARDS = 2
+
+# Flag CLI rclone -> opzioni rc di mount/mount
+_VFS_FLAGS = {
+    "--vfs-cache-mode": "CacheMode",
+    "--vfs-cache-max-size": "CacheMaxSize",
+    "--vfs-cache-max-age": "CacheMaxAge",
+    "--vfs-cache-poll-interval": "CachePollInterval",
+    "--vfs-read-chunk-size": "ChunkSize",
+    "--vfs-read-chunk-size-limit": "ChunkSizeLimit",
+    "--dir-cache-time": "DirCacheTime",
+    "--poll-interval": "PollInterval",
+    "--read-only": "ReadOnly",
+}
+_MOUNT_FLAGS = {
+    "--allow-other": "AllowOther",
+    "--attr-timeout": "AttrTimeout",
+}
+# Opzioni globali: passate alla riga di comando dello shard
+_DAEMON_FLAGS = ("--buffer-size", "--cache-dir")
+
+
+def profile_rc_options(profile: str, custom_options: Optional[List[str]] = None
+                       ) -> Tuple[Dict, Dict, List[str], List[str]]:
+    """
+    Converte le opzioni CLI di un profilo nei parametri rc
+
+    Returns:
+        Tupla (vfsOpt, mountOpt, argomenti globali del demone, flag senza
+        equivalente rc)
+    """
+    from .utils import merge_cli_options
+
+    options = list(DEFAULT_MOUNT_OPTIONS)
+    if profile in MOUNT_PROFILES:
+        options += MOUNT_PROFILES[profile]["options"]
+    options = merge_cli_options(options, custom_options or [])
+
+    vfs_opt, mount_opt, daemon_args, unsupported = {}, {}, [], []
+    i = 0
+    while i < len(options):
+        flag = options[i]
+        value = True
+        if i + 1 < len(options) and not options[i + 1].startswith("--"):
+            value = options[i + 1]
+            i += 1
+        i += 1
+
+        if flag in _VFS_FLAGS:
+            vfs_opt[_VFS_FLAGS[flag]] = value
+        elif flag in _MOUNT_FLAGS:
+            mount_opt[_MOUNT_FLAGS[flag]] = value
+        elif flag in _DAEMON_FLAGS:
+            daemon_args += [flag, value]
+        else:
+            unsupported.append(flag)
+    return vfs_opt, mount_opt, daemon_args, unsupported
+
+
+class MountSupervisor:
+    """
+    Gestisce i mount di molti tenant dentro pochi demoni rclone rcd
+
+    Uso:
+        supervisor = MountSupervisor()
+        supervisor.add("nc-user", "/home/user", profile="full")
+        supervisor.reconcile()   # da timer/servizio: riavvia e rimonta
+    """
+
+    def __init__(self, shards: Optional[int] = None, state_dir: Optional[str] = None):
+        self.shards = max(1, shards or env_int("NC_SUPERVISOR_SHARDS", DEFAULT_SHARDS))
+        directory = state_dir or first_writable_dir(SUPERVISOR_DIRS, "NC_SUPERVISOR_DIR")
+        if directory is None:
+            raise RuntimeError("nessuna directory scrivibile per lo stato del supervisore")
+        self.state_dir = str(directory)
+        os.chmod(self.state_dir, 0o700)
+        self.state_path = os.path.join(self.state_dir, "mounts.json")
+        self._clients: Dict[str, RcloneRC] = {}
+
+    # ===== Stato desiderato =====
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f).get("mounts", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _state_lock(self):
+        """
+        Lock sul read-modify-write di mounts.json
+
+        flock e non threading.Lock: ogni chiamante (MountManager, CLI, bulk,
+        mount tune) crea il proprio MountSupervisor, spesso in processi diversi.
+        """
+        return file_lock(f"{self.state_path}.lock")
+
+    def _save(self, mounts: Dict[str, Dict]) -> None:
+        content = json.dumps({"updated": time.time(), "mounts": mounts}, indent=2)
+        if not atomic_write(self.state_path, content, 0o600):
+            raise RuntimeError(f"Impossibile salvare stato supervisore: {self.state_path}")
+
+    # ===== Shard =====
+
+    def shard_for(self, mount_point: str, profile: str) -> str:
+        """Shard assegnato a un mount point (stabile tra esecuzioni)"""
+        index = zlib.crc32(os.path.realpath(mount_point).encode("utf-8")) % self.shards
+        return f"{profile}-{index}"
+
+    def _client(self, shard: str) -> RcloneRC:
+        client = self._clients.get(shard)
+        if client is None:
+            profile = shard.rsplit("-", 1)[0]
+            _, _, daemon_args, _ = profile_rc_options(profile)
+            client = RcloneRC(
+                str(RCLONE_CONF),
+                socket_path=os.path.join(self.state_dir, f"{shard}.sock"),
+                extra_args=daemon_args,
+            )
+            self._clients[shard] = client
+        return client
+
+    def _mount_in_shard(self, shard: str, mount_point: str, spec: Dict) -> None:
+        client = self._client(shard)
+        client.start()
+        from .tuner import load_tuned_options
+        # Profilo generato da `mount tune` letto ad ogni (ri)mount
+        custom_options = load_tuned_options(spec["remote"]) + list(spec.get("custom_options") or [])
+        vfs_opt, mount_opt, daemon_args, unsupported = profile_rc_options(spec["profile"], custom_options)
+        # Le opzioni globali valgono per tutto lo shard: quelle del tenant che
+        # differiscono dal profilo non si applicano al singolo mount
+        _, _, shard_args, _ = profile_rc_options(spec["profile"])
+        shard_values = dict(zip(shard_args[::2], shard_args[1::2]))
+        ignored = [flag for flag, value in zip(daemon_args[::2], daemon_args[1::2])
+                   if shard_values.get(flag) != value] + unsupported
+        if ignored:
+            print(f"⚠️ {mount_point}: opzioni ignorate nello shard {shard}: {', '.join(ignored)}")
+        client.mount(spec["remote"], mount_point, vfs_opt=vfs_opt, mount_opt=mount_opt)
+
+    # ===== Operazioni =====
+
+    def add(self, remote_name: str, mount_point: str, profile: str = "full",
+            custom_options: Optional[List[str]] = None) -> str:
+        """
+        Monta remote_name su mount_point in uno shard
+
+        Returns:
+            ID dello shard che ospita il mount
+
+        Raises:
+            ValueError: Profilo sconosciuto o mount point già montato
+            RcloneRCError: Errore avvio shard o mount
+        """
+        if profile not in MOUNT_PROFILES:
+            raise ValueError(f"profilo non valido: {profile}")
+        mount_point = os.path.realpath(mount_point)
+        if is_mounted(mount_point):
+            raise ValueError(f"{mount_point} già montato")
+
+        ensure_config()
+        os.makedirs(mount_point, exist_ok=True)
+        spec = {
+            "remote": remote_name if remote_name.endswith(":") else f"{remote_name}:",
+            "profile": profile,
+            "custom_options": list(custom_options or []),
+        }
+        shard = self.shard_for(mount_point, profile)
+        self._mount_in_shard(shard, mount_point, spec)
+
+        with self._state_lock():
+            mounts = self._load()
+            mounts[mount_point] = dict(spec, shard=shard, added=time.time())
+            self._save(mounts)
+        return shard
+
+    def remove(self, mount_point: str) -> bool:
+        """
+        Smonta e dimentica un mount gestito
+
+        Returns:
+            True se il mount era gestito dal supervisore
+        """
+        mount_point = os.path.realpath(mount_point)
+        with self._state_lock():
+            mounts = self._load()
+            spec = mounts.pop(mount_point, None)
+            if spec is None:
+                return False
+            self._save(mounts)
+
+        try:
+            self._client(spec["shard"]).unmount(mount_point)
+        except (RcloneRCError, OSError):
+            # Shard già terminato: resta solo l'eventuale endpoint FUSE orfano
+            run(["fusermount", "-uz", mount_point], check=False)
+        return True
+
+    def remount(self, mount_point: str) -> bool:
+        """
+        Ricrea un mount gestito nel suo shard (avviando lo shard se è caduto)
+
+        Il mount viene prima tolto dal demone e dalla tabella mount: un
+        endpoint bloccato o orfano non impedisce il nuovo mount/mount.
+
+        Returns:
+            False se il mount point non è gestito dal supervisore
+
+        Raises:
+            RcloneRCError: Errore avvio shard o mount
+        """
+        mount_point = os.path.realpath(mount_point)
+        spec = self._load().get(mount_point)
+        if spec is None:
+            return False
+        try:
+            self._client(spec["shard"]).unmount(mount_point)
+        except (RcloneRCError, OSError):
+            pass
+        if is_mounted(mount_point):
+            run(["fusermount", "-uz", mount_point], check=False)
+        self._mount_in_shard(spec["shard"], mount_point, spec)
+        return True
+
+    def desired(self) -> Dict[str, Dict]:
+        """Stato desiderato: mount point -> remote, profilo, shard"""
+        return self._load()
+
+    def manages(self, mount_point: str) -> bool:
+        """True se il mount point è gestito dal supervisore"""
+        return os.path.realpath(mount_point) in self._load()
+
+    def endpoint(self, mount_point: str) -> Optional[Tuple[str, RcloneRC, Optional[str]]]:
+        """
+        Shard che ospita un mount gestito
+
+        Returns:
+            Tupla (shard, client rc, Fs del mount nello shard; None se lo
+            shard non risponde o il mount manca) o None se non gestito
+        """
+        spec = self._load().get(os.path.realpath(mount_point))
+        if spec is None:
+            return None
+        client = self._client(spec["shard"])
+        try:
+            for mount in client.list_mounts():
+                if mount.get("MountPoint") == os.path.realpath(mount_point):
+                    return spec["shard"], client, mount.get("Fs")
+        except (RcloneRCError, OSError):
+            pass
+        return spec["shard"], client, None
+
+    def _live_mounts(self, shard: str) -> Optional[set]:
+        """Mount point attivi in uno shard (None se lo shard non risponde)"""
+        try:
+            return {m.get("MountPoint") for m in self._client(shard).list_mounts()}
+        except (RcloneRCError, OSError):
+            return None
+
+    def list(self) -> List[Dict]:
+        """
+        Mount gestiti con stato reale
+
+        Returns:
+            Lista di dict (mount_point, remote, profile, shard, status) con
+            status "active", "missing" (shard attivo, mount assente) o
+            "shard down"
+        """
+        mounts = self._load()
+        live = {shard: self._live_mounts(shard) for shard in {m["shard"] for m in mounts.values()}}
+
+        result = []
+        for mount_point, spec in sorted(mounts.items()):
+            shard_mounts = live[spec["shard"]]
+            if shard_mounts is None:
+                status = "shard down"
+            elif mount_point in shard_mounts:
+                status = "active"
+            else:
+                status = "missing"
+            result.append({
+                "mount_point": mount_point,
+                "remote": spec["remote"],
+                "profile": spec["profile"],
+                "shard": spec["shard"],
+                "status": status,
+            })
+        return result
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        Riporta i demoni allo stato desiderato
+
+        Riavvia gli shard che non rispondono e rimonta i mount mancanti
+        (rimuovendo prima eventuali endpoint FUSE orfani del demone caduto).
+
+        Returns:
+            Statistiche: active, remounted, shards_restarted, failed
+        """
+        mounts = self._load()
+        stats = {"active": 0, "remounted": 0, "shards_restarted": 0, "failed": 0}
+
+        by_shard: Dict[str, List[str]] = {}
+        for mount_point, spec in mounts.items():
+            by_shard.setdefault(spec["shard"], []).append(mount_point)
+
+        for shard, mount_points in sorted(by_shard.items()):
+            live = self._live_mounts(shard)
+            if live is None:
+                try:
+                    self._client(shard).start()
+                    stats["shards_restarted"] += 1
+                    live = set()
+                except (RcloneRCError, OSError):
+                    stats["failed"] += len(mount_points)
+                    continue
+
+            for mount_point in mount_points:
+                if mount_point in live:
+                    stats["active"] += 1
+                    continue
+                if is_mounted(mount_point):
+                    run(["fusermount", "-uz", mount_point], check=False)
+                try:
+                    self._mount_in_shard(shard, mount_point, mounts[mount_point])
+                    stats["remounted"] += 1
+                except (RcloneRCError, OSError):
+                    stats["failed"] += 1
+
+        return stats
+
+    def shutdown(self) -> None:
+        """Ferma tutti gli shard (i mount ospitati vengono smontati)"""
+        for shard in {spec["shard"] for spec in self._load().values()}:
+            self._client(shard).shutdown()
+
+
+SUPERVISOR_SERVICE = "ncwrap-supervisor"
+
+
+def create_supervisor_service(interval: int = 30) -> str:
+    """
+    Genera il servizio systemd unico del supervisore
+
+    KillMode=process: riavviando il servizio gli shard rcd (e i loro mount)
+    restano attivi e vengono ripresi dal nuovo processo di reconcile.
+    """
+    return f"""[Unit]
+Description=Nextcloud mount supervisor (rclone rcd shards)
+After=network-online.target
+Wants=network-online.target
+Before=docker.service
+
+[Service]
+Type=simple
+User=root
+Group=root
+ExecStart=/usr/local/bin/nextcloud-wrapper mount supervisor reconcile --interval {interval}
+KillMode=process
+Restart=on-failure
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+"""
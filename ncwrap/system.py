@@ -379,12 +379,15 @@ def get_user_info(username: str) -> Optional[Dict]:
         # Info home directory
         home_stats = {}
         if os.path.exists(user_info.pw_dir):
-            from .utils import get_directory_size, bytes_to_human
+            from .utils import bytes_to_human
+            from .rclone import get_path_size
             
+            # Home su mount rclone: dimensione da Nextcloud (oc:size), non os.walk su FUSE
+            size = get_path_size(user_info.pw_dir)
             stat = os.stat(user_info.pw_dir)
             home_stats = {
                 "exists": True,
-                "size": bytes_to_human(get_directory_size(user_info.pw_dir)),
+                "size": bytes_to_human(size) if size is not None else "N/A",
                 "permissions": oct(stat.st_mode)[-3:],
                 "last_modified": stat.st_mtime
             }
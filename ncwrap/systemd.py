@@ -6,8 +6,25 @@ import json
 import os
 import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
-from .utils import run, atomic_write, backup_file
+from .utils import run, atomic_write, backup_file, wait_for_condition
+from .systemd_dbus import SystemdBusError, get_systemd_bus, reset_systemd_bus
+
+# Stati transitori di una unit (job systemd ancora in corso)
+TRANSIENT_STATES = ("activating", "deactivating", "reloading")
+# Job systemctl in parallelo quando D-Bus non è disponibile
+REPAIR_WORKERS = 8
+# Proprietà lette da `systemctl show` (fallback di get_services_status)
+_SHOW_PROPERTIES = ("Id", "ActiveState", "UnitFileState", "LoadState", "SubState",
+                    "MainPID", "MemoryCurrent", "ActiveEnterTimestamp")
+# Job D-Bus per operazione
+_JOB_METHODS = {"start": "StartUnit", "stop": "StopUnit", "restart": "RestartUnit"}
+# MemoryCurrent quando il dato non è disponibile
+_UINT64_MAX = 2 ** 64 - 1
+
+# Marcatore: backend D-Bus non disponibile, usare systemctl
+_NO_BUS = object()
 
 
 class SystemdManager:
@@ -19,6 +36,26 @@ class SystemdManager:
         self.service_prefix = "nextcloud-wrapper"
         self.config = self._load_config()
     
+    def _bus_call(self, user: bool, operation):
+        """
+        Esegue operation(bus) sul backend D-Bus
+        
+        Returns:
+            Risultato di operation o _NO_BUS se D-Bus non è disponibile o la
+            chiamata fallisce (il chiamante ripiega su systemctl)
+        """
+        bus = get_systemd_bus(user)
+        if bus is None:
+            return _NO_BUS
+        try:
+            return operation(bus)
+        except SystemdBusError:
+            return _NO_BUS
+        except Exception:
+            # Socket chiuso o errore di protocollo: nuova connessione al prossimo uso
+            reset_systemd_bus(user)
+            return _NO_BUS
+    
     def _load_config(self) -> Dict:
         """Carica configurazione da environment"""
         return {
@@ -71,13 +108,28 @@ class SystemdManager:
         
         return service_name
     
-    def enable_service(self, service_name: str, user: bool = False) -> bool:
-        """Abilita e avvia un servizio"""
+    def enable_service(self, service_name: str, user: bool = False, reload: bool = True) -> bool:
+        """
+        Abilita e avvia un servizio
+        
+        reload=False salta il daemon-reload: basta per le istanze di un
+        template già caricato (es. ncwrap-rclone@mario).
+        """
+        unit = f"{service_name}.service"
+        result = self._bus_call(user, lambda bus: bus.enable_unit_files([unit], reload)
+                                or bus.run_jobs("StartUnit", [unit]))
+        if result is not _NO_BUS:
+            if result[unit] != "done":
+                print(f"Errore abilitazione servizio {service_name}: job {result[unit]}")
+            return result[unit] == "done"
+        
         try:
             cmd = ["systemctl"]
             if user:
                 cmd.append("--user")
             cmd.extend(["enable", "--now", f"{service_name}.service"])
+            if not reload:
+                cmd.append("--no-reload")
             
             run(cmd)
             return True
@@ -85,13 +137,23 @@ class SystemdManager:
             print(f"Errore abilitazione servizio {service_name}: {e}")
             return False
     
-    def disable_service(self, service_name: str, user: bool = False) -> bool:
-        """Disabilita e ferma un servizio"""
+    def disable_service(self, service_name: str, user: bool = False, reload: bool = True) -> bool:
+        """Disabilita e ferma un servizio (reload=False: senza daemon-reload)"""
+        unit = f"{service_name}.service"
+        result = self._bus_call(user, lambda bus: bus.disable_unit_files([unit], reload)
+                                or bus.run_jobs("StopUnit", [unit]))
+        if result is not _NO_BUS:
+            if result[unit] != "done":
+                print(f"Errore disabilitazione servizio {service_name}: job {result[unit]}")
+            return result[unit] == "done"
+        
         try:
             cmd = ["systemctl"]
             if user:
                 cmd.append("--user")
             cmd.extend(["disable", "--now", f"{service_name}.service"])
+            if not reload:
+                cmd.append("--no-reload")
             
             run(cmd)
             return True
@@ -99,8 +161,51 @@ class SystemdManager:
             print(f"Errore disabilitazione servizio {service_name}: {e}")
             return False
     
+    def enable_unit_files(self, service_names: List[str], user: bool = False, reload: bool = True) -> bool:
+        """
+        Abilita più servizi senza avviarli
+        
+        Un solo EnableUnitFiles (o un solo `systemctl enable u1 u2 ...`)
+        per tutte le unit, invece di un processo per unit.
+        """
+        return self._set_unit_files(service_names, True, user, reload)
+    
+    def disable_unit_files(self, service_names: List[str], user: bool = False, reload: bool = True) -> bool:
+        """Disabilita più servizi senza fermarli (una sola chiamata per tutte le unit)"""
+        return self._set_unit_files(service_names, False, user, reload)
+    
+    def _set_unit_files(self, service_names: List[str], enable: bool, user: bool, reload: bool) -> bool:
+        if not service_names:
+            return True
+        units = [f"{name}.service" for name in service_names]
+        if enable:
+            result = self._bus_call(user, lambda bus: bus.enable_unit_files(units, reload) or True)
+        else:
+            result = self._bus_call(user, lambda bus: bus.disable_unit_files(units, reload) or True)
+        if result is not _NO_BUS:
+            return True
+        
+        try:
+            cmd = ["systemctl"]
+            if user:
+                cmd.append("--user")
+            cmd.append("enable" if enable else "disable")
+            if not reload:
+                cmd.append("--no-reload")
+            cmd.extend(units)
+            
+            run(cmd)
+            return True
+        except RuntimeError as e:
+            print(f"Errore {'abilitazione' if enable else 'disabilitazione'} servizi: {e}")
+            return False
+    
     def start_service(self, service_name: str, user: bool = False) -> bool:
         """Avvia un servizio"""
+        result = self._bus_call(user, lambda bus: bus.run_jobs("StartUnit", [f"{service_name}.service"]))
+        if result is not _NO_BUS:
+            return result[f"{service_name}.service"] == "done"
+        
         try:
             cmd = ["systemctl"]
             if user:
@@ -114,6 +219,10 @@ class SystemdManager:
     
     def stop_service(self, service_name: str, user: bool = False) -> bool:
         """Ferma un servizio"""
+        result = self._bus_call(user, lambda bus: bus.run_jobs("StopUnit", [f"{service_name}.service"]))
+        if result is not _NO_BUS:
+            return result[f"{service_name}.service"] == "done"
+        
         try:
             cmd = ["systemctl"]
             if user:
@@ -127,6 +236,10 @@ class SystemdManager:
     
     def restart_service(self, service_name: str, user: bool = False) -> bool:
         """Riavvia un servizio"""
+        result = self._bus_call(user, lambda bus: bus.run_jobs("RestartUnit", [f"{service_name}.service"]))
+        if result is not _NO_BUS:
+            return result[f"{service_name}.service"] == "done"
+        
         try:
             cmd = ["systemctl"]
             if user:
@@ -138,60 +251,171 @@ class SystemdManager:
         except RuntimeError:
             return False
     
+    def wait_for_service(self, service_name: str, user: bool = False,
+                         timeout: float = 30) -> Optional[Dict]:
+        """
+        Attende che la unit esca dagli stati transitori
+        
+        `systemctl restart` ritorna al completamento del job; per le unit
+        ancora in activating (es. ExecStartPost lenti) si ricontrolla lo stato
+        a intervalli brevi. Una unit in auto-restart conta come assestata
+        (è fallita e attende RestartSec).
+        
+        Returns:
+            Ultimo stato letto (get_service_status) o None
+        """
+        last = {}
+        
+        def settled() -> bool:
+            status = self.get_service_status(service_name, user)
+            last["status"] = status
+            return status is None or status["active"] not in TRANSIENT_STATES or status["sub"] == "auto-restart"
+        
+        wait_for_condition(settled, timeout, interval=0.2)
+        return last.get("status")
+    
+    def run_jobs(self, operation: str, service_names: List[str], user: bool = False,
+                 timeout: float = 90) -> Dict[str, bool]:
+        """
+        start/stop/restart di più servizi in parallelo
+        
+        Con D-Bus i job vengono accodati tutti insieme e si attendono i
+        segnali JobRemoved; senza, `systemctl` in un pool di thread.
+        
+        Returns:
+            Dict servizio -> True se il job è terminato con successo
+        """
+        if not service_names:
+            return {}
+        units = [f"{name}.service" for name in service_names]
+        result = self._bus_call(user, lambda bus: bus.run_jobs(_JOB_METHODS[operation], units, timeout=timeout))
+        if result is not _NO_BUS:
+            return {name: result[unit] == "done" for name, unit in zip(service_names, units)}
+        
+        action = {"start": self.start_service, "stop": self.stop_service,
+                  "restart": self.restart_service}[operation]
+        with ThreadPoolExecutor(max_workers=min(REPAIR_WORKERS, len(service_names))) as pool:
+            return dict(zip(service_names, pool.map(lambda name: action(name, user), service_names)))
+    
+    @staticmethod
+    def _empty_status(service_name: str) -> Dict:
+        return {
+            "name": service_name,
+            "active": "unknown",
+            "enabled": "unknown",
+            "load": "unknown",
+            "sub": "unknown",
+            "main_pid": "0",
+            "memory": "0",
+            "uptime": "0"
+        }
+    
+    def _status_from_properties(self, service_name: str, properties: Dict) -> Dict:
+        """Stato da proprietà D-Bus (valori tipizzati)"""
+        from .utils import bytes_to_human
+        
+        status_info = self._empty_status(service_name)
+        status_info["active"] = properties.get("ActiveState", "unknown")
+        status_info["enabled"] = properties.get("UnitFileState", "unknown")
+        status_info["load"] = properties.get("LoadState", "unknown")
+        status_info["sub"] = properties.get("SubState", "unknown")
+        status_info["main_pid"] = str(properties.get("MainPID", 0))
+        memory = properties.get("MemoryCurrent")
+        if memory is not None:
+            status_info["memory"] = bytes_to_human(memory) if memory != _UINT64_MAX else "[not set]"
+        started = properties.get("ActiveEnterTimestamp", 0)
+        if started:
+            status_info["started_at"] = time.strftime("%a %Y-%m-%d %H:%M:%S %Z", time.localtime(started / 1e6))
+        return status_info
+    
+    def _status_from_show(self, service_name: str, output: str) -> Dict:
+        """Stato da un blocco di `systemctl show`"""
+        status_info = self._empty_status(service_name)
+        
+        for line in output.split('\n'):
+            if '=' in line:
+                key, value = line.split('=', 1)
+                
+                if key == "ActiveState":
+                    status_info["active"] = value
+                elif key == "UnitFileState":
+                    status_info["enabled"] = value
+                elif key == "LoadState":
+                    status_info["load"] = value
+                elif key == "SubState":
+                    status_info["sub"] = value
+                elif key == "MainPID":
+                    status_info["main_pid"] = value
+                elif key == "MemoryCurrent":
+                    if value.isdigit():
+                        from .utils import bytes_to_human
+                        status_info["memory"] = bytes_to_human(int(value))
+                    else:
+                        status_info["memory"] = value
+                elif key == "ActiveEnterTimestamp":
+                    if value and value != "0":
+                        status_info["started_at"] = value
+        
+        return status_info
+    
+    def get_services_status(self, service_names: List[str], user: bool = False) -> Dict[str, Dict]:
+        """
+        Stato di più servizi in una sola interrogazione
+        
+        D-Bus: richieste GetAll in pipeline; senza: un unico `systemctl show`
+        per tutte le unit.
+        
+        Returns:
+            Dict servizio -> stato (stesse chiavi di get_service_status)
+        """
+        if not service_names:
+            return {}
+        units = [f"{name}.service" for name in service_names]
+        result = self._bus_call(user, lambda bus: bus.get_properties(units))
+        if result is not _NO_BUS:
+            return {name: self._status_from_properties(name, result[unit])
+                    for name, unit in zip(service_names, units)}
+        
+        cmd = ["systemctl"]
+        if user:
+            cmd.append("--user")
+        cmd.extend(["show", "--no-pager", "-p", ",".join(_SHOW_PROPERTIES)] + units)
+        output = run(cmd, check=False)
+        
+        # Un blocco per unit separato da una riga vuota
+        statuses = {}
+        for block in output.split("\n\n"):
+            unit_id = next((line[3:] for line in block.split("\n") if line.startswith("Id=")), "")
+            if unit_id.endswith(".service"):
+                name = unit_id[:-len(".service")]
+                statuses[name] = self._status_from_show(name, block)
+        return {name: statuses.get(name) or self._empty_status(name) for name in service_names}
+    
     def get_service_status(self, service_name: str, user: bool = False) -> Optional[Dict]:
         """Recupera stato dettagliato di un servizio"""
         try:
-            cmd = ["systemctl"]
-            if user:
-                cmd.append("--user")
-            cmd.extend(["show", f"{service_name}.service", "--no-pager"])
-            
-            output = run(cmd, check=False)
-            
-            # Parse output systemctl show
-            status_info = {
-                "name": service_name,
-                "active": "unknown",
-                "enabled": "unknown",
-                "load": "unknown",
-                "sub": "unknown",
-                "main_pid": "0",
-                "memory": "0",
-                "uptime": "0"
-            }
-            
-            for line in output.split('\n'):
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    
-                    if key == "ActiveState":
-                        status_info["active"] = value
-                    elif key == "UnitFileState":
-                        status_info["enabled"] = value
-                    elif key == "LoadState":
-                        status_info["load"] = value
-                    elif key == "SubState":
-                        status_info["sub"] = value
-                    elif key == "MainPID":
-                        status_info["main_pid"] = value
-                    elif key == "MemoryCurrent":
-                        if value.isdigit():
-                            from .utils import bytes_to_human
-                            status_info["memory"] = bytes_to_human(int(value))
-                        else:
-                            status_info["memory"] = value
-                    elif key == "ActiveEnterTimestamp":
-                        if value and value != "0":
-                            status_info["started_at"] = value
-            
-            return status_info
-            
+            return self.get_services_status([service_name], user)[service_name]
         except Exception as e:
             print(f"Errore recupero status {service_name}: {e}")
             return None
     
     def list_nextcloud_services(self, user: bool = False) -> List[Dict]:
         """Lista tutti i servizi nextcloud-wrapper"""
+        result = self._bus_call(user, lambda bus: bus.list_units(["ncwrap-*.service"]))
+        if result is not _NO_BUS:
+            # Stesso filtro di `systemctl list-units` senza --all
+            return [
+                {
+                    "name": unit["name"].replace('.service', ''),
+                    "load": unit["load"],
+                    "active": unit["active"],
+                    "sub": unit["sub"],
+                    "description": unit["description"]
+                }
+                for unit in result
+                if unit["job_id"] or (unit["active"] != "inactive" and not unit["following"])
+            ]
+        
         try:
             cmd = ["systemctl"]
             if user:
@@ -331,6 +555,9 @@ WantedBy=timers.target
     
     def _reload_systemd(self, user: bool = False) -> bool:
         """Ricarica configurazione systemd"""
+        if self._bus_call(user, lambda bus: bus.reload() or True) is not _NO_BUS:
+            return True
+        
         try:
             cmd = ["systemctl"]
             if user:
@@ -419,6 +646,13 @@ WantedBy=multi-user.target
         
         results["total"] = len(matching_services)
         
+        # start/stop/restart: tutti i job insieme invece di uno per volta
+        if operation in _JOB_METHODS:
+            outcomes = self.run_jobs(operation, matching_services, user)
+            for service_name in matching_services:
+                results["success" if outcomes.get(service_name) else "failed"].append(service_name)
+            return results
+        
         for service_name in matching_services:
             try:
                 if operation == "start":
@@ -546,9 +780,12 @@ def list_all_mount_services() -> Dict[str, List[Dict]]:
 
 
 def service_health_check() -> Dict:
-    """Verifica salute di tutti i servizi nextcloud"""
-    manager = SystemdManager()
+    """
+    Verifica salute di tutti i servizi nextcloud
     
+    Lo stato arriva già dall'elenco delle unit (una chiamata per scope),
+    senza interrogare ogni servizio.
+    """
     all_services = list_all_mount_services()
     health_report = {
         "healthy": [],
@@ -558,67 +795,57 @@ def service_health_check() -> Dict:
         "issues": []
     }
     
-    # Verifica servizi system
-    for service in all_services["system"]:
-        service_name = service["name"]
-        status = manager.get_service_status(service_name, user=False)
-        
-        if status and status["active"] == "active":
-            health_report["healthy"].append(f"system:{service_name}")
-        else:
-            health_report["unhealthy"].append(f"system:{service_name}")
-            if status:
-                health_report["issues"].append(f"{service_name}: {status['active']}")
-    
-    # Verifica servizi user
-    for service in all_services["user"]:
-        service_name = service["name"]
-        status = manager.get_service_status(service_name, user=True)
-        
-        if status and status["active"] == "active":
-            health_report["healthy"].append(f"user:{service_name}")
-        else:
-            health_report["unhealthy"].append(f"user:{service_name}")
-            if status:
-                health_report["issues"].append(f"{service_name}: {status['active']}")
+    for scope in ("system", "user"):
+        for service in all_services[scope]:
+            service_name = service["name"]
+            if service["active"] == "active":
+                health_report["healthy"].append(f"{scope}:{service_name}")
+            else:
+                health_report["unhealthy"].append(f"{scope}:{service_name}")
+                health_report["issues"].append(f"{service_name}: {service['active']}")
     
     return health_report
 
 
-def auto_repair_services() -> Dict:
-    """Ripara automaticamente servizi non funzionanti"""
+def auto_repair_services(timeout: float = 30) -> Dict:
+    """
+    Ripara automaticamente servizi non funzionanti
+    
+    I riavvii partono tutti insieme (SystemdManager.run_jobs) e lo stato
+    finale si legge in una sola interrogazione: il tempo totale è quello
+    della unit più lenta, non la somma delle attese.
+    """
     manager = SystemdManager()
     health = service_health_check()
+    unhealthy = health["unhealthy"]
     
     repair_results = {
-        "attempted": [],
+        "attempted": list(unhealthy),
         "fixed": [],
         "still_broken": []
     }
     
-    for service_name in health["unhealthy"]:
+    fixed = set()
+    for scope, is_user in (("system", False), ("user", True)):
+        names = [service_name.split(":", 1)[1] for service_name in unhealthy
+                 if service_name.startswith(f"{scope}:")]
+        if not names:
+            continue
         try:
-            # Determina se è system o user service
-            service_type, name = service_name.split(":", 1)
-            is_user = service_type == "user"
-            
-            repair_results["attempted"].append(service_name)
-            
-            # Prova restart
-            if manager.restart_service(name, is_user):
-                # Attendi e verifica
-                time.sleep(5)
-                status = manager.get_service_status(name, is_user)
-                
-                if status and status["active"] == "active":
-                    repair_results["fixed"].append(service_name)
-                else:
-                    repair_results["still_broken"].append(service_name)
-            else:
-                repair_results["still_broken"].append(service_name)
-                
+            restarted = manager.run_jobs("restart", names, is_user, timeout)
+            statuses = manager.get_services_status([name for name in names if restarted[name]], is_user)
         except Exception as e:
-            repair_results["still_broken"].append(f"{service_name}: {str(e)}")
+            print(f"Errore riparazione servizi {scope}: {e}")
+            continue
+        for name, status in statuses.items():
+            # Unit ancora in avvio (ExecStartPost lenti): breve attesa
+            if status["active"] in TRANSIENT_STATES:
+                status = manager.wait_for_service(name, is_user, timeout) or status
+            if status["active"] == "active":
+                fixed.add(f"{scope}:{name}")
+    
+    for service_name in unhealthy:
+        repair_results["fixed" if service_name in fixed else "still_broken"].append(service_name)
     
     return repair_results
 
@@ -0,0 +1,290 @@
+"""
+Backend D-Bus per systemd (org.freedesktop.systemd1)
+
+SystemdManager passa da qui invece di avviare un processo `systemctl` per
+ogni operazione:
+- ListUnitsByPatterns: tutte le unit ncwrap-* in una sola chiamata
+- Properties.GetAll inviati in pipeline sulla stessa connessione: lo stato
+  di centinaia di unit costa un giro di messaggi, non un fork per unit
+- StartUnit/StopUnit/RestartUnit ritornano subito il job; l'attesa usa il
+  segnale JobRemoved, quindi i job di molte unit procedono in parallelo
+
+Richiede la dipendenza opzionale jeepney (D-Bus in puro Python):
+    pip install nextcloud-wrapper[dbus]
+
+Senza jeepney, senza bus raggiungibile o con NC_SYSTEMD_DBUS=0,
+get_systemd_bus() ritorna None e SystemdManager usa systemctl.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from jeepney.bus_messages import MatchRule, message_bus
+    from jeepney.io.blocking import open_dbus_connection
+    from jeepney.low_level import HeaderFields, MessageType
+    from jeepney.wrappers import DBusAddress, new_method_call
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    open_dbus_connection = None
+
+SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+SERVICE_INTERFACE = "org.freedesktop.systemd1.Service"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+# Attesa massima risposte e job (secondi)
+DEFAULT_TIMEOUT = 30.0
+
+
+class SystemdBusError(RuntimeError):
+    """Errore D-Bus o timeout in attesa di systemd"""
+
+
+def unit_object_path(unit_name: str) -> str:
+    """Percorso D-Bus di una unit (escape di sd_bus_path_encode: 'a-b.service' -> 'a_2db_2eservice')"""
+    parts = []
+    for i, byte in enumerate(unit_name.encode("utf-8")):
+        char = chr(byte)
+        if char.isascii() and char.isalnum() and not (i == 0 and char.isdigit()):
+            parts.append(char)
+        else:
+            parts.append(f"_{byte:02x}")
+    return f"{SYSTEMD_PATH}/unit/{''.join(parts)}"
+
+
+class SystemdBus:
+    """
+    Connessione bloccante al manager systemd (di sistema o utente)
+
+    Uso:
+        bus = get_systemd_bus()
+        if bus:
+            units = bus.list_units(["ncwrap-*.service"])
+            properties = bus.get_properties([unit["name"] for unit in units])
+            results = bus.run_jobs("RestartUnit", ["ncwrap-rclone@mario.service"])
+    """
+
+    def __init__(self, user: bool = False):
+        if open_dbus_connection is None:
+            raise SystemdBusError("jeepney non installato (pip install nextcloud-wrapper[dbus])")
+        try:
+            self._conn = open_dbus_connection(bus="SESSION" if user else "SYSTEM")
+        except Exception as e:
+            raise SystemdBusError(f"bus D-Bus non raggiungibile: {e}")
+        self._manager = DBusAddress(SYSTEMD_PATH, bus_name=SYSTEMD_BUS_NAME, interface=MANAGER_INTERFACE)
+        self._lock = threading.Lock()
+        # Risposte per serial e job terminati (percorso job -> esito)
+        self._replies: Dict[int, object] = {}
+        self._removed_jobs: Dict[str, str] = {}
+        self._subscribed = False
+
+    # ===== Messaggi =====
+
+    def _receive(self, deadline: float):
+        """Riceve un messaggio; ritorna il serial della risposta o il job terminato"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise SystemdBusError("timeout in attesa di systemd")
+        try:
+            message = self._conn.receive(timeout=remaining)
+        except TimeoutError:
+            raise SystemdBusError("timeout in attesa di systemd")
+
+        header = message.header
+        if header.message_type in (MessageType.method_return, MessageType.error):
+            serial = header.fields.get(HeaderFields.reply_serial)
+            self._replies[serial] = message
+            return serial
+        if header.message_type == MessageType.signal and header.fields.get(HeaderFields.member) == "JobRemoved":
+            _, job, _, result = message.body
+            self._removed_jobs[job] = result
+            return job
+        return None
+
+    def _call_many(self, messages: List, timeout: float = DEFAULT_TIMEOUT) -> List:
+        """
+        Invia i messaggi in pipeline e raccoglie le risposte nello stesso ordine
+
+        Returns:
+            Body di ogni risposta o SystemdBusError per le risposte di errore
+        """
+        serials = []
+        for message in messages:
+            serial = next(self._conn.outgoing_serial)
+            self._conn.send(message, serial=serial)
+            serials.append(serial)
+
+        pending = set(serials)
+        deadline = time.monotonic() + timeout
+        while pending:
+            pending.discard(self._receive(deadline))
+
+        results = []
+        for serial in serials:
+            reply = self._replies.pop(serial)
+            if reply.header.message_type == MessageType.error:
+                error_name = reply.header.fields.get(HeaderFields.error_name)
+                detail = reply.body[0] if reply.body else ""
+                results.append(SystemdBusError(f"{error_name}: {detail}"))
+            else:
+                results.append(reply.body)
+        return results
+
+    def call(self, method: str, signature: Optional[str] = None, body: tuple = ()) -> tuple:
+        """Chiama un metodo del Manager systemd"""
+        with self._lock:
+            result = self._call_many([new_method_call(self._manager, method, signature, body)])[0]
+        if isinstance(result, SystemdBusError):
+            raise result
+        return result
+
+    # ===== Unit =====
+
+    def list_units(self, patterns: Iterable[str], states: Iterable[str] = ()) -> List[Dict]:
+        """Unit caricate che corrispondono ai pattern (una sola chiamata ListUnitsByPatterns)"""
+        (units,) = self.call("ListUnitsByPatterns", "asas", (list(states), list(patterns)))
+        return [
+            {
+                "name": unit[0],
+                "description": unit[1],
+                "load": unit[2],
+                "active": unit[3],
+                "sub": unit[4],
+                "following": unit[5],
+                "job_id": unit[7],
+            }
+            for unit in units
+        ]
+
+    def get_properties(self, unit_names: Iterable[str],
+                       interfaces: Iterable[str] = (UNIT_INTERFACE, SERVICE_INTERFACE)) -> Dict[str, Dict]:
+        """
+        Proprietà di più unit con richieste GetAll in pipeline
+
+        Returns:
+            Dict nome unit -> {proprietà: valore} (vuoto per unit sconosciute)
+        """
+        names, interfaces = list(unit_names), list(interfaces)
+        messages = []
+        for name in names:
+            address = DBusAddress(unit_object_path(name), bus_name=SYSTEMD_BUS_NAME,
+                                  interface=PROPERTIES_INTERFACE)
+            messages += [new_method_call(address, "GetAll", "s", (interface,)) for interface in interfaces]
+        with self._lock:
+            replies = self._call_many(messages)
+
+        properties: Dict[str, Dict] = {name: {} for name in names}
+        for i, reply in enumerate(replies):
+            # Errore tipico: interfaccia Service richiesta su una unit .timer
+            if isinstance(reply, SystemdBusError):
+                continue
+            properties[names[i // len(interfaces)]].update(
+                {key: value for key, (_, value) in reply[0].items()})
+        return properties
+
+    # ===== Job =====
+
+    def _subscribe(self) -> None:
+        """Abilita i segnali del Manager (JobRemoved) su questa connessione"""
+        if self._subscribed:
+            return
+        rule = MatchRule(type="signal", sender=SYSTEMD_BUS_NAME, interface=MANAGER_INTERFACE,
+                         member="JobRemoved", path=SYSTEMD_PATH)
+        for result in self._call_many([message_bus.AddMatch(rule), new_method_call(self._manager, "Subscribe")]):
+            if isinstance(result, SystemdBusError):
+                raise result
+        self._subscribed = True
+
+    def run_jobs(self, method: str, unit_names: Iterable[str], mode: str = "replace",
+                 wait: bool = True, timeout: float = DEFAULT_TIMEOUT) -> Dict[str, str]:
+        """
+        Accoda un job (StartUnit, StopUnit, RestartUnit, ...) per ogni unit
+
+        Le richieste partono in pipeline e systemd esegue i job in parallelo;
+        con wait=True si attendono i segnali JobRemoved.
+
+        Returns:
+            Dict unit -> esito: "done", "failed", "timeout", "canceled",
+            "dependency", "skipped"; "queued" con wait=False, "timeout" se
+            il job non termina in tempo, "error: ..." se systemd lo rifiuta
+        """
+        names = list(unit_names)
+        results: Dict[str, str] = {}
+        with self._lock:
+            if wait:
+                self._subscribe()
+            replies = self._call_many(
+                [new_method_call(self._manager, method, "ss", (name, mode)) for name in names], timeout)
+
+            jobs = {}
+            for name, reply in zip(names, replies):
+                if isinstance(reply, SystemdBusError):
+                    results[name] = f"error: {reply}"
+                else:
+                    jobs[reply[0]] = name
+                    results[name] = "queued"
+
+            if wait:
+                pending = set(jobs) - set(self._removed_jobs)
+                deadline = time.monotonic() + timeout
+                try:
+                    while pending:
+                        pending.discard(self._receive(deadline))
+                except SystemdBusError:
+                    pass
+                for job, name in jobs.items():
+                    results[name] = self._removed_jobs.get(job, "timeout")
+                self._removed_jobs.clear()
+        return results
+
+    # ===== Configurazione =====
+
+    def reload(self) -> None:
+        """Equivalente di `systemctl daemon-reload` (ritorna a reload completato)"""
+        self.call("Reload")
+
+    def enable_unit_files(self, unit_files: Iterable[str], reload: bool = True) -> None:
+        """Abilita le unit (EnableUnitFiles) e, come `systemctl enable`, ricarica systemd"""
+        self.call("EnableUnitFiles", "asbb", (list(unit_files), False, True))
+        if reload:
+            self.reload()
+
+    def disable_unit_files(self, unit_files: Iterable[str], reload: bool = True) -> None:
+        """Disabilita le unit (DisableUnitFiles) e, come `systemctl disable`, ricarica systemd"""
+        self.call("DisableUnitFiles", "asb", (list(unit_files), False))
+        if reload:
+            self.reload()
+
+    def close(self) -> None:
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+
+_buses: Dict[bool, Optional[SystemdBus]] = {}
+_buses_lock = threading.Lock()
+
+
+def get_systemd_bus(user: bool = False) -> Optional[SystemdBus]:
+    """Connessione condivisa al manager systemd, None se si deve usare systemctl"""
+    if open_dbus_connection is None or os.environ.get("NC_SYSTEMD_DBUS", "1") == "0":
+        return None
+    with _buses_lock:
+        if user not in _buses:
+            try:
+                _buses[user] = SystemdBus(user)
+            except SystemdBusError:
+                _buses[user] = None
+        return _buses[user]
+
+
+def reset_systemd_bus(user: bool = False) -> None:
+    """Chiude la connessione condivisa (es. dopo un errore di socket)"""
+    with _buses_lock:
+        bus = _buses.pop(user, None)
+    if bus is not None:
+        bus.close()
@@ -0,0 +1,552 @@
+"""
+Trasferimenti file di grandi dimensioni via WebDAV
+
+Upload a blocchi con il protocollo chunking v2 di Nextcloud:
+    MKCOL  /remote.php/dav/uploads/<user>/<id>         (Destination: file finale)
+    PUT    /remote.php/dav/uploads/<user>/<id>/<n>     (n = 1..10000, in parallelo)
+    MOVE   /remote.php/dav/uploads/<user>/<id>/.file   (assemblaggio lato server)
+
+Un journal locale (~/.cache/ncwrap/uploads) ricorda la sessione: dopo un
+crash l'upload riprende inviando solo i blocchi che il server non ha.
+
+I corpi delle PUT sono FileBody: il file viene letto con preadv in un
+bytearray riutilizzato e passato al socket come memoryview, senza creare
+un oggetto bytes per blocco; Content-Length esplicito (niente chunked).
+
+Download a intervalli: GET con Range su più connessioni, scritti con pwrite
+in un file <dest>.part preallocato; la bitmap degli intervalli completati
+(<dest>.part.json) permette la ripresa, il rename finale è atomico.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+import requests
+
+from .api import (
+    get_nc_config,
+    dav_files_url,
+    dav_uploads_url,
+    make_request_with_retry,
+)
+from .davxml import PROPFIND_BODY, iter_multistatus
+from .utils import atomic_write, env_int
+
+MiB = 1024 * 1024
+# Limiti protocollo chunking v2 (tutti i blocchi tranne l'ultimo >= 5 MiB)
+MIN_CHUNK_SIZE = 5 * MiB
+MAX_CHUNK_SIZE = 5 * 1024 * MiB
+MAX_CHUNKS = 10000
+# Predefiniti (sovrascrivibili con NC_UPLOAD_CHUNK_MB / NC_UPLOAD_PARALLEL,
+# NC_DOWNLOAD_RANGE_MB / NC_DOWNLOAD_PARALLEL)
+DEFAULT_CHUNK_MB = 16
+DEFAULT_PARALLEL = 4
+DEFAULT_RANGE_MB = 16
+# Blocchi letti dal body durante il download
+STREAM_CHUNK_SIZE = 1 * MiB
+# Buffer riutilizzato da FileBody per ogni lettura dal disco
+BODY_BUFFER_SIZE = 1 * MiB
+
+JOURNAL_DIR = Path.home() / ".cache" / "ncwrap" / "uploads"
+
+# Timeout (connessione, lettura): un blocco può richiedere minuti su linee
+# lente, l'assemblaggio finale di file multi-GB anche di più
+CHUNK_TIMEOUT = (10, 300)
+ASSEMBLE_TIMEOUT = (10, 1800)
+
+ProgressCallback = Callable[[int, int], None]
+
+
+@dataclass
+class TransferResult:
+    """Esito di un trasferimento con statistiche di throughput"""
+    status_code: int
+    size: int
+    transferred: int = 0
+    elapsed: float = 0.0
+    chunks_total: int = 1
+    chunks_skipped: int = 0
+    resumed: bool = False
+
+    @property
+    def success(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    @property
+    def throughput(self) -> float:
+        """Byte/s effettivamente trasferiti in questa esecuzione"""
+        return self.transferred / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.throughput / MiB
+
+
+class FileBody:
+    """
+    Corpo richiesta letto da file a blocchi grandi, senza copie intermedie
+
+    - __len__ fa impostare a requests Content-Length (niente chunked encoding)
+    - __iter__ riempie con os.preadv un unico bytearray e produce memoryview:
+      urllib3 le passa direttamente a socket.sendall
+    - ogni iterazione riparte da offset, quindi il corpo è ritrasmissibile
+      dai retry di make_request_with_retry
+    - niente metodo read(): urllib3 leggerebbe a blocchi da 16 KiB
+    - per file vuoti usare b"" (requests userebbe chunked con lunghezza 0)
+
+    Args:
+        source: Percorso file o file descriptor aperto (non viene chiuso)
+        offset: Primo byte da inviare
+        length: Byte da inviare (default: fino a fine file)
+        buffer_size: Dimensione del buffer di lettura
+    """
+
+    def __init__(self, source, offset: int = 0, length: Optional[int] = None,
+                 buffer_size: int = BODY_BUFFER_SIZE):
+        self.source = source
+        self.offset = offset
+        if length is None:
+            size = os.fstat(source).st_size if isinstance(source, int) else os.path.getsize(source)
+            length = max(size - offset, 0)
+        self.length = length
+        self.buffer_size = buffer_size
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        owned = not isinstance(self.source, int)
+        fd = os.open(self.source, os.O_RDONLY) if owned else self.source
+        buffer = bytearray(min(self.buffer_size, self.length) or 1)
+        view = memoryview(buffer)
+        try:
+            position = self.offset
+            remaining = self.length
+            while remaining > 0:
+                target = view[:min(len(buffer), remaining)]
+                read = os.preadv(fd, [target], position)
+                if read == 0:
+                    raise OSError(f"File troncato durante l'upload ({remaining} byte mancanti)")
+                # Il buffer viene riscritto solo dopo che sendall ha consumato il blocco
+                yield target[:read]
+                position += read
+                remaining -= read
+        finally:
+            if owned:
+                os.close(fd)
+
+
+def chunk_plan(size: int, chunk_size: int) -> int:
+    """
+    Adatta la dimensione blocco ai limiti del protocollo
+
+    Args:
+        size: Dimensione file
+        chunk_size: Dimensione richiesta
+
+    Returns:
+        Dimensione blocco effettiva (>= 5 MiB, al massimo 10000 blocchi)
+    """
+    chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    if size > chunk_size * MAX_CHUNKS:
+        chunk_size = -(-size // MAX_CHUNKS)
+    return chunk_size
+
+
+class _Journal:
+    """Journal JSON di un trasferimento (niente credenziali)"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data: Dict = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict:
+        try:
+            with open(self.path, "r") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        return self.data
+
+    def save(self) -> None:
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(str(self.path), json.dumps(self.data), 0o600)
+
+    def mark_chunk(self, number: int) -> None:
+        """Upload: blocco completato"""
+        with self._lock:
+            self.data.setdefault("completed", []).append(number)
+        self.save()
+
+    def mark_range(self, index: int) -> None:
+        """Download: bit dell'intervallo completato nella bitmap"""
+        with self._lock:
+            bitmap = bytearray.fromhex(self.data["bitmap"])
+            bitmap[index // 8] |= 1 << (index % 8)
+            self.data["bitmap"] = bitmap.hex()
+        self.save()
+
+    def remove(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _server_chunks(upload_url: str, auth, size: int, chunk_size: int) -> Optional[Set[int]]:
+    """
+    Blocchi già presenti sul server con la dimensione attesa
+
+    Returns:
+        Set numeri blocco, o None se la sessione non esiste più
+    """
+    response = make_request_with_retry(
+        "PROPFIND", upload_url, auth=auth, data=PROPFIND_BODY,
+        headers={"Depth": "1", "Content-Type": "application/xml"}, stream=True,
+    )
+    try:
+        if response.status_code == 404:
+            return None
+        if response.status_code != 207:
+            response.raise_for_status()
+            return None
+
+        chunks = set()
+        for entry in iter_multistatus(response):
+            if entry.is_dir or not entry.name.isdigit():
+                continue
+            number = int(entry.name)
+            expected = min(chunk_size, size - (number - 1) * chunk_size)
+            if entry.size == expected:
+                chunks.add(number)
+        return chunks
+    finally:
+        response.close()
+
+
+def upload_file_chunked(local_path: str, remote_path: str, user: str, password: str,
+                        chunk_size: Optional[int] = None, parallel: Optional[int] = None,
+                        journal_dir: Optional[str] = None,
+                        progress: Optional[ProgressCallback] = None) -> TransferResult:
+    """
+    Carica un file con il protocollo chunking v2 (blocchi paralleli, ripristinabile)
+
+    Args:
+        local_path: Percorso file locale
+        remote_path: Percorso destinazione su Nextcloud
+        user: Username
+        password: Password
+        chunk_size: Byte per blocco (default NC_UPLOAD_CHUNK_MB MiB)
+        parallel: PUT contemporanei (default NC_UPLOAD_PARALLEL)
+        journal_dir: Directory journal (default ~/.cache/ncwrap/uploads)
+        progress: Callback(byte_inviati, byte_totali)
+
+    Returns:
+        TransferResult (status dell'assemblaggio finale)
+
+    Raises:
+        FileNotFoundError: Se il file locale non esiste
+        requests.HTTPError: Se un blocco fallisce dopo i retry (journal conservato)
+    """
+    base_url, _, _ = get_nc_config()
+    auth = (user, password)
+    stat = os.stat(local_path)
+    size = stat.st_size
+    chunk_size = chunk_plan(size, chunk_size or env_int("NC_UPLOAD_CHUNK_MB", DEFAULT_CHUNK_MB) * MiB)
+    parallel = max(1, parallel or env_int("NC_UPLOAD_PARALLEL", DEFAULT_PARALLEL))
+    destination = dav_files_url(base_url, user, remote_path)
+    started = time.monotonic()
+
+    # File piccolo: un solo PUT
+    if size <= chunk_size:
+        response = make_request_with_retry(
+            "PUT", destination, auth=auth, data=FileBody(local_path, length=size) if size else b"",
+            timeout=CHUNK_TIMEOUT,
+        )
+        response.close()
+        if progress:
+            progress(size, size)
+        return TransferResult(response.status_code, size, size, time.monotonic() - started)
+
+    chunks_total = -(-size // chunk_size)
+    journal_key = f"{base_url}|{user}|{remote_path.strip('/')}|{os.path.abspath(local_path)}"
+    journal = _Journal(
+        (Path(journal_dir) if journal_dir else JOURNAL_DIR)
+        / f"{hashlib.sha1(journal_key.encode()).hexdigest()}.json"
+    )
+    state = journal.load()
+    done: Set[int] = set()
+    resumed = False
+
+    # Ripresa solo se file locale e dimensione blocchi sono invariati
+    if (state.get("size") == size and state.get("mtime") == stat.st_mtime
+            and state.get("chunk_size") == chunk_size and state.get("upload_id")):
+        upload_url = dav_uploads_url(base_url, user, state["upload_id"])
+        server_chunks = _server_chunks(upload_url, auth, size, chunk_size)
+        if server_chunks is not None:
+            done = server_chunks
+            resumed = True
+    elif state.get("upload_id"):
+        # Sessione precedente non più valida: rimozione best effort
+        make_request_with_retry(
+            "DELETE", dav_uploads_url(base_url, user, state["upload_id"]), auth=auth, max_retries=0,
+        ).close()
+
+    if not resumed:
+        upload_id = f"ncwrap-{uuid.uuid4().hex}"
+        upload_url = dav_uploads_url(base_url, user, upload_id)
+        response = make_request_with_retry(
+            "MKCOL", upload_url, auth=auth, headers={"Destination": destination},
+        )
+        response.raise_for_status()
+        journal.data = {
+            "upload_id": upload_id,
+            "local_path": os.path.abspath(local_path),
+            "remote_path": remote_path,
+            "size": size,
+            "mtime": stat.st_mtime,
+            "chunk_size": chunk_size,
+            "completed": [],
+        }
+    else:
+        journal.data["completed"] = sorted(done)
+    journal.save()
+
+    headers = {"Destination": destination, "OC-Total-Length": str(size)}
+    sent = sum(min(chunk_size, size - (n - 1) * chunk_size) for n in done)
+    transferred = 0
+    if progress:
+        progress(sent, size)
+
+    def put_chunk(fd: int, number: int) -> int:
+        offset = (number - 1) * chunk_size
+        length = min(chunk_size, size - offset)
+        response = make_request_with_retry(
+            "PUT", dav_uploads_url(base_url, user, journal.data["upload_id"], str(number)),
+            auth=auth, data=FileBody(fd, offset, length), headers=headers, timeout=CHUNK_TIMEOUT,
+        )
+        response.close()
+        if response.status_code not in (201, 204):
+            raise requests.HTTPError(f"Blocco {number}: HTTP {response.status_code}", response=response)
+        journal.mark_chunk(number)
+        return length
+
+    pending = [n for n in range(1, chunks_total + 1) if n not in done]
+    fd = os.open(local_path, os.O_RDONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = [executor.submit(put_chunk, fd, n) for n in pending]
+            try:
+                for future in as_completed(futures):
+                    length = future.result()
+                    sent += length
+                    transferred += length
+                    if progress:
+                        progress(sent, size)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        os.close(fd)
+
+    # Assemblaggio lato server
+    move_headers = dict(headers)
+    move_headers["X-OC-Mtime"] = str(int(stat.st_mtime))
+    response = make_request_with_retry(
+        "MOVE", dav_uploads_url(base_url, user, journal.data["upload_id"], ".file"),
+        auth=auth, headers=move_headers, timeout=ASSEMBLE_TIMEOUT,
+    )
+    response.close()
+    if response.status_code in (201, 204):
+        journal.remove()
+
+    return TransferResult(
+        status_code=response.status_code,
+        size=size,
+        transferred=transferred,
+        elapsed=time.monotonic() - started,
+        chunks_total=chunks_total,
+        chunks_skipped=len(done),
+        resumed=resumed,
+    )
+
+
+def _range_done(bitmap: bytes, index: int) -> bool:
+    return bool(bitmap[index // 8] & (1 << (index % 8)))
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """Riserva lo spazio del file (fallback a file sparso se non supportato)"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def _stream_to_file(response: requests.Response, fd: int, offset: int = 0) -> int:
+    """Scrive il body della risposta nel file a partire da offset, ritorna i byte scritti"""
+    written = 0
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        if chunk:
+            os.pwrite(fd, chunk, offset + written)
+            written += len(chunk)
+    return written
+
+
+def download_file_ranged(remote_path: str, local_path: str, user: str, password: str,
+                         range_size: Optional[int] = None, parallel: Optional[int] = None,
+                         progress: Optional[ProgressCallback] = None) -> TransferResult:
+    """
+    Scarica un file con GET Range paralleli (ripristinabile)
+
+    Il file viene scritto in <local_path>.part e rinominato solo a download
+    completo: local_path non contiene mai un file troncato. Se il server non
+    supporta Range (o il file è piccolo) si usa un singolo stream.
+
+    Args:
+        remote_path: Percorso file su Nextcloud
+        local_path: Percorso destinazione locale
+        user: Username
+        password: Password
+        range_size: Byte per intervallo (default NC_DOWNLOAD_RANGE_MB MiB)
+        parallel: Connessioni contemporanee (default NC_DOWNLOAD_PARALLEL)
+        progress: Callback(byte_ricevuti, byte_totali)
+
+    Returns:
+        TransferResult (status 200 se completato, altrimenti status HTTP)
+
+    Raises:
+        requests.HTTPError: Se un intervallo fallisce dopo i retry (.part conservato)
+    """
+    base_url, _, _ = get_nc_config()
+    auth = (user, password)
+    url = dav_files_url(base_url, user, remote_path)
+    range_size = max(range_size or env_int("NC_DOWNLOAD_RANGE_MB", DEFAULT_RANGE_MB) * MiB, MiB)
+    parallel = max(1, parallel or env_int("NC_DOWNLOAD_PARALLEL", DEFAULT_PARALLEL))
+    part_path = f"{local_path}.part"
+    journal = _Journal(Path(f"{part_path}.json"))
+    started = time.monotonic()
+
+    head = make_request_with_retry("HEAD", url, auth=auth)
+    head.close()
+    if head.status_code != 200:
+        return TransferResult(head.status_code, 0)
+
+    length = head.headers.get("Content-Length")
+    size = int(length) if length and length.isdigit() else None
+    etag = head.headers.get("ETag", "")
+    ranged = (size is not None and size > range_size
+              and head.headers.get("Accept-Ranges", "").lower() == "bytes")
+
+    # Singolo stream: server senza Range, dimensione ignota o file piccolo
+    if not ranged:
+        response = make_request_with_retry("GET", url, auth=auth, stream=True, timeout=CHUNK_TIMEOUT)
+        try:
+            if response.status_code != 200:
+                return TransferResult(response.status_code, size or 0)
+            fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                written = _stream_to_file(response, fd)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        finally:
+            response.close()
+        if size is not None and written != size:
+            raise requests.HTTPError(f"Download troncato: {written}/{size} byte", response=response)
+        os.replace(part_path, local_path)
+        if progress:
+            progress(written, written)
+        return TransferResult(200, written, written, time.monotonic() - started)
+
+    ranges_total = -(-size // range_size)
+    state = journal.load()
+    resumed = (state.get("etag") == etag and state.get("size") == size
+               and state.get("range_size") == range_size and os.path.exists(part_path)
+               and os.path.getsize(part_path) == size)
+    if not resumed:
+        journal.data = {
+            "remote_path": remote_path,
+            "etag": etag,
+            "size": size,
+            "range_size": range_size,
+            "bitmap": bytearray(-(-ranges_total // 8)).hex(),
+        }
+        journal.save()
+
+    bitmap = bytes.fromhex(journal.data["bitmap"])
+    pending = [i for i in range(ranges_total) if not _range_done(bitmap, i)]
+    skipped = ranges_total - len(pending)
+    received = sum(min(range_size, size - i * range_size) for i in range(ranges_total)
+                   if _range_done(bitmap, i))
+    transferred = 0
+    if progress:
+        progress(received, size)
+
+    def fetch_range(fd: int, index: int) -> int:
+        start = index * range_size
+        end = min(start + range_size, size) - 1
+        headers = {"Range": f"bytes={start}-{end}"}
+        if etag:
+            # Se il file remoto cambia il server risponde 200: niente mix di versioni
+            headers["If-Range"] = etag
+        response = make_request_with_retry("GET", url, auth=auth, headers=headers,
+                                           stream=True, timeout=CHUNK_TIMEOUT)
+        try:
+            if response.status_code != 206:
+                raise requests.HTTPError(f"Intervallo {start}-{end}: HTTP {response.status_code}",
+                                         response=response)
+            written = _stream_to_file(response, fd, start)
+        finally:
+            response.close()
+        if written != end - start + 1:
+            raise requests.HTTPError(f"Intervallo {start}-{end} troncato", response=response)
+        journal.mark_range(index)
+        return written
+
+    # Senza ripresa si tronca: posix_fallocate non riduce mai un .part
+    # rimasto più lungo (es. versione precedente del file remoto)
+    flags = os.O_RDWR | os.O_CREAT | (0 if resumed else os.O_TRUNC)
+    fd = os.open(part_path, flags, 0o644)
+    try:
+        if not resumed:
+            _preallocate(fd, size)
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = [executor.submit(fetch_range, fd, i) for i in pending]
+            try:
+                for future in as_completed(futures):
+                    written = future.result()
+                    received += written
+                    transferred += written
+                    if progress:
+                        progress(received, size)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.replace(part_path, local_path)
+    journal.remove()
+
+    return TransferResult(
+        status_code=200,
+        size=size,
+        transferred=transferred,
+        elapsed=time.monotonic() - started,
+        chunks_total=ranges_total,
+        chunks_skipped=skipped,
+        resumed=resumed,
+    )
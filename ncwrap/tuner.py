@@ -0,0 +1,277 @@
+"""
+Autotuning delle opzioni di mount per tenant
+
+`mount tune <utente>` campiona per una finestra di tempo le statistiche rc
+del mount (`core/stats`, `vfs/stats`) e ne ricava:
+- working set: picco di cache VFS occupata più i byte riscaricati dopo
+  un'espulsione (cache piena che continua a scaricare)
+- efficienza lettura: frazione dei file effettivamente letta nei
+  trasferimenti completati nella finestra (`core/transferred`, byte
+  finali: letture parziali = accesso casuale)
+- concorrenza: picco di file aperti (RAM = --buffer-size x file aperti)
+- scritture: upload in coda osservati
+
+La raccomandazione rispetta un budget disco locale e, se applicata, viene
+salvata per remote: `mount_remote()` e il supervisore la sovrappongono al
+profilo ad ogni mount, quindi anche le unit systemd esistenti la usano.
+
+Per i mount ospitati dal supervisore (scope "shard") i contatori dei
+trasferimenti coprono tutti i tenant dello shard: working set ed
+efficienza lettura si ricavano solo dalle statistiche VFS del mount, e
+--buffer-size (opzione del demone, comune allo shard) non viene proposto.
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .mountstats import rclone_size_to_bytes, stats_endpoint
+from .rclone_rc import RcloneRCError
+from .utils import atomic_write, bytes_to_human, first_writable_dir, get_available_space
+
+# Profili generati per remote (NC_TUNED_DIR ha la precedenza)
+TUNED_DIRS = ("/var/lib/ncwrap/tuned", "~/.config/ncwrap/tuned")
+# Quota dello spazio libero locale concessa a una cache tenant (NC_TUNE_DISK_FRACTION, %)
+DEFAULT_DISK_FRACTION = 50
+# Granularità e minimo della cache raccomandata
+CACHE_STEP = 256 * 1024 ** 2
+MIN_CACHE = 256 * 1024 ** 2
+# Margine sul working set osservato
+CACHE_HEADROOM = 1.5
+
+
+def _rclone_size(value: int) -> str:
+    """Bytes -> dimensione rclone (es. 1536M, 5G)"""
+    mib = max(1, -(-value // 1024 ** 2))
+    return f"{mib // 1024}G" if mib % 1024 == 0 else f"{mib}M"
+
+
+def _cache_mode(value) -> Optional[str]:
+    """CacheMode di vfs/stats (stringa o, nelle versioni rclone meno recenti, intero)"""
+    if isinstance(value, int):
+        return ("off", "minimal", "writes", "full")[value] if 0 <= value <= 3 else None
+    return value
+
+
+def _remote_key(remote_name: str) -> str:
+    return remote_name.split(":", 1)[0]
+
+
+def _tuned_path(remote_name: str) -> Optional[str]:
+    directory = first_writable_dir(TUNED_DIRS, "NC_TUNED_DIR")
+    if directory is None:
+        return None
+    return os.path.join(str(directory), f"{_remote_key(remote_name)}.json")
+
+
+# ===== Campionamento =====
+
+def sample_workload(mount_point: str, window: float = 300, interval: float = 10) -> Dict:
+    """
+    Campiona le statistiche rc di un mount per `window` secondi
+
+    Returns:
+        Riepilogo: samples, window, scope, bytes_transferred, cache_peak,
+        cache_start, cache_end, cache_max, cache_mode, chunk_size,
+        saturated, read_ratio, files_observed, open_files_peak,
+        uploads_peak, metadata_files
+
+    Raises:
+        RcloneRCError: Se il mount non espone l'endpoint rc
+    """
+    mount_point = os.path.realpath(mount_point)
+    client, fs, shard = stats_endpoint(mount_point)
+    if client is None:
+        raise RcloneRCError(f"{mount_point}: endpoint rc non disponibile (rimonta per abilitarlo)")
+    # Demone condiviso: core/stats e core/transferred includono gli altri tenant
+    scope = "shard" if shard is not None else "mount"
+
+    def completed() -> Dict[tuple, Dict]:
+        if scope == "shard":
+            return {}
+        return {(item.get("name"), item.get("started_at"), item.get("completed_at")): item
+                for item in client.core_transferred()}
+
+    samples: List[Dict] = []
+    # trasferimento completato -> (dimensione, byte letti): core/transferred
+    # conserva solo gli ultimi, quindi si raccoglie ad ogni campione
+    before = set(completed())
+    transfers: Dict[tuple, Tuple[int, int]] = {}
+    deadline = time.monotonic() + window
+    while True:
+        core, vfs = client.core_stats(), client.vfs_stats(fs)
+        samples.append({"core": core, "vfs": vfs})
+        for key, item in completed().items():
+            size = item.get("size") or 0
+            if key in before or item.get("error") or size <= 0:
+                continue
+            transfers[key] = (size, item.get("bytes") or 0)
+        if time.monotonic() + interval > deadline:
+            break
+        time.sleep(interval)
+
+    first, last = samples[0], samples[-1]
+    disk = [sample["vfs"].get("diskCache") or {} for sample in samples]
+    opt = last["vfs"].get("opt") or {}
+    cache_used = [d.get("bytesUsed") or 0 for d in disk]
+    cache_max = rclone_size_to_bytes(opt.get("CacheMaxSize"))
+
+    read_ratio = None
+    if transfers:
+        read_ratio = sum(min(done / size, 1.0) for size, done in transfers.values()) / len(transfers)
+
+    return {
+        "samples": len(samples),
+        "window": window,
+        "scope": scope,
+        "bytes_transferred": max((last["core"].get("bytes") or 0) - (first["core"].get("bytes") or 0), 0),
+        "cache_peak": max(cache_used),
+        "cache_start": cache_used[0],
+        "cache_end": cache_used[-1],
+        "cache_max": cache_max,
+        "cache_mode": _cache_mode(opt.get("CacheMode")),
+        "chunk_size": rclone_size_to_bytes(opt.get("ChunkSize")),
+        "saturated": bool(cache_max) and max(cache_used) >= 0.95 * cache_max,
+        "read_ratio": read_ratio,
+        "files_observed": len(transfers),
+        "open_files_peak": max(sample["vfs"].get("inUse") or 0 for sample in samples),
+        "uploads_peak": max((d.get("uploadsQueued") or 0) + (d.get("uploadsInProgress") or 0) for d in disk),
+        "metadata_files": (last["vfs"].get("metadataCache") or {}).get("files", 0),
+    }
+
+
+def disk_budget(current_cache: int = 0, cache_dir: Optional[str] = None) -> int:
+    """Budget cache per un tenant: quota dello spazio libero più la cache già occupata"""
+    if cache_dir is None:
+        from .rclone import DEFAULT_MOUNT_OPTIONS
+        options = list(DEFAULT_MOUNT_OPTIONS)
+        cache_dir = options[options.index("--cache-dir") + 1] if "--cache-dir" in options else "/var/cache"
+        while not os.path.isdir(cache_dir) and cache_dir != "/":
+            cache_dir = os.path.dirname(cache_dir)
+    fraction = min(max(int(os.environ.get("NC_TUNE_DISK_FRACTION", DEFAULT_DISK_FRACTION)), 1), 100)
+    return int((get_available_space(cache_dir) + current_cache) * fraction / 100)
+
+
+# ===== Raccomandazione =====
+
+def recommend_options(summary: Dict, budget: int) -> Dict:
+    """
+    Opzioni rclone consigliate per il carico osservato
+
+    Returns:
+        Dict con options (lista CLI da sovrapporre al profilo), reasons
+        (motivazioni leggibili) e working_set stimato in bytes
+    """
+    options: List[str] = []
+    reasons: List[str] = []
+
+    mode = summary.get("cache_mode") or "full"
+    if summary["uploads_peak"] and mode in ("off", "minimal"):
+        mode = "writes"
+        reasons.append("scritture osservate: cache VFS almeno in modalità writes")
+
+    # Working set: cache occupata al picco + dati riscaricati dopo espulsioni.
+    # Su uno shard i byte trasferiti sono di tutti i tenant: solo la cache
+    growth = max(summary["cache_end"] - summary["cache_start"], 0)
+    shared = summary.get("scope") == "shard"
+    refetched = 0
+    if summary["saturated"] and not shared:
+        refetched = max(summary["bytes_transferred"] - growth, 0)
+    working_set = summary["cache_peak"] + refetched
+
+    if mode != "off":
+        target = max(int(working_set * CACHE_HEADROOM), MIN_CACHE)
+        target = -(-target // CACHE_STEP) * CACHE_STEP
+        if summary["saturated"] and shared:
+            reasons.append("cache satura su mount condiviso (shard): riscaricamenti non attribuibili, "
+                           "working set dalla sola cache")
+        elif summary["saturated"]:
+            reasons.append(f"cache satura: riscaricati {bytes_to_human(refetched)} nella finestra")
+        if target > budget:
+            target = max(budget // CACHE_STEP * CACHE_STEP, MIN_CACHE)
+            reasons.append(f"cache limitata dal budget disco ({bytes_to_human(budget)})")
+        else:
+            reasons.append(f"working set stimato {bytes_to_human(working_set)} (+50% margine)")
+        options += ["--vfs-cache-mode", mode, "--vfs-cache-max-size", _rclone_size(target)]
+
+    # Letture parziali -> chunk piccoli; letture complete -> chunk grandi
+    ratio = summary.get("read_ratio")
+    if ratio is not None and summary["files_observed"] >= 3:
+        if ratio < 0.25:
+            options += ["--vfs-read-chunk-size", "16M", "--vfs-read-chunk-size-limit", "256M"]
+            reasons.append(f"accesso casuale (letto in media il {ratio:.0%} dei file): chunk piccoli")
+        elif ratio > 0.9:
+            options += ["--vfs-read-chunk-size", "64M", "--vfs-read-chunk-size-limit", "2G"]
+            reasons.append(f"letture sequenziali complete ({ratio:.0%}): chunk grandi")
+
+    # RAM di read-ahead: --buffer-size per ogni file aperto. Su uno shard è
+    # un'opzione del demone condiviso, non del singolo mount
+    if mode != "off" and shared:
+        reasons.append("buffer per file non regolabile per tenant su mount condiviso (shard)")
+    elif mode != "off":
+        peak = summary["open_files_peak"]
+        buffer_size = "64M" if peak <= 8 else "32M" if peak <= 32 else "16M"
+        options += ["--buffer-size", buffer_size]
+        reasons.append(f"picco {peak} file aperti: buffer {buffer_size} per file")
+
+    # Alberi grandi: listing costosi, cache directory più lunga
+    if summary["metadata_files"] > 50000:
+        options += ["--dir-cache-time", "24h"]
+        reasons.append(f"{summary['metadata_files']} voci in cache metadati: dir-cache 24h")
+
+    return {"options": options, "reasons": reasons, "working_set": working_set}
+
+
+# ===== Persistenza =====
+
+def save_tuned_profile(remote_name: str, mount_point: str, summary: Dict,
+                       recommendation: Dict) -> str:
+    """
+    Salva il profilo generato per un remote
+
+    Returns:
+        Percorso del file salvato
+
+    Raises:
+        RuntimeError: Se nessuna directory è scrivibile
+    """
+    path = _tuned_path(remote_name)
+    content = json.dumps({
+        "remote": _remote_key(remote_name),
+        "mount_point": os.path.realpath(mount_point),
+        "created": time.time(),
+        "summary": summary,
+        "options": recommendation["options"],
+        "reasons": recommendation["reasons"],
+    }, indent=2)
+    if path is None or not atomic_write(path, content, 0o644):
+        raise RuntimeError(f"Impossibile salvare profilo ottimizzato per {remote_name}")
+    return path
+
+
+def load_tuned_profile(remote_name: str) -> Optional[Dict]:
+    """Profilo generato per un remote o None"""
+    path = _tuned_path(remote_name)
+    if path is None:
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_tuned_options(remote_name: str) -> List[str]:
+    """Opzioni del profilo generato (lista vuota se assente)"""
+    profile = load_tuned_profile(remote_name)
+    return list(profile.get("options") or []) if profile else []
+
+
+def remove_tuned_profile(remote_name: str) -> bool:
+    """Elimina il profilo generato (si torna al profilo statico)"""
+    path = _tuned_path(remote_name)
+    try:
+        os.remove(path)
+        return True
+    except (OSError, TypeError):
+        return False
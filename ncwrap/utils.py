@@ -1,6 +1,7 @@
 """
 Utility functions per nextcloud-wrapper v0.3.0
 """
+import fcntl
 import os
 import subprocess
 import pwd
@@ -8,8 +9,9 @@ import shutil
 import re
 import time
 import random
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Iterator, Tuple, Optional
 
 
 def run(cmd: list, check: bool = True) -> str:
@@ -21,7 +23,7 @@ def run(cmd: list, check: bool = True) -> str:
 
 
 def run_with_retry(cmd: list, max_retries: int = 3, delay_base: float = 1.0, 
-                  backoff_multiplier: float = 2.0, check: bool = True) -> str:
+                  backoff_multiplier: float = 2.0, check: bool = True, limiter=None) -> str:
     """
     Esegue comando con retry automatico e backoff esponenziale per gestire rate limiting
     
@@ -31,6 +33,8 @@ def run_with_retry(cmd: list, max_retries: int = 3, delay_base: float = 1.0,
         delay_base: Delay base in secondi
         backoff_multiplier: Moltiplicatore per backoff esponenziale
         check: Se sollevare eccezione su errore
+        limiter: Rate limiter condiviso (ratelimit.get_limiter); se presente
+                 sostituisce il backoff cieco sui 429
         
     Returns:
         Output del comando
@@ -42,10 +46,14 @@ def run_with_retry(cmd: list, max_retries: int = 3, delay_base: float = 1.0,
     
     for attempt in range(max_retries + 1):
         try:
+            if limiter is not None:
+                limiter.acquire()
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
             
             # Successo
             if result.returncode == 0:
+                if limiter is not None:
+                    limiter.on_success()
                 return result.stdout.strip()
             
             # Controllo errori specifici
@@ -53,7 +61,14 @@ def run_with_retry(cmd: list, max_retries: int = 3, delay_base: float = 1.0,
             
             # Rate limiting (429 Too Many Requests)
             if "429" in stderr_lower or "too many requests" in stderr_lower:
-                if attempt < max_retries:
+                if limiter is not None:
+                    # Il limiter condiviso rallenta anche gli altri processi;
+                    # il prossimo acquire() attende la pausa
+                    pause = limiter.on_throttle()
+                    if attempt < max_retries:
+                        print(f"⏳ Rate limit rilevato, rallento ({pause:.1f}s) (tentativo {attempt + 1}/{max_retries + 1})")
+                        continue
+                elif attempt < max_retries:
                     # Calcola delay con jitter per evitare thundering herd
                     delay = delay_base * (backoff_multiplier ** attempt)
                     jitter = random.uniform(0.1, 0.3) * delay
@@ -96,6 +111,39 @@ def run_with_retry(cmd: list, max_retries: int = 3, delay_base: float = 1.0,
     return ""
 
 
+def env_int(name: str, default: int) -> int:
+    """Legge un intero da variabile d'ambiente con fallback"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def first_writable_dir(candidates, env_var: Optional[str] = None) -> Optional[Path]:
+    """
+    Prima directory scrivibile tra i candidati (creandola se serve)
+    
+    Args:
+        candidates: Percorsi in ordine di preferenza (~ espanso)
+        env_var: Variabile d'ambiente che, se impostata, ha la precedenza
+        
+    Returns:
+        Path della directory o None se nessuna è utilizzabile
+    """
+    candidates = list(candidates)
+    if env_var and os.environ.get(env_var):
+        candidates.insert(0, os.environ[env_var])
+    for candidate in candidates:
+        path = Path(candidate).expanduser()
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(path, os.W_OK):
+            return path
+    return None
+
+
 def ensure_dir(path: str) -> None:
     """Crea directory se non esiste"""
     os.makedirs(path, exist_ok=True)
@@ -116,19 +164,9 @@ def is_command_available(command: str) -> bool:
 
 
 def is_mounted(path: str) -> bool:
-    """Verifica se un percorso è montato"""
-    try:
-        # Metodo 1: controlla /proc/mounts
-        with open('/proc/mounts', 'r') as f:
-            mounts = f.read()
-            return path in mounts
-    except:
-        try:
-            # Metodo 2: usa comando mount
-            result = run(["mount"], check=False)
-            return path in result
-        except:
-            return False
+    """Verifica se un percorso è un mount point (match esatto, tabella mount condivisa)"""
+    from .mounttable import get_mount_table
+    return get_mount_table().is_mounted(path)
 
 
 def check_sudo_privileges() -> bool:
@@ -265,6 +303,19 @@ def atomic_write(file_path: str, content: str, mode: int = 0o644) -> bool:
         return False
 
 
+@contextmanager
+def file_lock(lock_path: str) -> Iterator[None]:
+    """
+    Lock esclusivo tra processi (e thread) con flock su un file di lock
+
+    Per i read-modify-write di file condivisi (rclone.conf, mounts.json):
+    un threading.Lock protegge solo il singolo processo.
+    """
+    with open(lock_path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
 def get_system_info() -> dict:
     """Ottiene informazioni sistema"""
     info = {}
@@ -394,17 +445,57 @@ def get_public_ip() -> Optional[str]:
         return None
 
 
-def wait_for_condition(condition_func, timeout: int = 30, interval: float = 1.0) -> bool:
-    """Attende che una condizione sia vera"""
-    import time
-    start_time = time.time()
+def wait_for_condition(condition_func, timeout: float = 30, interval: float = 1.0,
+                       wait_func=None) -> bool:
+    """
+    Attende che una condizione sia vera
+
+    wait_func(secondi) sostituisce la pausa tra due controlli con un'attesa
+    su eventi che ritorna appena qualcosa cambia (es. poll() su mountinfo);
+    la condizione viene comunque ricontrollata almeno ogni `interval`.
+    """
+    deadline = time.monotonic() + timeout
+    wait = wait_func or time.sleep
     
-    while time.time() - start_time < timeout:
+    while True:
         if condition_func():
             return True
-        time.sleep(interval)
-    
-    return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        wait(min(interval, remaining))
+
+
+def call_with_timeout(func, timeout: float, default=None):
+    """
+    Esegue func() in un thread daemon attendendo al massimo timeout secondi
+
+    Per chiamate che possono bloccarsi senza limite, come stat()/statfs()
+    su un mount FUSE il cui demone non risponde: il thread resta appeso,
+    il chiamante prosegue.
+
+    Returns:
+        Risultato di func() o default se non termina in tempo
+        (le eccezioni di func vengono rilanciate)
+    """
+    import threading
+    outcome = []
+
+    def target():
+        try:
+            outcome.append((True, func()))
+        except BaseException as e:
+            outcome.append((False, e))
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not outcome:
+        return default
+    ok, value = outcome[0]
+    if not ok:
+        raise value
+    return value
 
 
 def random_string(length: int = 16, charset: str = None) -> str:
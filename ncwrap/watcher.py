@@ -0,0 +1,335 @@
+"""
+Watcher dei mount tenant guidato da eventi
+
+`nextcloud-wrapper watch` resta bloccato in poll() su:
+- /proc/self/mountinfo (POLLPRI a ogni mount/umount): un mount sparito
+  viene visto subito
+- un pidfd per ogni processo rclone che serve i mount (PID da `core/pid`
+  sull'endpoint rc): quando rclone muore il mount FUSE resta in tabella ma
+  risponde ENOTCONN, e l'uscita del processo sveglia il watcher
+
+Un controllo periodico con stat() (in un thread, con timeout) copre i mount
+bloccati senza che nessun processo sia uscito.
+
+I mount mancanti o inutilizzabili vengono rimontati da chi li possiede:
+restart della unit systemd (ncwrap-rclone@<utente> o unit per-utente),
+mount/mount nello shard del supervisore, MountManager.mount_user_home solo
+per i mount senza proprietario. Ogni tenant ha un circuit breaker: retry con
+back-off esponenziale e, dopo troppi fallimenti consecutivi, pausa lunga
+prima di un nuovo tentativo.
+"""
+import errno
+import os
+import random
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from .mounttable import get_mount_table, wait_for_mount
+from .utils import call_with_timeout, env_int, run
+
+# Intervallo controllo stat() periodico (secondi)
+DEFAULT_PROBE_INTERVAL = 30
+# Timeout stat() su un mount (oltre = bloccato)
+DEFAULT_STAT_TIMEOUT = 5.0
+# Circuit breaker: fallimenti consecutivi prima della pausa lunga
+DEFAULT_MAX_FAILURES = 5
+# Back-off tra i tentativi (secondi) e pausa a circuito aperto
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+DEFAULT_COOLDOWN = 900.0
+# Remount in parallelo
+REMOUNT_WORKERS = 4
+
+# Errori stat() di un mount FUSE il cui processo non risponde più
+_STALE_ERRNOS = (errno.ENOTCONN, errno.EIO, errno.ESTALE, errno.ECONNABORTED)
+
+
+class CircuitBreaker:
+    """
+    Back-off esponenziale con jitter e apertura dopo N fallimenti
+
+    Stati: "closed" (nessun errore), "backoff" (retry in attesa),
+    "open" (troppi fallimenti: un solo tentativo dopo il cooldown)
+    """
+
+    def __init__(self, max_failures: int = DEFAULT_MAX_FAILURES,
+                 cooldown: float = DEFAULT_COOLDOWN):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.failures == 0:
+            return "closed"
+        return "open" if self.failures >= self.max_failures else "backoff"
+
+    def allow(self, now: float) -> bool:
+        return now >= self.next_attempt
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            delay = self.cooldown
+        else:
+            delay = min(BACKOFF_BASE * 2 ** (self.failures - 1), BACKOFF_MAX)
+            delay *= 0.5 + random.random() / 2
+        self.next_attempt = now + delay
+
+
+def probe_mount(mount_point: str, timeout: float = DEFAULT_STAT_TIMEOUT) -> str:
+    """
+    Stato di un mount point
+
+    Returns:
+        "ok", "missing" (non in mountinfo), "stale" (ENOTCONN/EIO) o
+        "hung" (stat() non risponde entro timeout)
+    """
+    if not get_mount_table().is_mounted(mount_point):
+        return "missing"
+
+    def stat() -> str:
+        try:
+            os.stat(mount_point)
+            return "ok"
+        except OSError as e:
+            return "stale" if e.errno in _STALE_ERRNOS else "ok"
+
+    # Thread daemon: uno stat() bloccato su FUSE non blocca il watcher
+    return call_with_timeout(stat, timeout, default="hung")
+
+
+class MountWatcher:
+    """
+    Rimonta i mount tenant appena spariscono o smettono di rispondere
+
+    Uso:
+        MountWatcher().run()   # bloccante
+    """
+
+    def __init__(self, probe_interval: float = DEFAULT_PROBE_INTERVAL,
+                 stat_timeout: float = DEFAULT_STAT_TIMEOUT,
+                 max_failures: Optional[int] = None,
+                 cooldown: Optional[float] = None):
+        from .mount import MountManager
+
+        self.manager = MountManager()
+        self.probe_interval = probe_interval
+        self.stat_timeout = stat_timeout
+        self.max_failures = max_failures or env_int("NC_WATCH_MAX_FAILURES", DEFAULT_MAX_FAILURES)
+        self.cooldown = cooldown or env_int("NC_WATCH_COOLDOWN", int(DEFAULT_COOLDOWN))
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.targets: Dict[str, Dict] = {}
+        # pidfd -> mount serviti dal processo; pid -> pidfd
+        self._pidfds: Dict[int, Set[str]] = {}
+        self._pid_fd: Dict[int, int] = {}
+        # Mount senza endpoint rc (riprovati al probe completo)
+        self._no_pid: Set[str] = set()
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=REMOUNT_WORKERS)
+
+    def _log(self, message: str) -> None:
+        print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+    # ===== pidfd dei processi rclone =====
+
+    def _watch_process(self, mount_point: str, poller: select.poll) -> None:
+        """Registra il pidfd del processo rclone che serve il mount (se noto)"""
+        if mount_point in self._no_pid or not hasattr(os, "pidfd_open"):
+            return
+        if any(mount_point in mount_points for mount_points in self._pidfds.values()):
+            return
+        from .mountstats import stats_endpoint
+        from .rclone_rc import RcloneRCError
+
+        client, _, _ = stats_endpoint(mount_point)
+        try:
+            if client is None:
+                raise KeyError(mount_point)
+            pid = client.pid()
+            fd = self._pid_fd.get(pid)
+            if fd is None:
+                fd = os.pidfd_open(pid)
+                poller.register(fd, select.POLLIN)
+                self._pid_fd[pid] = fd
+                self._pidfds[fd] = set()
+        except (RcloneRCError, OSError, KeyError, ValueError):
+            self._no_pid.add(mount_point)
+            return
+        self._pidfds[fd].add(mount_point)
+
+    def _process_exited(self, fd: int, poller: select.poll) -> Set[str]:
+        poller.unregister(fd)
+        os.close(fd)
+        for pid, pid_fd in list(self._pid_fd.items()):
+            if pid_fd == fd:
+                del self._pid_fd[pid]
+        return self._pidfds.pop(fd, set())
+
+    # ===== Remount =====
+
+    def _breaker(self, mount_point: str) -> CircuitBreaker:
+        breaker = self.breakers.get(mount_point)
+        if breaker is None:
+            breaker = CircuitBreaker(self.max_failures, self.cooldown)
+            self.breakers[mount_point] = breaker
+        return breaker
+
+    def _remount(self, mount_point: str, state: str) -> None:
+        spec = self.targets[mount_point]
+        try:
+            if state in ("stale", "hung"):
+                # Endpoint FUSE orfano: smontaggio lazy prima del nuovo mount
+                run(["fusermount", "-uz", mount_point], check=False)
+                get_mount_table().refresh()
+            ok = self._remount_owned(mount_point, spec)
+        except Exception as e:
+            self._log(f"❌ {mount_point}: {e}")
+            ok = False
+
+        with self._lock:
+            breaker = self._breaker(mount_point)
+            if ok:
+                breaker.record_success()
+                self._no_pid.discard(mount_point)
+                self._log(f"✅ {mount_point} rimontato")
+            else:
+                breaker.record_failure(time.time())
+                wait = max(breaker.next_attempt - time.time(), 0)
+                self._log(f"⚠️ {mount_point}: remount fallito ({breaker.failures}), "
+                          f"{'circuito aperto' if breaker.state == 'open' else 'retry'} tra {wait:.0f}s")
+            self._in_flight.discard(mount_point)
+
+    def _remount_owned(self, mount_point: str, spec: Dict) -> bool:
+        """Rimonta tramite il proprietario del mount (unit, supervisore o nessuno)"""
+        owner = spec.get("owner")
+        if owner == "unit":
+            # Un secondo rclone fuori dalla unit andrebbe in conflitto con Restart=
+            from .mount import MOUNT_READY_TIMEOUT
+            from .systemd import SystemdManager
+            restarted = SystemdManager().run_jobs("restart", [spec["unit"]])
+            return restarted.get(spec["unit"], False) and wait_for_mount(
+                mount_point, timeout=MOUNT_READY_TIMEOUT)
+        if owner == "supervisor":
+            from .supervisor import MountSupervisor
+            return MountSupervisor().remount(mount_point)
+        result = self.manager.mount_user_home(
+            spec["username"], "", home_path=mount_point,
+            profile=spec["profile"], configure_remote=False,
+        )
+        return result.get("success", False)
+
+    def _handle(self, mount_point: str, state: str) -> None:
+        now = time.time()
+        with self._lock:
+            breaker = self._breaker(mount_point)
+            if state == "ok":
+                if breaker.failures:
+                    self._log(f"✅ {mount_point} di nuovo attivo")
+                breaker.record_success()
+                return
+            if mount_point in self._in_flight or not breaker.allow(now):
+                return
+            self._in_flight.add(mount_point)
+        self._log(f"🔴 {mount_point}: {state}, remount ({breaker.state})")
+        self._executor.submit(self._remount, mount_point, state)
+
+    def check(self, mount_points: List[str], stat: bool) -> Dict[str, str]:
+        """
+        Controlla i mount indicati e avvia i remount
+
+        Con stat=False si verifica solo la presenza in mountinfo: un mount
+        presente non conta come sano (potrebbe essere stale).
+        """
+        states = {}
+        for mount_point in mount_points:
+            if mount_point in self._in_flight:
+                continue
+            if stat:
+                state = probe_mount(mount_point, self.stat_timeout)
+            elif get_mount_table().is_mounted(mount_point):
+                continue
+            else:
+                state = "missing"
+            states[mount_point] = state
+            self._handle(mount_point, state)
+        return states
+
+    # ===== Ciclo eventi =====
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """Ciclo bloccante: poll() su mountinfo e pidfd rclone"""
+        table = get_mount_table()
+        poller = select.poll()
+        # Descrittore mountinfo riservato al watcher: i worker di remount
+        # (wait_for_mount) e snapshot() non possono consumarne gli eventi
+        notifier = table.notifier()
+        table_fd = notifier.fileno()
+        if table_fd is not None:
+            poller.register(table_fd, select.POLLPRI | select.POLLERR)
+
+        try:
+            self.targets = self.manager.expected_mounts()
+            self._log(f"👀 Watcher attivo su {len(self.targets)} mount")
+            self.check(list(self.targets), stat=True)
+            next_probe = time.monotonic() + self.probe_interval
+
+            while not self._stop.is_set():
+                for mount_point in self.targets:
+                    if table.is_mounted(mount_point):
+                        self._watch_process(mount_point, poller)
+
+                # Risveglio al prossimo probe o al prossimo retry in back-off
+                wake = next_probe
+                with self._lock:
+                    pending = [b.next_attempt for b in self.breakers.values() if b.failures]
+                if pending:
+                    wake = min(wake, time.monotonic() + max(min(pending) - time.time(), 0))
+                timeout_ms = max(int((wake - time.monotonic()) * 1000), 0)
+                # Con mountinfo non disponibile il poll fa da semplice timer
+                events = poller.poll(min(timeout_ms, 1000) if table_fd is None else timeout_ms)
+                if self._stop.is_set():
+                    break
+
+                to_stat: Set[str] = set()
+                # Un evento su mountinfo serve solo a risvegliare il ciclo:
+                # snapshot() rilegge da sé, la tabella ha il proprio descrittore
+                for fd, _ in events:
+                    if fd in self._pidfds:
+                        exited = self._process_exited(fd, poller)
+                        self._log(f"💀 processo rclone terminato: {', '.join(sorted(exited)) or '?'}")
+                        # Nuovo pidfd solo dopo il remount (o al prossimo probe completo)
+                        self._no_pid |= exited
+                        to_stat |= exited
+
+                if time.monotonic() >= next_probe:
+                    # Probe completo: ricarica anche i mount attesi (nuovi tenant, unit rimosse)
+                    self.targets = self.manager.expected_mounts()
+                    self._no_pid.clear()
+                    self.check(list(self.targets), stat=True)
+                    next_probe = time.monotonic() + self.probe_interval
+                    continue
+
+                # Retry in back-off scaduti: ricontrollati con stat()
+                now = time.time()
+                with self._lock:
+                    to_stat |= {mp for mp, b in self.breakers.items() if b.failures and b.allow(now)}
+                to_stat &= set(self.targets)
+                self.check(sorted(to_stat), stat=True)
+                self.check([mp for mp in self.targets if mp not in to_stat], stat=False)
+        finally:
+            notifier.close()
+            self._executor.shutdown(wait=False)
@@ -22,6 +22,23 @@ except Exception as e:
 # Test core modules v1.0 (solo quelli mantenuti)
 core_modules = [
     'ncwrap.api',
+    'ncwrap.client',
+    'ncwrap.aioapi',
+    'ncwrap.davxml',
+    'ncwrap.ratelimit',
+    'ncwrap.bulk',
+    'ncwrap.transfer',
+    'ncwrap.index',
+    'ncwrap.cache',
+    'ncwrap.rclone_rc',
+    'ncwrap.supervisor',
+    'ncwrap.mountstats',
+    'ncwrap.metrics',
+    'ncwrap.exporter',
+    'ncwrap.tuner',
+    'ncwrap.mounttable',
+    'ncwrap.watcher',
+    'ncwrap.systemd_dbus',
     'ncwrap.utils', 
     'ncwrap.system',
     'ncwrap.systemd',